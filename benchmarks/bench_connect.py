@@ -0,0 +1,40 @@
+#Measure the time taken to connect to each of many provenance databases attached to the same connection
+#The connect time should remain flat as the number of attached databases grows
+#Usage: python bench_connect.py [ndb]
+import sys
+import os
+import time
+import tempfile
+import duckdb
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+
+tables = ['ad_models', 'anomalies', 'call_stack_events', 'call_stack_labels', 'call_stacks', 'exec_window_events', 'exec_windows',
+          'func_anomaly_count_stats', 'func_anomaly_severity_stats', 'func_runtime_profile_exclusive_stats',
+          'func_runtime_profile_inclusive_stats', 'functions', 'io_steps', 'node_state', 'normal_execs', 'rank_node_map']
+
+#Write a database containing empty versions of the provenance tables
+def makeDatabase(path):
+    con = duckdb.connect(path)
+    for t in tables:
+        con.sql("CREATE TABLE %s (pid BIGINT, rid BIGINT, fid BIGINT, event_id VARCHAR)" % t)
+    con.close()
+
+if __name__ == "__main__":
+    ndb = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    d = tempfile.mkdtemp()
+    paths = [ os.path.join(d, "db%d.duckdb" % i) for i in range(ndb) ]
+    for p in paths:
+        makeDatabase(p)
+
+    con = ProvenanceDatabaseConnection()
+    times = []
+    for p in paths:
+        t = time.perf_counter()
+        pdb = con.connect(p, quiet=True)
+        pdb.anomalies
+        times.append(time.perf_counter() - t)
+
+    print("%10s %16s" % ("attached", "connect (ms)"))
+    for i in sorted(set([0, ndb//4, ndb//2, 3*ndb//4, ndb-1])):
+        print("%10d %16.2f" % (i+1, 1e3*times[i]))
+    print("total %.2f s" % sum(times))
@@ -0,0 +1,57 @@
+#Compare per-run analyses (one query per run, combined in python) against a single federated query over all runs
+#Usage: python bench_federation.py [nrun ...]
+import sys
+import os
+import time
+import tempfile
+import numpy
+import duckdb
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+
+#Write a database containing the tables used by topFunctions, getApplicationProfile and getCallStackSummaries
+def makeDatabase(path, seed, nfunc = 1000, nanom = 20000):
+    con = duckdb.connect(path)
+    con.sql("CREATE TABLE functions AS SELECT 0 AS pid, range AS fid, 'func_' || range AS name FROM range(%d)" % nfunc)
+    #Anomaly counts and severities are bounded by the execution counts and runtimes
+    for t, cnt, acc in [('func_anomaly_count_stats', 100, 1000), ('func_anomaly_severity_stats', 100, 1000000),
+                        ('func_runtime_profile_exclusive_stats', 10000, 10000000), ('func_runtime_profile_inclusive_stats', 10000, 20000000)]:
+        con.sql("CREATE TABLE %s AS SELECT 0 AS pid, range AS fid, %d + hash(range, %d) %% %d AS count, \
+(%d + hash(range, %d, '%s') %% %d)::DOUBLE AS accumulate FROM range(%d)" % (t,cnt,seed,cnt,acc,seed,t,acc,nfunc))
+    con.sql("CREATE TABLE anomalies AS SELECT '0:' || range AS event_id, 0 AS pid, hash(range, %d) %% %d AS fid, \
+(hash(range, %d, 1) %% 10000)::DOUBLE AS outlier_severity FROM range(%d)" % (seed,nfunc,seed,nanom))
+    con.sql("CREATE TABLE call_stack_labels AS SELECT event_id, hash(fid, hash(event_id) % 3) AS call_stack_label FROM anomalies")
+    con.close()
+
+def timeit(f):
+    t = time.perf_counter()
+    f()
+    return time.perf_counter() - t
+
+def perRun(dbs):
+    tf = numpy.concatenate([ db.topFunctions().fetchnumpy()['fid'] for db in dbs ])
+    prof = numpy.concatenate([ db.getApplicationProfile('exclusive').fetchnumpy()['fid'] for db in dbs ])
+    css = numpy.concatenate([ db.getCallStackSummaries(0).fetchnumpy()['call_stack_label'] for db in dbs ])
+    return tf, prof, css
+
+def federated(fed):
+    tf = fed.topFunctions().fetchnumpy()['fid']
+    prof = fed.getApplicationProfile('exclusive').fetchnumpy()['fid']
+    css = fed.getCallStackSummaries(0).fetchnumpy()['call_stack_label']
+    return tf, prof, css
+
+if __name__ == "__main__":
+    nruns = [ int(a) for a in sys.argv[1:] ] if len(sys.argv) > 1 else [2, 16, 64]
+    d = tempfile.mkdtemp()
+    paths = [ os.path.join(d, "run%d.duckdb" % i) for i in range(max(nruns)) ]
+    for i, p in enumerate(paths):
+        makeDatabase(p, i)
+
+    print("%6s %14s %16s %10s" % ("runs", "per-run (s)", "federated (s)", "speedup"))
+    for n in nruns:
+        con = ProvenanceDatabaseConnection()
+        dbs = [ con.connect(p, quiet=True) for p in paths[:n] ]
+        fed = con.federate()
+        federated(fed) #create the views
+        tp = timeit(lambda: perRun(dbs))
+        tf = timeit(lambda: federated(fed))
+        print("%6d %14.3f %16.3f %9.1fx" % (n, tp, tf, tp/tf))
@@ -0,0 +1,45 @@
+#Compare the scalar per-function accessors against their batched equivalents
+#Usage: python bench_function_accessors.py [nfunc]
+import sys
+import os
+import time
+import tempfile
+import numpy
+import duckdb
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+
+#Write a database containing only the function tables used by the accessors
+def makeDatabase(path, nfunc):
+    con = duckdb.connect(path)
+    con.sql("CREATE TABLE functions AS SELECT 0 AS pid, range AS fid, 'func_' || range AS name FROM range(%d)" % nfunc)
+    for t in ['func_anomaly_count_stats', 'func_runtime_profile_exclusive_stats', 'func_runtime_profile_inclusive_stats']:
+        con.sql("CREATE TABLE %s AS SELECT 0 AS pid, range AS fid, range %% 1000 AS count, (range * 1.5)::DOUBLE AS accumulate, 1.5::DOUBLE AS mean FROM range(%d)" % (t,nfunc))
+    con.sql("CREATE TABLE ad_models AS SELECT 0 AS pid, range AS fid, 1.0::DOUBLE AS bin_width, 0.0::DOUBLE AS first_edge, [1.0, 2.0, 3.0]::DOUBLE[] AS bin_counts FROM range(%d)" % nfunc)
+    con.close()
+
+def timeit(f):
+    t = time.perf_counter()
+    f()
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    nfunc = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    path = os.path.join(tempfile.mkdtemp(), "bench_function_accessors.duckdb")
+    makeDatabase(path, nfunc)
+
+    con = ProvenanceDatabaseConnection()
+    pdb = con.connect(path)
+    fids = numpy.random.default_rng(1234).permutation(nfunc)
+
+    cases = [
+        ("name", lambda: [pdb.getFunctionName(f) for f in fids], lambda: pdb.getFunctionNames(fids)),
+        ("anomaly count", lambda: [pdb.getFunctionAnomalyCount(f) for f in fids], lambda: pdb.getFunctionAnomalyCounts(fids)),
+        ("execution count", lambda: [pdb.getFunctionExecutionCount(f) for f in fids], lambda: pdb.getFunctionExecutionCounts(fids)),
+        ("profile", lambda: [pdb.getFunctionProfile(f, 'exclusive').fetchnumpy() for f in fids], lambda: pdb.getFunctionProfiles(fids, 'exclusive').fetchnumpy()),
+        ("AD model histogram", lambda: [pdb.getFunctionADmodelHistogram(f) for f in fids], lambda: pdb.getFunctionADmodelHistograms(fids)),
+    ]
+    print("%-20s %12s %12s %10s" % ("accessor", "scalar (s)", "batched (s)", "speedup"))
+    for nm, scalar, batched in cases:
+        ts = timeit(scalar)
+        tb = timeit(batched)
+        print("%-20s %12.3f %12.4f %9.0fx" % (nm, ts, tb, ts/tb))
@@ -0,0 +1,48 @@
+#Measure the cold-start import time of the package, as paid by every batch worker process, and check it against a budget
+#Each statement is timed in a fresh interpreter (the minimum over --repeat runs), and the modules that must not be loaded by it are
+#checked, e.g. plotly must not be imported until a chart is built
+#Usage: python bench_import.py [--repeat 5] [--budget 0.5]
+#The exit code is 1 if a statement exceeds the budget or loads a forbidden module
+import sys
+import json
+import argparse
+import subprocess
+
+#The statements: name -> (statement, budget factor, modules that must not be loaded). The budget of a statement is its factor
+#times --budget
+statements = {
+    "import chimbuko_offline_analysis" : ("import chimbuko_offline_analysis", 1.0, ["plotly", "pyarrow"]),
+    "batch worker" : ("import chimbuko_offline_analysis.batch", 1.0, ["plotly"]),
+    "visualization package" : ("import chimbuko_offline_analysis.visualization", 1.0, ["plotly"]),
+    "chart module" : ("import chimbuko_offline_analysis.visualization.lollipop", None, []),
+}
+
+#Time the statement in a fresh interpreter, returning the time in seconds and the forbidden modules that were loaded
+def measure(stmt, forbidden):
+    code = "import sys, time, json\nt = time.perf_counter()\n%s\nt = time.perf_counter() - t\n\
+print(json.dumps([t, [ m for m in %r if m in sys.modules ]]))" % (stmt, forbidden)
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5, help="the import time budget in seconds")
+    opts = parser.parse_args()
+
+    failures = []
+    print("%-30s %10s %10s  %s" % ("statement", "time (s)", "budget (s)", "forbidden modules loaded"))
+    for name, (stmt, factor, forbidden) in statements.items():
+        best = None
+        loaded = []
+        for i in range(opts.repeat):
+            t, loaded = measure(stmt, forbidden)
+            best = t if best is None else min(best, t)
+        budget = None if factor is None else factor * opts.budget
+        if (budget is not None and best > budget) or len(loaded) > 0:
+            failures.append(name)
+        print("%-30s %10.4f %10s  %s" % (name, best, "-" if budget is None else "%.4f" % budget, ", ".join(loaded) if len(loaded) > 0 else "-"))
+
+    if len(failures) > 0:
+        print("\nOver budget or loading forbidden modules: %s" % ", ".join(failures))
+        sys.exit(1)
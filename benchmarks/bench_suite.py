@@ -0,0 +1,187 @@
+#Time every public ProvenanceDatabase method and the chart builders on synthetic provenance databases at several scales, and
+#report regressions against a stored baseline
+#Usage:
+#  python bench_suite.py [--scales small,medium] [--repeat 3] [--baseline baseline.json] [--save-baseline baseline.json] [--threshold 1.25]
+#The databases are generated once into --data-dir (default: a directory in the system temporary directory) and reused
+#The exit code is 1 if any case is slower than the baseline by more than the threshold
+#Baseline timings are specific to the machine on which they were recorded; regenerate with --save-baseline after changing machine
+import sys
+import os
+import json
+import time
+import argparse
+import collections.abc
+import tempfile
+import numpy
+import duckdb
+import plotly.io
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+from chimbuko_offline_analysis.synthetic import generateProvenanceDatabase
+from chimbuko_offline_analysis.visualization.lollipop import CallStackSummariesComparison
+from chimbuko_offline_analysis.visualization.parallel_coords import AnomalySummary
+from chimbuko_offline_analysis.visualization import setRenderer
+
+#Generator parameters for each scale
+scales = {
+    "small" : dict(nrank=4, nfunc=50, nevent=10000),
+    "medium" : dict(nrank=16, nfunc=500, nevent=200000),
+    "large" : dict(nrank=64, nfunc=2000, nevent=2000000),
+}
+
+#Fully evaluate the result of a method such that lazily evaluated relations and generators are included in the timing
+def consume(r):
+    if isinstance(r, duckdb.DuckDBPyRelation):
+        return r.fetchnumpy()
+    if isinstance(r, collections.abc.Iterator):
+        return [ b for b in r ]
+    if isinstance(r, (list, tuple)):
+        return [ consume(x) for x in r ]
+    return r
+
+#Arguments shared by the cases, chosen from the database: the function with the most anomalies, one of its anomalous events and a call stack label
+def caseArguments(pdb):
+    fid = int(pdb("SELECT fid FROM %s ORDER BY accumulate DESC LIMIT 1" % pdb.func_anomaly_count_stats.get_sql()).fetchone()[0])
+    event_id = pdb("SELECT event_id FROM %s WHERE fid = %d ORDER BY event_id LIMIT 1" % (pdb.anomalies.get_sql(),fid)).fetchone()[0]
+    label = int(pdb("SELECT c.call_stack_label FROM %s AS c WHERE c.event_id = '%s'" % (pdb.call_stack_labels.get_sql(),event_id)).fetchone()[0])
+    fids = numpy.arange(int(pdb("SELECT COUNT(*) FROM %s" % pdb.functions.get_sql()).fetchone()[0]))
+    return dict(fid=fid, event_id=event_id, label=label, fids=fids)
+
+#The benchmark cases: name -> f(pdb, pdb2, args), where pdb2 is a second database of the same scale used for comparisons
+cases = {
+    "listTables" : lambda pdb, pdb2, a: pdb.listTables(),
+    "listColumnsAsArray" : lambda pdb, pdb2, a: pdb.listColumnsAsArray(pdb.anomalies),
+    "getFunctionName" : lambda pdb, pdb2, a: pdb.getFunctionName(a["fid"]),
+    "getFunctionAnomalyCount" : lambda pdb, pdb2, a: pdb.getFunctionAnomalyCount(a["fid"]),
+    "getFunctionExecutionCount" : lambda pdb, pdb2, a: pdb.getFunctionExecutionCount(a["fid"]),
+    "getFunctionADmodelHistogram" : lambda pdb, pdb2, a: pdb.getFunctionADmodelHistogram(a["fid"]),
+    "getFunctionNames" : lambda pdb, pdb2, a: pdb.getFunctionNames(a["fids"]),
+    "getFunctionAnomalyCounts" : lambda pdb, pdb2, a: pdb.getFunctionAnomalyCounts(a["fids"]),
+    "getFunctionExecutionCounts" : lambda pdb, pdb2, a: pdb.getFunctionExecutionCounts(a["fids"]),
+    "getFunctionProfiles" : lambda pdb, pdb2, a: pdb.getFunctionProfiles(a["fids"], 'exclusive'),
+    "getFunctionADmodelHistograms" : lambda pdb, pdb2, a: pdb.getFunctionADmodelHistograms(a["fids"]),
+    "loadADModels" : lambda pdb, pdb2, a: pdb.loadADModels(),
+    "rescoreEvents" : lambda pdb, pdb2, a: pdb.compareAnomalySets(pdb.rescoreEvents(10.0)),
+    "compareRuntimeDistributions" : lambda pdb, pdb2, a: pdb.compareRuntimeDistributions(pdb2),
+    "compareRuntimeDistributions(by_label)" : lambda pdb, pdb2, a: pdb.compareRuntimeDistributions(pdb2, by_label=True),
+    "getFunctionProfile" : lambda pdb, pdb2, a: pdb.getFunctionProfile(a["fid"], 'exclusive'),
+    "getApplicationProfile(exclusive)" : lambda pdb, pdb2, a: pdb.getApplicationProfile('exclusive'),
+    "getApplicationProfile(inclusive)" : lambda pdb, pdb2, a: pdb.getApplicationProfile('inclusive'),
+    "topFunctions" : lambda pdb, pdb2, a: pdb.topFunctions('anom_severity'),
+    "approxTopFunctions" : lambda pdb, pdb2, a: pdb.approxTopFunctions('anom_severity', fraction=0.1),
+    "refineTopFunctions" : lambda pdb, pdb2, a: pdb.refineTopFunctions(pdb.approxTopFunctions('anom_count', fraction=0.1, sampling="bernoulli"), 10, 'anom_count'),
+    "approxApplicationProfile" : lambda pdb, pdb2, a: pdb.approxApplicationProfile('exclusive', fraction=0.1),
+    "approxCallStackSummaries" : lambda pdb, pdb2, a: pdb.approxCallStackSummaries(0, fraction=0.1),
+    "scope:topFunctions" : lambda pdb, pdb2, a: pdb.scope(rids=[0], io_steps=(0, 4)).topFunctions('anom_severity'),
+    "scope:getFunctionEvents" : lambda pdb, pdb2, a: pdb.scope(rids=[0], io_steps=(0, 4)).getFunctionEvents(a["fid"], 'normal_execs'),
+    "getAnomalyTimes" : lambda pdb, pdb2, a: pdb.getAnomalyTimes(0, 0),
+    "getAnomalyTimes(fid)" : lambda pdb, pdb2, a: pdb.getAnomalyTimes(0, 0, a["fid"]),
+    "getAnomalyHeatmap" : lambda pdb, pdb2, a: pdb.getAnomalyHeatmap(0),
+    "getAnomalyHeatmap(by_function)" : lambda pdb, pdb2, a: pdb.getAnomalyHeatmap(0, by_function=True),
+    "getFunctionEvents(anomalies)" : lambda pdb, pdb2, a: pdb.getFunctionEvents(a["fid"], 'anomalies'),
+    "getFunctionEvents(normal_execs)" : lambda pdb, pdb2, a: pdb.getFunctionEvents(a["fid"], 'normal_execs'),
+    "getFunctionEvents(compact)" : lambda pdb, pdb2, a: pdb.getFunctionEvents(a["fid"], 'normal_execs', compact=True),
+    "iterFunctionEvents" : lambda pdb, pdb2, a: pdb.iterFunctionEvents(a["fid"], 'normal_execs', batch_size=100000),
+    "convertColumnToSecondsSinceStart" : lambda pdb, pdb2, a: pdb.convertColumnToSecondsSinceStart(pdb.anomalies, "entry", "entry_s"),
+    "getEventPrimaryTable" : lambda pdb, pdb2, a: pdb.getEventPrimaryTable(a["event_id"]),
+    "lookupEvents" : lambda pdb, pdb2, a: pdb.lookupEvents(pdb("SELECT event_id FROM %s" % pdb.anomalies.get_sql())),
+    "getEventExecWindow" : lambda pdb, pdb2, a: pdb.getEventExecWindow(a["event_id"]),
+    "getExecWindowEnrichment" : lambda pdb, pdb2, a: pdb.getExecWindowEnrichment([a["fid"]]),
+    "getExecWindowEnrichment(all)" : lambda pdb, pdb2, a: pdb.getExecWindowEnrichment(),
+    "getEventCallStack" : lambda pdb, pdb2, a: pdb.getEventCallStack(a["event_id"]),
+    "getEventNodeMemoryStatus" : lambda pdb, pdb2, a: pdb.getEventNodeMemoryStatus(a["event_id"]),
+    "getEventNodeCPUstatus" : lambda pdb, pdb2, a: pdb.getEventNodeCPUstatus(a["event_id"]),
+    "getEventsNodeStatus" : lambda pdb, pdb2, a: pdb.getEventsNodeStatus(pdb("SELECT event_id FROM %s" % pdb.anomalies.get_sql())),
+    "getLabeledCallStack" : lambda pdb, pdb2, a: pdb.getLabeledCallStack(a["label"]),
+    "getFunctionCallStackLabelsAndCounts" : lambda pdb, pdb2, a: pdb.getFunctionCallStackLabelsAndCounts(a["fid"], 'both'),
+    "getCallStackSummaries" : lambda pdb, pdb2, a: pdb.getCallStackSummaries(0),
+    "getCallStackLabelCounts" : lambda pdb, pdb2, a: pdb.getCallStackLabelCounts(subset='both'),
+    "getCallTree" : lambda pdb, pdb2, a: pdb.getCallTree(0),
+    "chart:CallStackSummariesComparison" : lambda pdb, pdb2, a: CallStackSummariesComparison(pdb, pdb2),
+    "chart:AnomalySummary" : lambda pdb, pdb2, a: AnomalySummary(pdb),
+    "chart:AnomalySummary(sample)" : lambda pdb, pdb2, a: AnomalySummary(pdb, sample=1000, stratify="rank_function"),
+    "chart:AnomalySummary(density)" : lambda pdb, pdb2, a: AnomalySummary(pdb, topn=None, density=True),
+}
+
+#Return the paths of the two databases of the given scale, generating them if necessary
+def databases(data_dir, scale):
+    paths = []
+    for seed in [1, 2]:
+        p = os.path.join(data_dir, "%s_%d.duckdb" % (scale,seed))
+        if not os.path.exists(p):
+            generateProvenanceDatabase(p + ".tmp", seed=seed, **scales[scale])
+            os.rename(p + ".tmp", p)
+        paths.append(p)
+    return paths
+
+#Time each case, returning the minimum over 'repeat' repetitions. Each repetition uses a fresh connection such that state cached
+#on the connection (e.g. the run start times) does not carry over
+def run(paths, repeat, select = None):
+    con = ProvenanceDatabaseConnection()
+    args = caseArguments(con.connect(paths[0], quiet=True))
+    times = dict()
+    for name, f in cases.items():
+        if select is not None and not any( s in name for s in select ):
+            continue
+        best = None
+        for i in range(repeat):
+            con = ProvenanceDatabaseConnection()
+            pdb = con.connect(paths[0], quiet=True)
+            pdb2 = con.connect(paths[1], quiet=True)
+            t = time.perf_counter()
+            consume(f(pdb, pdb2, args))
+            t = time.perf_counter() - t
+            best = t if best is None else min(best, t)
+        times[name] = best
+    return times
+
+#Rather than opening a browser, the charts are serialized as they would be for rendering
+def headlessShow(fig, *args, **kwargs):
+    fig.to_json()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default="small,medium", help="comma separated list of scales among %s" % ",".join(scales))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", default=None, help="comma separated list of substrings selecting the cases to run")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "chimbuko_bench"))
+    parser.add_argument("--baseline", default=None, help="compare against the timings in this file")
+    parser.add_argument("--save-baseline", default=None, help="write the timings to this file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio to the baseline beyond which a case is a regression")
+    parser.add_argument("--min-time", type=float, default=0.005, help="cases faster than this (in seconds) are never regressions")
+    opts = parser.parse_args()
+
+    plotly.io.show = headlessShow
+    setRenderer("browser")
+    os.makedirs(opts.data_dir, exist_ok=True)
+    baseline = dict()
+    if opts.baseline is not None:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    results = dict()
+    regressions = []
+    for scale in opts.scales.split(","):
+        paths = databases(opts.data_dir, scale)
+        results[scale] = run(paths, opts.repeat, None if opts.cases is None else opts.cases.split(","))
+        base = baseline.get(scale, dict())
+        print("\n%s (%s)" % (scale, ", ".join("%s=%s" % kv for kv in scales[scale].items())))
+        print("%-40s %12s %12s %8s" % ("case", "time (s)", "baseline (s)", "ratio"))
+        for name, t in results[scale].items():
+            if name in base:
+                ratio = t / base[name]
+                flag = ratio > opts.threshold and t > opts.min_time
+                if flag:
+                    regressions.append((scale, name, ratio))
+                print("%-40s %12.4f %12.4f %7.2fx%s" % (name, t, base[name], ratio, "  REGRESSION" if flag else ""))
+            else:
+                print("%-40s %12.4f %12s %8s" % (name, t, "-", "-"))
+
+    if opts.save_baseline is not None:
+        with open(opts.save_baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if len(regressions) > 0:
+        print("\n%d regression(s):" % len(regressions))
+        for scale, name, ratio in regressions:
+            print("  %s %s %.2fx" % (scale, name, ratio))
+        sys.exit(1)
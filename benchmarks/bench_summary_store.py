@@ -0,0 +1,30 @@
+#Compare the time to produce the summary analyses in a new session with and without a persistent summary store
+#Usage: python bench_summary_store.py [nfunc] [nanom]
+import sys
+import os
+import time
+import tempfile
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+from bench_federation import makeDatabase
+
+def session(path, summaries):
+    t = time.perf_counter()
+    con = ProvenanceDatabaseConnection()
+    pdb = con.connect(path, quiet=True, summaries=summaries)
+    for o in ['anom_severity', 'anom_count', 'total_time_excl']:
+        pdb.topFunctions(o).fetchnumpy()
+    pdb.getApplicationProfile('exclusive').fetchnumpy()
+    pdb.getApplicationProfile('inclusive').fetchnumpy()
+    pdb.getCallStackSummaries(0).fetchnumpy()
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    nfunc = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nanom = int(sys.argv[2]) if len(sys.argv) > 2 else 5000000
+    path = os.path.join(tempfile.mkdtemp(), "run.duckdb")
+    makeDatabase(path, 0, nfunc, nanom)
+
+    print("%-28s %10s" % ("session", "time (s)"))
+    print("%-28s %10.3f" % ("no store", session(path, False)))
+    print("%-28s %10.3f" % ("store (first, building)", session(path, True)))
+    print("%-28s %10.3f" % ("store (reopened)", session(path, True)))
@@ -1,2 +1,14 @@
+import importlib
 from .provenance_database import *
-from . import visualization
+
+#The submodules that are not needed by ProvenanceDatabase are imported on first access, e.g. chimbuko_offline_analysis.visualization,
+#such that importing the package (and starting a batch worker) does not load the chart dependencies
+_lazy_submodules = ["visualization", "batch", "synthetic"]
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + _lazy_submodules)
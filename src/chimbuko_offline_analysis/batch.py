@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import html
+import decimal
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from .optional import requirePyarrow
+
+#Batch analysis of many provenance databases
+#The chosen analyses are run on each database in a separate worker process (one database per worker, each with its own
+#ProvenanceDatabaseConnection and hence its own DuckDB instance and memory budget). The results are returned as Arrow tables,
+#labeled by run, and merged into a single output file written as JSON, HTML or Parquet. No charts are rendered, such that the
+#batch can be run headless
+#
+#From the command line:
+#   chimbuko-batch run1.duckdb run2.duckdb ... -o report.parquet [--analyses topFunctions,heatmap] [--processes 8]
+#or from Python via runBatch(paths, output)
+
+#The analyses: name -> f(pdb, opts) returning a relation or an Arrow table. 'opts' is a dictionary of options (pid, nbins, order_by)
+analyses = {
+    "topFunctions" : lambda pdb, o: pdb.topFunctions(o.get("order_by", "anom_severity")),
+    "applicationProfileExclusive" : lambda pdb, o: pdb.getApplicationProfile("exclusive"),
+    "applicationProfileInclusive" : lambda pdb, o: pdb.getApplicationProfile("inclusive"),
+    "callStackSummaries" : lambda pdb, o: pdb.getCallStackSummaries(o.get("pid", 0)),
+    "heatmap" : lambda pdb, o: heatmapTable(pdb.getAnomalyHeatmap(o.get("pid", 0), o.get("nbins", 100)), o.get("pid", 0)),
+}
+
+#Convert the output of getAnomalyHeatmap into a table of the non-empty (rank, time bin) cells
+def heatmapTable(hm, pid):
+    pa = requirePyarrow("Batch analysis")
+    rid, b = numpy.nonzero(hm["count"])
+    return pa.table({ "pid" : numpy.full(len(rid), pid, dtype=numpy.int64), "rid" : rid.astype(numpy.int64), "bin" : b.astype(numpy.int64),
+                      "t_start" : hm["edges"][b], "t_end" : hm["edges"][b+1],
+                      "count" : hm["count"][rid, b], "severity" : hm["severity"][rid, b] })
+
+#Run the analyses 'names' on the database at 'path', returning (path, { name : Arrow table }, error). Executed in a worker process
+def analyzeDatabase(path, names, opts):
+    pa = requirePyarrow("Batch analysis")
+    from .provenance_database import ProvenanceDatabaseConnection
+    try:
+        con = ProvenanceDatabaseConnection()
+        pdb = con.connect(path, quiet=True, summaries=opts.get("summaries", False))
+        out = dict()
+        for n in names:
+            r = analyses[n](pdb, opts)
+            out[n] = r if isinstance(r, pa.Table) else r.arrow()
+        return path, out, None
+    except Exception:
+        return path, None, traceback.format_exc()
+
+#Run the analyses on each database in a process pool and merge the results
+#paths : the database files
+#names : the analyses to run (default: all), see 'analyses'
+#processes : the number of worker processes (default: the number of CPUs)
+#opts : options passed to the analyses: pid, nbins, order_by, and summaries (use the persistent summary store of each database)
+#Return ({ name : Arrow table }, { path : error }) where the tables contain the results of all runs with additional columns
+#"run" (the database path) and "run_idx" (its index in 'paths')
+def analyzeDatabases(paths, names = None, processes = None, opts = None):
+    pa = requirePyarrow("Batch analysis")
+    names = list(analyses) if names is None else list(names)
+    for n in names:
+        if n not in analyses:
+            raise Exception("Unknown analysis %s, expected one of %s" % (n, ", ".join(analyses)))
+    opts = dict() if opts is None else opts
+    results = { n : [] for n in names }
+    errors = dict()
+    #Worker processes are spawned rather than forked such that they do not inherit any DuckDB state
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as ex:
+        futures = [ ex.submit(analyzeDatabase, p, names, opts) for p in paths ]
+        for i, f in enumerate(futures):
+            path, out, err = f.result()
+            if err is not None:
+                errors[path] = err
+                continue
+            for n, t in out.items():
+                t = t.add_column(0, "run_idx", pa.array(numpy.full(t.num_rows, i, dtype=numpy.int64)))
+                results[n].append(t.add_column(0, "run", pa.array([path] * t.num_rows, type=pa.string())))
+    merged = dict()
+    for n, ts in results.items():
+        if len(ts) > 0:
+            merged[n] = pa.concat_tables(ts, promote_options="default")
+    return merged, errors
+
+def _jsonValue(v):
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if isinstance(v, numpy.generic):
+        return v.item()
+    return str(v)
+
+#Write the merged results to a single file. The format is "json", "html" or "parquet"
+#  json : an object mapping each analysis to its list of rows
+#  html : a static page with a table for each analysis
+#  parquet : a single table of all analyses with an "analysis" column; columns absent from an analysis are null
+def writeResults(results, path, fmt):
+    pa = requirePyarrow("Batch analysis")
+    if fmt == "json":
+        with open(path, "w") as f:
+            json.dump({ n : t.to_pylist() for n, t in results.items() }, f, default=_jsonValue)
+    elif fmt == "html":
+        with open(path, "w") as f:
+            f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Chimbuko batch analysis</title></head><body>\n")
+            for n, t in results.items():
+                f.write("<h2>%s</h2>\n<table border=\"1\">\n<tr>%s</tr>\n" % (html.escape(n), "".join("<th>%s</th>" % html.escape(c) for c in t.column_names)))
+                for row in t.to_pylist():
+                    f.write("<tr>%s</tr>\n" % "".join("<td>%s</td>" % html.escape("" if v is None else str(v)) for v in row.values()))
+                f.write("</table>\n")
+            f.write("</body></html>\n")
+    elif fmt == "parquet":
+        import pyarrow.parquet
+        ts = []
+        for n, t in results.items():
+            #Decimal columns of different scales cannot be merged, hence they are stored as doubles
+            t = t.cast(pa.schema([ pa.field(f.name, pa.float64()) if pa.types.is_decimal(f.type) else f for f in t.schema ]))
+            ts.append(t.add_column(0, "analysis", pa.array([n] * t.num_rows, type=pa.string())))
+        pyarrow.parquet.write_table(pa.concat_tables(ts, promote_options="default"), path)
+    else:
+        raise Exception("Invalid format %s" % fmt)
+    return path
+
+#Analyze the databases and write the merged results to 'output', with the format inferred from its extension if not given
+def runBatch(paths, output, names = None, fmt = None, processes = None, opts = None):
+    if fmt is None:
+        fmt = os.path.splitext(output)[1].lstrip(".").lower()
+    if fmt not in ("json", "html", "parquet"):
+        raise Exception("Could not determine the output format, use one of json, html, parquet")
+    results, errors = analyzeDatabases(paths, names, processes, opts)
+    writeResults(results, output, fmt)
+    return errors
+
+#The console entry point "chimbuko-batch"
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="chimbuko-batch", description="Run analyses on many provenance databases in parallel and merge the results into a single report")
+    parser.add_argument("databases", nargs="+", help="the provenance database files")
+    parser.add_argument("-o", "--output", required=True, help="the output file (.json, .html or .parquet)")
+    parser.add_argument("--format", default=None, choices=["json", "html", "parquet"], help="the output format (default: from the output file extension)")
+    parser.add_argument("--analyses", default=",".join(analyses), help="comma separated list of analyses among %s" % ",".join(analyses))
+    parser.add_argument("--processes", type=int, default=None, help="the number of worker processes (default: the number of CPUs)")
+    parser.add_argument("--pid", type=int, default=0, help="the program index for the call stack summaries and heatmap")
+    parser.add_argument("--nbins", type=int, default=100, help="the number of time bins of the heatmap")
+    parser.add_argument("--order-by", default="anom_severity", choices=["anom_severity", "anom_count", "total_time_excl"], help="the sort order of topFunctions")
+    parser.add_argument("--summaries", action="store_true", help="use the persistent summary store of each database")
+    args = parser.parse_args(argv)
+
+    opts = { "pid" : args.pid, "nbins" : args.nbins, "order_by" : args.order_by, "summaries" : args.summaries }
+    errors = runBatch(args.databases, args.output, args.analyses.split(","), args.format, args.processes, opts)
+    for path, err in errors.items():
+        print("Analysis of %s failed:\n%s" % (path, err), file=sys.stderr)
+    return 1 if len(errors) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
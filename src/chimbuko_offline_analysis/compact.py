@@ -0,0 +1,53 @@
+import duckdb
+from .optional import requirePyarrow
+
+#Compact results. Rather than converting a result to numpy arrays (with strings as arrays of Python objects and all integers
+#as int64), the result is fetched from DuckDB as an Arrow table, which does not copy the data, and compacted:
+#  - string columns with many repeated values (function names, hostnames, ...) are dictionary encoded, such that each value is
+#    stored once. Columns of mostly distinct values, e.g. event ids, are left as they are, as encoding them would only add the
+#    indices to the values
+#  - integer columns are cast to the narrowest integer type that holds their values
+#The sizes of the table before and after compaction are recorded in the schema metadata (see compactionReport)
+#Requires pyarrow
+
+#Return the narrowest integer type holding the values in [lo, hi]
+def narrowestIntegerType(pa, lo, hi):
+    if lo >= 0:
+        for t, m in [ (pa.uint8(), 2**8), (pa.uint16(), 2**16), (pa.uint32(), 2**32) ]:
+            if hi < m:
+                return t
+        return pa.uint64()
+    for t, m in [ (pa.int8(), 2**7), (pa.int16(), 2**15), (pa.int32(), 2**31) ]:
+        if lo >= -m and hi < m:
+            return t
+    return pa.int64()
+
+#Compact a relation or Arrow table
+#dictionary : dictionary encode the string columns whose number of distinct values is at most 'max_distinct_fraction' times their length
+#downcast : cast the integer columns to the narrowest type holding their values
+def compactTable(result, dictionary = True, downcast = True, max_distinct_fraction = 0.5):
+    pa = requirePyarrow("Compact results")
+    import pyarrow.compute as pc
+    tab = result.arrow() if isinstance(result, duckdb.DuckDBPyRelation) else result
+    before = tab.nbytes
+    cols = []
+    for name, col in zip(tab.column_names, tab.columns):
+        t = col.type
+        if dictionary and (pa.types.is_string(t) or pa.types.is_large_string(t)):
+            if pc.count_distinct(col, mode="all").as_py() <= max_distinct_fraction * col.length():
+                col = col.dictionary_encode()
+        elif downcast and pa.types.is_integer(t) and col.length() > col.null_count:
+            mm = pc.min_max(col)
+            col = col.cast(narrowestIntegerType(pa, mm["min"].as_py(), mm["max"].as_py()))
+        cols.append(col)
+    out = pa.table(cols, names=tab.column_names)
+    meta = dict(tab.schema.metadata or {})
+    meta.update({ b"chimbuko.bytes_before" : str(before).encode(), b"chimbuko.bytes_after" : str(out.nbytes).encode() })
+    return out.replace_schema_metadata(meta)
+
+#Return the sizes in bytes of a compacted table before and after compaction and their ratio, as a dictionary
+def compactionReport(tab):
+    meta = tab.schema.metadata or {}
+    before = int(meta.get(b"chimbuko.bytes_before", tab.nbytes))
+    after = int(meta.get(b"chimbuko.bytes_after", tab.nbytes))
+    return { "bytes_before" : before, "bytes_after" : after, "ratio" : after / before if before > 0 else 1.0 }
@@ -0,0 +1,40 @@
+import asyncio
+import functools
+import duckdb
+from .optional import requirePyarrow
+
+#Support for running analyses concurrently on a ProvenanceDatabaseConnection
+#Each thread executes queries on its own DuckDB cursor (see ProvenanceDatabaseConnection.cursor). As relations are evaluated
+#lazily and bound to the cursor of the thread that created them, results produced on a worker thread are materialized
+#there (as Arrow tables) and handed back to the calling thread as a relation on its own cursor.
+
+#Materialize the result of an analysis method on the thread that produced it
+def materialize(result):
+    if isinstance(result, duckdb.DuckDBPyRelation):
+        return _Materialized(result.arrow())
+    return result
+
+class _Materialized:
+    def __init__(self, tab):
+        self.tab = tab
+
+#Run f(*args, **kwargs) on the connection's thread pool and return the result, with relations re-bound to the calling thread's cursor
+async def runAsync(pdb_con, f, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    r = await loop.run_in_executor(pdb_con.executor(), functools.partial(_call, f, args, kwargs))
+    if isinstance(r, _Materialized):
+        return pdb_con.cursor().from_arrow(r.tab)
+    return r
+
+def _call(f, args, kwargs):
+    return materialize(f(*args, **kwargs))
+
+#Return a coroutine function wrapping the method 'f' of an analysis object, used to provide the "<method>_async" variants
+#e.g. await pdb.topFunctions_async('anom_count')
+def asyncMethod(pdb_con, f):
+    requirePyarrow("Asynchronous methods")
+
+    @functools.wraps(f)
+    async def wrapper(*args, **kwargs):
+        return await runAsync(pdb_con, f, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,135 @@
+import duckdb
+import pypika
+from pypika import *
+from .concurrency import asyncMethod
+
+#A federation of several attached provenance databases (runs), for analyses spanning many runs in a single query
+#Each table is exposed as a view that is the UNION ALL of that table over all runs, with additional columns:
+#  run : the label of the run
+#  run_idx : the index of the run in the federation
+#The views are created lazily on first access, e.g. fed.anomalies
+#The small per-function summary tables are instead materialized in memory on first access, as scanning a union over many
+#attached catalogs carries a fixed cost per catalog for every query
+#
+#Obtain from ProvenanceDatabaseConnection.federate()
+class FederatedProvenanceDatabase:
+    summary_tables = ['functions', 'func_anomaly_count_stats', 'func_anomaly_severity_stats', 'func_runtime_profile_exclusive_stats',
+                      'func_runtime_profile_inclusive_stats', 'rank_node_map', 'io_steps', 'ad_models']
+
+    #pdb_con : the ProvenanceDatabaseConnection
+    #dbs : the list of ProvenanceDatabase in the federation
+    #runs : the labels of the runs (default: the database catalog names)
+    #prefix : the prefix of the federated view names
+    #materialize : the tables that are materialized rather than exposed as views (default: summary_tables)
+    def __init__(self, pdb_con, dbs, runs = None, prefix = "__fed", materialize = None):
+        if len(dbs) == 0:
+            raise Exception("A federation requires at least one database")
+        if runs is None:
+            runs = [ db.db_nm for db in dbs ]
+        if len(runs) != len(dbs):
+            raise Exception("The number of run labels must match the number of databases")
+        self.pdb_con = pdb_con
+        self.dbs = list(dbs)
+        self.runs = [ str(r) for r in runs ]
+        self.prefix = prefix
+        self.materialize = self.summary_tables if materialize is None else materialize
+        self._views = dict()
+
+    def __call__(self, query : pypika.queries.QueryBuilder) -> duckdb.duckdb.DuckDBPyRelation:
+        return self.pdb_con(query)
+
+    #Return the federated view of the given table, creating it if necessary
+    def view(self, name) -> Table:
+        with self.pdb_con.lock:
+            if name not in self._views:
+                self._createView(name)
+        return self._views[name]
+
+    #Create the federated view/table of the given table. Must be called with the connection lock held
+    def _createView(self, name):
+        sel = []
+        for i, (db, run) in enumerate(zip(self.dbs, self.runs)):
+            if name not in db.tableNames():
+                raise Exception("Table %s does not exist in database %s" % (name,db.db_nm))
+            sel.append("SELECT '%s' AS run, %d AS run_idx, * FROM %s.\"%s\"" % (run.replace("'", "''"),i,db.db_nm,name))
+        nm = "%s_%s" % (self.prefix,name)
+        kind = "TABLE" if name in self.materialize else "VIEW"
+        self.pdb_con("CREATE OR REPLACE %s %s AS %s" % (kind, nm, " UNION ALL BY NAME ".join(sel)), cache=False)
+        self.pdb_con.registerRelation(nm, [ db.db_nm for db in self.dbs ])
+        self._views[name] = Table(nm)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name.endswith('_async') and callable(getattr(type(self), name[:-len('_async')], None)):
+            return asyncMethod(self.pdb_con, getattr(self, name[:-len('_async')]))
+        if all( name in db.tableNames() for db in self.dbs ):
+            return self.view(name)
+        raise AttributeError("'%s' object has no attribute '%s' and not all databases have a table of that name" % (type(self).__name__, name))
+
+    #Drop the federated views and tables
+    def close(self):
+        for name, v in self._views.items():
+            self.pdb_con("DROP %s IF EXISTS %s" % ("TABLE" if name in self.materialize else "VIEW", v.get_table_name()), cache=False)
+            self.pdb_con.dropRelation(v.get_table_name())
+        self._views = dict()
+
+    #Get the application profile of every run, as for ProvenanceDatabase.getApplicationProfile
+    #The output is sorted by run and then in descending order by the runtime, with column "rank" giving the position within the run
+    def getApplicationProfile(self, excl_or_incl):
+        fname = self.functions
+        if excl_or_incl == 'exclusive':
+            exc = self.func_runtime_profile_exclusive_stats
+            sev = self.func_anomaly_severity_stats
+            return self("SELECT exc.run, exc.accumulate AS runtime, sev.accumulate AS accum_sev, exc.fid, \
+CAST(sev.accumulate / exc.accumulate AS DECIMAL(5, 4)) AS anom_time_frac, fname.name, \
+ROW_NUMBER() OVER (PARTITION BY exc.run_idx ORDER BY exc.accumulate DESC) AS rank \
+FROM %s AS exc INNER JOIN %s AS fname ON fname.run_idx = exc.run_idx AND fname.fid = exc.fid \
+INNER JOIN %s AS sev ON sev.run_idx = exc.run_idx AND sev.fid = exc.fid \
+ORDER BY exc.run_idx, exc.accumulate DESC" % (exc.get_sql(),fname.get_sql(),sev.get_sql()))
+        elif excl_or_incl == 'inclusive':
+            inc = self.func_runtime_profile_inclusive_stats
+            return self("SELECT inc.run, inc.accumulate AS runtime_incl, inc.fid, fname.name, \
+ROW_NUMBER() OVER (PARTITION BY inc.run_idx ORDER BY inc.accumulate DESC) AS rank \
+FROM %s AS inc INNER JOIN %s AS fname ON fname.run_idx = inc.run_idx AND fname.fid = inc.fid \
+ORDER BY inc.run_idx, inc.accumulate DESC" % (inc.get_sql(),fname.get_sql()))
+        else:
+            raise Exception("Invalid profile type")
+
+    #Tabulate summary information on functions for every run, as for ProvenanceDatabase.topFunctions
+    #The output is sorted by run and then in descending order by the chosen metric, with column "rank" giving the position within the run
+    #limit : if not None, return only the top 'limit' functions of each run
+    def topFunctions(self, order_by = 'anom_severity', limit = None):
+        if order_by == 'anom_severity':
+            ob = "sev.accumulate"
+        elif order_by == 'anom_count':
+            ob = "acnt.accumulate"
+        elif order_by == 'total_time_excl':
+            ob = "ecnt.accumulate"
+        else:
+            raise Exception("Unsupported sort order")
+
+        q = "SELECT sev.run, sev.accumulate AS accum_sev, ecnt.accumulate AS total_time_excl, sev.fid, func.pid, \
+acnt.accumulate AS anomalies, ecnt.count AS calls, \
+CAST(acnt.accumulate / ecnt.count AS DECIMAL(5, 4)) AS anom_call_frac, \
+CAST(sev.accumulate / ecnt.accumulate AS DECIMAL(5, 4)) AS anom_time_frac, func.name, \
+ROW_NUMBER() OVER (PARTITION BY sev.run_idx ORDER BY %s DESC) AS rank, sev.run_idx \
+FROM %s AS sev INNER JOIN %s AS func ON func.run_idx = sev.run_idx AND func.fid = sev.fid \
+INNER JOIN %s AS acnt ON acnt.run_idx = sev.run_idx AND acnt.fid = sev.fid \
+INNER JOIN %s AS ecnt ON ecnt.run_idx = sev.run_idx AND ecnt.fid = sev.fid" % (
+            ob, self.func_anomaly_severity_stats.get_sql(), self.functions.get_sql(),
+            self.func_anomaly_count_stats.get_sql(), self.func_runtime_profile_exclusive_stats.get_sql())
+        where = "" if limit is None else "WHERE rank <= %d" % limit
+        return self("SELECT * EXCLUDE (run_idx) FROM (%s) %s ORDER BY run_idx, rank" % (q,where))
+
+    #Produce the call stack summaries of ProvenanceDatabase.getCallStackSummaries for every run, with an additional "run" column
+    #The output is sorted by run and then by the average severity in descending order
+    def getCallStackSummaries(self, pid):
+        d = self.anomalies
+        cl = self.call_stack_labels
+        f = self.functions
+        return self("SELECT d.run, cl.call_stack_label, count(*) as anomaly_count, AVG(d.outlier_severity) as avg_severity, \
+first(f.name) as fname, hash(first(f.name)) as fname_hash \
+FROM %s AS d INNER JOIN %s AS cl ON cl.run_idx = d.run_idx AND cl.event_id = d.event_id \
+INNER JOIN %s AS f ON f.run_idx = d.run_idx AND f.fid = d.fid \
+WHERE d.pid = %d GROUP BY d.run_idx, d.run, cl.call_stack_label ORDER BY d.run_idx, avg_severity DESC" % (d.get_sql(),cl.get_sql(),f.get_sql(),pid))
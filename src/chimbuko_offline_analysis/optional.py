@@ -0,0 +1,9 @@
+#Helpers for optional dependencies
+
+#Import and return pyarrow, raising an informative error naming the feature that requires it if it is not installed
+def requirePyarrow(feature : str):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("%s requires pyarrow: pip install chimbuko_offline_analysis[arrow]" % feature)
+    return pyarrow
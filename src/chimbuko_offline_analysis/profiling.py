@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+from .optional import requirePyarrow
+
+#Query-level profiling of a ProvenanceDatabaseConnection
+#Every query executed through ProvenanceDatabaseConnection.__call__ is recorded with the API method responsible for it, the wall
+#time, the number of rows returned and the number of bytes fetched. This includes the statements creating the materialized
+#summaries, scope and federation views and the exports. To measure the full cost of a query, rather than only the
+#construction of DuckDB's lazily evaluated relation, the result is materialized as an Arrow table and handed back as a relation on
+#the same cursor. Results that are streamed (queries issued with cache=False) are not materialized; for these only the time to
+#construct the relation is recorded and the rows/bytes are None.
+#
+#explain : if True, also capture the DuckDB EXPLAIN ANALYZE plan of each query. This executes every query a second time
+#hooks : optional list of callables, each called with the QueryRecord of every query, e.g. to forward records to a logger
+#
+#Obtain from ProvenanceDatabaseConnection.enableProfiling()
+class QueryProfiler:
+    def __init__(self, pdb_con, explain = False, hooks = None):
+        requirePyarrow("Query profiling")
+        self.pdb_con = pdb_con
+        self.explain = explain
+        self.hooks = [] if hooks is None else list(hooks)
+        self.records = []
+        self.start = time.time()
+
+    #Add a callable that is called with the QueryRecord of every subsequent query
+    def addHook(self, hook):
+        with self.pdb_con.lock:
+            self.hooks.append(hook)
+
+    #Drop the recorded queries
+    def reset(self):
+        with self.pdb_con.lock:
+            self.records = []
+            self.start = time.time()
+
+    #Execute the query using execute(sql) -> relation, recording it. 'materialize' : if False, do not materialize the result
+    def __call__(self, sql : str, execute, materialize = True):
+        method, path = callingMethod()
+        t = time.perf_counter()
+        rel = execute(sql)
+        rows = None
+        nbytes = None
+        if materialize and rel is not None:
+            tab = rel.arrow()
+            rel = self.pdb_con.cursor().from_arrow(tab)
+            rows = tab.num_rows
+            nbytes = tab.nbytes
+        t = time.perf_counter() - t
+
+        plan = None
+        if self.explain and isSelect(sql):
+            plan = "\n".join( r[1] for r in self.pdb_con.cursor().sql("EXPLAIN ANALYZE " + sql).fetchall() )
+
+        r = QueryRecord(sql, method, path, t, rows, nbytes, plan)
+        with self.pdb_con.lock:
+            self.records.append(r)
+            hooks = list(self.hooks)
+        for h in hooks:
+            h(r)
+        return rel
+
+    #Aggregate the recorded queries by calling method
+    #Return a list of dictionaries sorted in descending order by the total time
+    def methods(self):
+        with self.pdb_con.lock:
+            records = list(self.records)
+        agg = dict()
+        for r in records:
+            m = agg.setdefault(r.method, { "method" : r.method, "queries" : 0, "time" : 0.0, "max_time" : 0.0, "rows" : 0, "bytes" : 0 })
+            m["queries"] += 1
+            m["time"] += r.time
+            m["max_time"] = max(m["max_time"], r.time)
+            m["rows"] += r.rows or 0
+            m["bytes"] += r.bytes or 0
+        return sorted(agg.values(), key=lambda m: m["time"], reverse=True)
+
+    #Return the 'n' slowest recorded queries (all if n is None) in descending order by the time
+    def slowest(self, n = 10):
+        with self.pdb_con.lock:
+            records = sorted(self.records, key=lambda r: r.time, reverse=True)
+        return records if n is None else records[:n]
+
+    #Return a human readable report of the 'n' slowest methods and queries of the session
+    def report(self, n = 10):
+        with self.pdb_con.lock:
+            nq = len(self.records)
+            total = sum( r.time for r in self.records )
+        out = [ "%d queries, %.3f s total" % (nq,total), "",
+                "%-50s %8s %10s %10s %12s %14s" % ("method", "queries", "time (s)", "max (s)", "rows", "bytes") ]
+        for m in self.methods()[:n]:
+            out.append("%-50s %8d %10.4f %10.4f %12d %14d" % (m["method"], m["queries"], m["time"], m["max_time"], m["rows"], m["bytes"]))
+        out += [ "", "%-10s %-50s %12s %14s  %s" % ("time (s)", "method", "rows", "bytes", "sql") ]
+        for r in self.slowest(n):
+            sql = " ".join(r.sql.split())
+            out.append("%-10.4f %-50s %12s %14s  %s" % (r.time, r.method, "-" if r.rows is None else r.rows,
+                                                         "-" if r.bytes is None else r.bytes, sql if len(sql) <= 200 else sql[:197] + "..."))
+        return "\n".join(out)
+
+    #Write the session report, comprising the per-method aggregates and every recorded query, to a JSON file at 'path'
+    def export(self, path : str):
+        with self.pdb_con.lock:
+            records = [ r.asDict() for r in self.records ]
+            start = self.start
+        with open(path, "w") as f:
+            json.dump({ "start" : start, "methods" : self.methods(), "queries" : records }, f, indent=1)
+        return path
+
+#The record of a single query
+#sql : the SQL statement
+#method : the qualified name of the API method that issued the query, e.g. "ProvenanceDatabase.getFunctionEvents"
+#path : the chain of API methods from the entry point called by the user down to the issuing method
+#time : the wall time in seconds
+#rows, bytes : the number of rows and bytes of the result (None if the result was not materialized)
+#plan : the EXPLAIN ANALYZE plan, if captured
+class QueryRecord:
+    def __init__(self, sql, method, path, time, rows, bytes, plan = None):
+        self.sql = sql
+        self.method = method
+        self.path = path
+        self.time = time
+        self.rows = rows
+        self.bytes = bytes
+        self.plan = plan
+
+    def asDict(self):
+        return { "sql" : self.sql, "method" : self.method, "path" : self.path, "time" : self.time,
+                 "rows" : self.rows, "bytes" : self.bytes, "plan" : self.plan }
+
+    def __repr__(self):
+        return "QueryRecord(method=%s, time=%.4f, rows=%s, bytes=%s)" % (self.method, self.time, self.rows, self.bytes)
+
+def isSelect(sql : str):
+    s = sql.lstrip().upper()
+    return s.startswith("SELECT") or s.startswith("WITH") or s.startswith("FROM")
+
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+_internal = { os.path.join(_package_dir, f) for f in ["profiling.py", "query_cache.py", "concurrency.py"] }
+
+#Return the qualified name of the public API method of this package responsible for the current query, and the chain of public
+#methods from the outermost (the entry point called from user code) to the innermost. The method is the innermost public method,
+#such that private helpers are attributed to the API method that called them. Queries issued directly from user code are
+#attributed to "<user>"
+def callingMethod():
+    chain = []
+    f = sys._getframe(1)
+    while f is not None:
+        fname = f.f_code.co_filename
+        name = f.f_code.co_name
+        if fname.startswith(_package_dir) and fname not in _internal and name.isidentifier() and not name.startswith("_"):
+            chain.append(getattr(f.f_code, "co_qualname", name))
+        f = f.f_back
+    if len(chain) == 0:
+        return "<user>", []
+    chain.reverse()
+    return chain[-1], chain
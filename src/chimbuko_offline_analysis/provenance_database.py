@@ -1,43 +1,271 @@
 import duckdb
 import pypika
+import re
+import threading
+import itertools
+import statistics
+from concurrent.futures import ThreadPoolExecutor
 from pypika import *
 from pypika import functions as fn
 import numpy
+from .query_cache import QueryCache
+from .federation import FederatedProvenanceDatabase
+from .concurrency import asyncMethod
+from .optional import requirePyarrow
+from .summary_store import SummaryStore
+from .profiling import QueryProfiler
+from .rescoring import ADModelSet
+from .sketches import QuantileSketchSet
+from .compact import compactTable
 
+#The connection can be used from multiple threads: each thread executes its queries on its own DuckDB cursor, and
+#intermediate relations are given unique names (see uniqueName). Every analysis method "<method>" of ProvenanceDatabase
+#also has an asynchronous variant "<method>_async" that runs on the connection's thread pool, e.g.
+#   await asyncio.gather(pdb.topFunctions_async(), pdb.getCallStackSummaries_async(0))
 class ProvenanceDatabaseConnection:
-    def __init__(self):
+    #cache_bytes : if > 0, enable the query result cache with the given size budget in bytes (see enableCache)
+    #threads : the number of worker threads used by the asynchronous methods (default: as ThreadPoolExecutor)
+    def __init__(self, cache_bytes : int = 0, threads = None):
         self.con = duckdb.connect()
         self.db = []
-    def connect(self, file : str):
-        ndb = len(self.db)
-        db_nm = "pdb_%d" % ndb
-        self.con.sql("ATTACH '%s' AS %s (READ_ONLY)" % (file,db_nm))
-        self.db.append(ProvenanceDatabase(self, db_nm))
-        return self.db[-1]
-        
-    def __call__(self, query : pypika.queries.QueryBuilder) -> duckdb.duckdb.DuckDBPyRelation:
+        self.cache = None
+        self.threads = threads
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self._names = itertools.count()
+        self._executor = None
+        self.profiler = None
+        #The in-memory relations (and summary catalogs) created by the package whose contents are fixed once created: name ->
+        #the catalogs of the databases they are derived from (see registerRelation)
+        self.relations = dict()
+        #Incremented by every statement other than a query, e.g. CREATE or DROP, executed through the connection
+        self.ddl_version = 0
+        if cache_bytes > 0:
+            self.enableCache(cache_bytes)
+    #quiet : if False, print the list of tables in the database
+    #summaries : if True (or the path of the sidecar file), use a persistent store of materialized summaries (see ProvenanceDatabase.useSummaryStore)
+    def connect(self, file : str, quiet = False, summaries = False):
+        with self.lock:
+            ndb = len(self.db)
+            db_nm = "pdb_%d" % ndb
+            self("ATTACH '%s' AS %s (READ_ONLY)" % (file,db_nm), cache=False)
+            self.db.append(ProvenanceDatabase(self, db_nm, file, quiet))
+            if summaries:
+                self.db[-1].useSummaryStore(None if summaries is True else summaries)
+            return self.db[-1]
+
+    #Return a FederatedProvenanceDatabase for analyses spanning several runs in a single query
+    #dbs : the databases to include (default: all attached databases)
+    #runs : optional labels for the runs (default: the database catalog names)
+    def federate(self, dbs = None, runs = None):
+        if dbs is None:
+            dbs = self.db
+        return FederatedProvenanceDatabase(self, dbs, runs, self.uniqueName("__fed"))
+
+    #Return the DuckDB connection on which queries are executed for the calling thread
+    #The main thread uses the primary connection and other threads each have their own cursor
+    def cursor(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            with self.lock:
+                con = self.con if threading.current_thread() is threading.main_thread() else self.con.cursor()
+            self._local.con = con
+        return con
+
+    #Return a name, starting with 'prefix', that is unique to this connection; used for intermediate views and tables
+    def uniqueName(self, prefix : str):
+        return "%s_%d" % (prefix, next(self._names))
+
+    #Return the thread pool on which the asynchronous methods are executed
+    def executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="chimbuko")
+            return self._executor
+
+    #Cache the results of queries on the attached (read-only) databases such that repeated identical queries do not re-execute
+    #max_bytes : the size budget of the cache; least-recently-used results are evicted beyond this
+    #max_entries : optional limit on the number of cached results
+    #Requires pyarrow
+    def enableCache(self, max_bytes : int = 256*1024*1024, max_entries = None):
+        self.cache = QueryCache(self, max_bytes, max_entries)
+        return self.cache
+
+    def disableCache(self):
+        self.cache = None
+
+    #Drop cached results, optionally only those referencing the given ProvenanceDatabase
+    def invalidateCache(self, db = None):
+        if self.cache is not None:
+            self.cache.invalidate(db)
+
+    #Record that the relation 'name', created by the package, is derived only from the databases 'catalogs' and is not modified
+    #once created, such that the results of queries on it can be cached (keyed by the identity of those databases)
+    def registerRelation(self, name : str, catalogs):
+        with self.lock:
+            self.relations[name.lower()] = tuple(catalogs)
+
+    #Record that the relation 'name' has been dropped, dropping the cached results of queries on it
+    def dropRelation(self, name : str):
+        with self.lock:
+            self.relations.pop(name.lower(), None)
+            if self.cache is not None:
+                self.cache.invalidateRelation(name)
+
+    #Record every query executed through this connection with the calling API method, wall time, rows returned and bytes fetched
+    #explain : if True, also capture the DuckDB EXPLAIN ANALYZE plan of each query (this executes each query twice)
+    #hooks : optional list of callables called with the record of every query
+    #The report of the session is obtained from con.profiler.report() or written to a file with con.profiler.export(path)
+    #Requires pyarrow
+    def enableProfiling(self, explain = False, hooks = None) -> QueryProfiler:
+        self.profiler = QueryProfiler(self, explain, hooks)
+        return self.profiler
+
+    def disableProfiling(self):
+        self.profiler = None
+
+    #All SQL statements of the package, including those creating the intermediate tables and views, are executed through this
+    #method such that they are recorded by the profiler
+    #cache : if False, bypass the result cache (e.g. for results that are streamed rather than materialized, and for statements
+    #        other than queries such as CREATE or COPY, which are executed immediately)
+    #cursor : the DuckDB cursor on which to execute the statement, if not that of the calling thread. The cache is then bypassed
+    def __call__(self, query : pypika.queries.QueryBuilder, cache = True, cursor = None) -> duckdb.duckdb.DuckDBPyRelation:
         if type(query) == pypika.queries.QueryBuilder:
-            return self.con.sql(query.get_sql()) #quote_char=None
+            sql = query.get_sql() #quote_char=None
         elif type(query) == pypika.queries._SetOperation:
-            return self.con.sql(query.get_sql())
+            sql = query.get_sql()
         elif type(query) == str:
-            return self.con.sql(query)    
+            sql = query
         else:
             raise Exception("Invalid input type")
 
+        if cursor is not None:
+            cache = False
+        if self.profiler is not None:
+            return self.profiler(sql, lambda q: self._execute(q, cache, cursor), materialize=cache)
+        return self._execute(sql, cache, cursor)
+
+    _query = re.compile(r"\s*\(*\s*(SELECT|FROM|WITH)\b", re.IGNORECASE)
+
+    def _execute(self, sql : str, cache = True, cursor = None) -> duckdb.duckdb.DuckDBPyRelation:
+        if cache and self.cache is not None:
+            return self.cache(sql)
+        rel = (self.cursor() if cursor is None else cursor).sql(sql)
+        if not self._query.match(sql):
+            with self.lock:
+                self.ddl_version += 1
+        return rel
+
 class ProvenanceDatabase:
-    def __init__(self, pdb_con, db_nm):
-        #auto-generate the table objects
+    #quiet : if False, print the list of tables on connection
+    def __init__(self, pdb_con, db_nm, file = None, quiet = False):
         self.db_nm = db_nm
+        self.name = db_nm
+        self.file = file
         self.pdb = Database(db_nm)
         self.pdb_con = pdb_con
-        print("Tables:")
-        for n in pdb_con("SELECT DISTINCT table_name FROM information_schema.tables WHERE table_type='BASE TABLE'").fetchnumpy()["table_name"]:
-            exec("self.%s = Table(\"%s\", self.pdb)" % (n,n))
-            print(n)        
+        self._tables = None
+        self._columns = dict()
+        self._run_start = None
+        self._run_start_times = None
+        self._materialized = dict()
+        self._ad_model_set = None
+        self._sketches = dict()
+        self.summaries = None
+        if not quiet:
+            print("Tables:")
+            for n in self.tableNames():
+                print(n)
+
+    #Return the names of the tables in this database
+    #The catalog is queried once (restricted to this database) and cached
+    def tableNames(self):
+        with self.pdb_con.lock:
+            if self._tables is None:
+                self._tables = list(self.pdb_con("SELECT table_name FROM duckdb_tables() WHERE database_name = '%s' ORDER BY table_name" % self.db_nm).fetchnumpy()["table_name"])
+        return self._tables
+
+    #Return the column names of the given table (name or Table object), cached after the first call
+    def tableColumns(self, table):
+        name = table.get_table_name() if isinstance(table, Table) else table
+        with self.pdb_con.lock:
+            if name not in self._columns:
+                self._columns[name] = self.pdb_con('SELECT * FROM %s."%s" LIMIT 0' % (self.db_nm,name), cache=False).columns
+        return self._columns[name]
+
+    #The table objects are resolved lazily on first access, e.g. pdb.anomalies, such that connecting does not require
+    #scanning the catalog
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name.endswith('_async') and callable(getattr(type(self), name[:-len('_async')], None)):
+            return asyncMethod(self.pdb_con, getattr(self, name[:-len('_async')]))
+        if self._tables is not None:
+            exists = name in self._tables
+        else:
+            try:
+                self.tableColumns(name)
+                exists = True
+            except duckdb.CatalogException:
+                exists = False
+        if not exists:
+            raise AttributeError("'%s' object has no attribute '%s' and the database has no table of that name" % (type(self).__name__, name))
+        tab = Table(name, self.pdb)
+        setattr(self, name, tab)
+        return tab
 
-    def __call__(self, query : pypika.queries.QueryBuilder) -> duckdb.duckdb.DuckDBPyRelation:
-        return self.pdb_con(query)
+    def __dir__(self):
+        return list(super().__dir__()) + self.tableNames()
+
+    #Store the summary tables used by topFunctions, getApplicationProfile, getCallStackSummaries and the run start times in a
+    #persistent sidecar DuckDB file (default: the database path with suffix ".summaries.duckdb") such that they are computed only
+    #once across sessions. The store is rebuilt automatically if the database file changes
+    #full_hash : if True, fingerprint the database by hashing its full contents rather than a sample of blocks
+    def useSummaryStore(self, path = None, full_hash = False) -> SummaryStore:
+        with self.pdb_con.lock:
+            if self.summaries is None:
+                self.summaries = SummaryStore(self, path, full_hash)
+                self._materialized = dict()
+                self._run_start = None
+                self._run_start_times = None
+        return self.summaries
+
+    #Return the source of a summary: the stored table if a summary store is in use, otherwise the query as a subquery
+    def _summary(self, name, query):
+        if self.summaries is not None:
+            return self.summaries.table(name, query)
+        return query
+
+    #Return the table 'name' materialized from 'query' on first call: in the summary store if one is in use, otherwise as an
+    #in-memory table of the connection
+    def _materializedTable(self, name, query) -> Table:
+        with self.pdb_con.lock:
+            if name not in self._materialized:
+                if self.summaries is not None:
+                    self._materialized[name] = self.summaries.table(name, query)
+                else:
+                    nm = "__%s_%s" % (name, self.name)
+                    sql = query if isinstance(query, str) else query.get_sql()
+                    self.pdb_con("CREATE OR REPLACE TABLE %s AS %s" % (nm, sql), cache=False)
+                    self.pdb_con.registerRelation(nm, (self.db_nm,))
+                    self._materialized[name] = Table(nm)
+        return self._materialized[name]
+
+    def __call__(self, query : pypika.queries.QueryBuilder, cache = True) -> duckdb.duckdb.DuckDBPyRelation:
+        return self.pdb_con(query, cache)
+
+    #Methods with a 'compact' argument return, if it is True, an Arrow table with dictionary encoded strings and narrowed integer
+    #types in place of the relation (see compactTable). Requires pyarrow
+    def _result(self, rel, compact = False):
+        return compactTable(rel) if compact else rel
+
+    #Return a handle on this database restricted to a subset of the run, on which all analysis methods (and the charts) operate
+    #only on the events within the scope. See ScopedProvenanceDatabase
+    #pids, rids : lists of program indices / ranks
+    #io_steps : an inclusive range (first, last) of io steps
+    #time : a range (start, end) in seconds since the start of each rank's run; events overlapping the range are included
+    def scope(self, pids = None, rids = None, io_steps = None, time = None):
+        return ScopedProvenanceDatabase(self, pids, rids, io_steps, time)
 
     def describe(self, table : str):
         q = ("DESCRIBE %s." % self.db_nm) + table
@@ -47,7 +275,7 @@ class ProvenanceDatabase:
     def listColumns(self, table : Table):
         return self("SELECT COLUMN_NAME FROM duckdb_columns() WHERE TABLE_NAME = '%s' AND database_name='%s'" % (table.get_table_name(),self.db_nm) )
     def listColumnsAsArray(self, table: Table):
-        return self.listColumns(table).fetchnumpy()["column_name"]
+        return numpy.array(self.tableColumns(table))
 
     def getFunctionName(self, fid):
         f = self.functions
@@ -69,11 +297,184 @@ class ProvenanceDatabase:
     def getFunctionADmodelHistogram(self, fid):
         d = self.ad_models
         ts = self(Query.from_(d).select(d.bin_width, d.first_edge, d.bin_counts).where(d.fid==fid) ).fetchnumpy()
-        nbin=len(ts['bin_counts'][0])
-        edges = [ ts['first_edge'][0] + b*ts['bin_width'][0] for b in range(0,nbin+1) ]
         counts = ts['bin_counts'][0]
+        edges = ts['first_edge'][0] + ts['bin_width'][0] * numpy.arange(len(counts)+1)
+        return edges, counts
+
+    #Batched versions of the per-function accessors above. These accept any sequence of function indices, resolve them all
+    #in a single query and return results aligned with the input order
+    #pid : the program index of the functions, or an array of program indices aligned with the function indices. As the function
+    #      indices of different programs overlap, it is required if the database contains several programs
+
+    #Return a query that joins the provided function indices (in input order, column "pos") onto the table 'tab'
+    #The selected columns are 'cols' from 'tab'. Function indices not present in 'tab' are flagged in column "_missing"
+    def _fidJoin(self, fids, tab : Table, cols, pid = None):
+        fids = numpy.asarray(fids, dtype=numpy.int64).ravel()
+        lst = lambda v: "[%s]::BIGINT[]" % ",".join(str(x) for x in v)
+        if pid is None:
+            ids = "SELECT unnest(ids) AS fid, generate_subscripts(ids, 1) AS pos FROM (SELECT %s AS ids)" % lst(fids)
+            on = "_t.fid = _fids.fid"
+        else:
+            pids = numpy.broadcast_to(numpy.asarray(pid, dtype=numpy.int64).ravel(), fids.shape)
+            ids = "SELECT unnest(ids) AS fid, unnest(pids) AS pid, generate_subscripts(ids, 1) AS pos FROM (SELECT %s AS ids, %s AS pids)" % (lst(fids), lst(pids))
+            on = "_t.fid = _fids.fid AND _t.pid = _fids.pid"
+        return "WITH _fids AS (%s) \
+SELECT _fids.pos, _fids.fid AS _fid, _t.fid IS NULL AS _missing, %s FROM _fids LEFT JOIN %s AS _t ON %s ORDER BY _fids.pos" % (
+                ids, ", ".join('_t."%s"' % c for c in cols), tab.get_sql(), on)
+
+    #Fetch the aligned columns as numpy arrays, raising an exception if any function index is missing, or matches several
+    #functions (of different programs) when no pid is given
+    def _fetchAligned(self, fids, tab : Table, cols, pid = None):
+        r = self(self._fidJoin(fids, tab, cols, pid)).fetchnumpy()
+        missing = numpy.asarray(r['_missing'], dtype=bool)
+        if numpy.any(missing):
+            raise Exception("Could not find function(s) ", numpy.asarray(r['_fid'])[missing])
+        pos = numpy.asarray(r['pos'])
+        if numpy.any(pos[1:] == pos[:-1]):
+            raise Exception("Function(s) found in several programs, specify the pid: ", numpy.unique(numpy.asarray(r['_fid'])[1:][pos[1:] == pos[:-1]]))
+        return r
+
+    #Get the names of the given function idxs as an array
+    def getFunctionNames(self, fids, pid = None):
+        return self._fetchAligned(fids, self.functions, ['name'], pid)['name']
+
+    #Get the number of anomalies recorded for each of the given function idxs as an array
+    def getFunctionAnomalyCounts(self, fids, pid = None):
+        return self._fetchAligned(fids, self.func_anomaly_count_stats, ['accumulate'], pid)['accumulate']
+
+    #Get the number of executions observed for each of the given function idxs as an array
+    def getFunctionExecutionCounts(self, fids, pid = None):
+        return self._fetchAligned(fids, self.func_runtime_profile_exclusive_stats, ['count'], pid)['count']
+
+    #Return the function profile information for the given function idxs as a single table in the input order
+    def getFunctionProfiles(self, fids, excl_or_incl, pid = None):
+        if excl_or_incl == 'exclusive':
+            tab = self.func_runtime_profile_exclusive_stats
+        elif excl_or_incl == 'inclusive':
+            tab = self.func_runtime_profile_inclusive_stats
+        else:
+            raise Exception("Invalid profile type")
+        cols = [ c for c in self.listColumnsAsArray(tab) ]
+        self._fetchAligned(fids, tab, ['fid'], pid) #check all functions exist and are unique
+        return self("SELECT %s FROM (%s)" % (", ".join('"%s"' % c for c in cols), self._fidJoin(fids, tab, cols, pid)))
+
+    #Get the AD model histograms for the given function idxs (HBOS/COPOD only)
+    #Return ( [edges_0, edges_1, ...], [counts_0, counts_1, ...] ) with the same conventions as getFunctionADmodelHistogram
+    def getFunctionADmodelHistograms(self, fids, pid = None):
+        ts = self._fetchAligned(fids, self.ad_models, ['bin_width', 'first_edge', 'bin_counts'], pid)
+        edges = []
+        counts = []
+        for first, width, cnts in zip(ts['first_edge'], ts['bin_width'], ts['bin_counts']):
+            cnts = numpy.asarray(cnts)
+            edges.append(first + width * numpy.arange(len(cnts)+1))
+            counts.append(cnts)
         return edges, counts
 
+    #Offline re-scoring. The AD models of all functions are loaded once into packed arrays (see ADModelSet), against which the
+    #recorded executions can be re-scored with a different algorithm, regularization or threshold without rerunning the job
+
+    #Return the AD models (HBOS/COPOD histograms) of all functions as an ADModelSet, loading them on first call
+    def loadADModels(self) -> ADModelSet:
+        with self.pdb_con.lock:
+            if self._ad_model_set is None:
+                d = self.ad_models
+                ts = self(Query.from_(d).select(d.pid, d.fid, d.first_edge, d.bin_width, d.bin_counts)).fetchnumpy()
+                self._ad_model_set = ADModelSet(ts['pid'], ts['fid'], ts['first_edge'], ts['bin_width'], ts['bin_counts'])
+        return self._ad_model_set
+
+    #Re-score the recorded executions against the AD models, returning the new anomaly set: the executions with a score above
+    #'threshold' as a table with columns event_id, pid, rid, fid, runtime_exclusive, score and recorded (whether the execution is
+    #in the recorded anomalies)
+    #etype : the executions to re-score, "anomalies", "normal_execs" or "both"
+    #fids : optionally restrict to a list of function indices
+    #algorithm, alpha : as for ADModelSet.score
+    #The executions are streamed in batches of 'batch_size' such that memory usage is bounded. Requires pyarrow
+    def rescoreEvents(self, threshold, etype = "both", fids = None, algorithm = "hbos", alpha = 1e-32, batch_size = 1000000) -> Table:
+        pa = requirePyarrow("Re-scoring")
+        models = self.loadADModels()
+        qs = []
+        for e in (["anomalies", "normal_execs"] if etype == "both" else [etype]):
+            tab = self._eventTable(e)
+            q = "SELECT event_id, pid, rid, fid, runtime_exclusive::DOUBLE AS runtime_exclusive, %s AS recorded FROM %s" % (
+                "true" if e == "anomalies" else "false", tab.get_sql())
+            if fids is not None:
+                q += " WHERE fid IN (%s)" % ",".join(str(int(f)) for f in numpy.asarray(fids).ravel())
+            qs.append(q)
+
+        nm = self.pdb_con.uniqueName("__rescored")
+        batch_nm = nm + "_batch"
+        #The inserts are made on a separate cursor as the cursor of this thread is streaming the executions
+        ins = self.pdb_con.con.cursor()
+        self.pdb_con("CREATE TABLE %s (event_id VARCHAR, pid BIGINT, rid BIGINT, fid BIGINT, runtime_exclusive DOUBLE, score DOUBLE, recorded BOOLEAN)" % nm, cursor=ins)
+        for batch in self.iterRecordBatches(" UNION ALL ".join(qs), batch_size):
+            score = models.score(batch.column(3).to_numpy(zero_copy_only=False), batch.column(4).to_numpy(zero_copy_only=False), algorithm, alpha,
+                                 pid=batch.column(1).to_numpy(zero_copy_only=False))
+            sel = score > threshold
+            if numpy.any(sel):
+                t = pa.Table.from_batches([batch]).filter(pa.array(sel)).append_column("score", pa.array(score[sel]))
+                ins.register(batch_nm, t)
+                self.pdb_con("INSERT INTO %s SELECT event_id, pid, rid, fid, runtime_exclusive, score, recorded FROM %s" % (nm, batch_nm), cursor=ins)
+                ins.unregister(batch_nm)
+        ins.close()
+        return Table(nm)
+
+    #Compare a re-scored anomaly set (from rescoreEvents) with the recorded anomalies, per function (pid, fid):
+    #  recorded, rescored : the number of anomalies in the recorded and re-scored sets
+    #  retained : the number of recorded anomalies that are also in the re-scored set
+    #  added, dropped : the number of anomalies only in the re-scored / recorded set
+    #The comparison is meaningful for a re-scoring of both the anomalies and normal executions (etype="both")
+    def compareAnomalySets(self, rescored : Table):
+        if isinstance(rescored, str):
+            rescored = Table(rescored)
+        return self("SELECT pid, fid, COALESCE(r.recorded, 0) AS recorded, COALESCE(n.rescored, 0) AS rescored, COALESCE(n.retained, 0) AS retained, \
+COALESCE(n.rescored, 0) - COALESCE(n.retained, 0) AS added, COALESCE(r.recorded, 0) - COALESCE(n.retained, 0) AS dropped \
+FROM (SELECT pid, fid, COUNT(*) AS recorded FROM %s GROUP BY pid, fid) AS r \
+FULL OUTER JOIN (SELECT pid, fid, COUNT(*) AS rescored, SUM(recorded::BIGINT) AS retained FROM %s GROUP BY pid, fid) AS n USING (pid, fid) \
+ORDER BY pid, fid" % (
+            self.anomalies.get_sql(), rescored.get_sql()))
+
+    #Runtime distribution regression detection. The exclusive runtimes of the executions (anomalies and normal executions) of every
+    #function are summarized, in a single scan of the event tables, into mergeable quantile sketches (see QuantileSketchSet). The
+    #sketches are stored like the other summary tables, such that comparing the runtime distributions of two runs reads only the
+    #sketches and not the events
+    #by_label : if True, keep a separate sketch for every call stack label of each function
+    #alpha : the relative accuracy of the quantiles
+
+    #Return the table (pid, fid[, call_stack_label], bucket, count) of the sketches, creating it on first call
+    def runtimeSketchTable(self, by_label = False, alpha = 0.01) -> Table:
+        if not (0 < alpha < 1):
+            raise Exception("The relative accuracy must be in (0, 1)")
+        bucket = "CASE WHEN runtime_exclusive <= 1 THEN 0 ELSE CEIL(LN(runtime_exclusive) / %r)::BIGINT END" % float(numpy.log((1.0 + alpha) / (1.0 - alpha)))
+        e = "SELECT event_id, pid, fid, %s AS bucket FROM (SELECT event_id, pid, fid, runtime_exclusive FROM %s UNION ALL SELECT event_id, pid, fid, runtime_exclusive FROM %s)" % (
+            bucket, self.anomalies.get_sql(), self.normal_execs.get_sql())
+        name = "runtime_sketches%s_%d" % ("_by_label" if by_label else "", round(alpha * 1e6))
+        if by_label:
+            return self._materializedTable(name, "SELECT e.pid, e.fid, lb.call_stack_label, e.bucket, COUNT(*)::BIGINT AS count FROM (%s) AS e \
+INNER JOIN %s AS lb ON lb.event_id = e.event_id GROUP BY e.pid, e.fid, lb.call_stack_label, e.bucket" % (e, self.call_stack_labels.get_sql()))
+        return self._materializedTable(name, "SELECT pid, fid, bucket, COUNT(*)::BIGINT AS count FROM (%s) GROUP BY pid, fid, bucket" % e)
+
+    #Return the runtime sketches of all functions as a QuantileSketchSet, loading them on first call
+    #The set can be saved with QuantileSketchSet.save to compare with runs that are not at hand
+    def runtimeSketches(self, by_label = False, alpha = 0.01) -> QuantileSketchSet:
+        with self.pdb_con.lock:
+            key = (by_label, alpha)
+            if key not in self._sketches:
+                t = self.runtimeSketchTable(by_label, alpha)
+                r = self("SELECT s.pid, s.fid, COALESCE(f.name, s.fid::VARCHAR) AS name, s.bucket, s.count%s FROM %s AS s \
+LEFT JOIN %s AS f ON f.pid = s.pid AND f.fid = s.fid" % (", s.call_stack_label" if by_label else "", t.get_sql(), self.functions.get_sql())).fetchnumpy()
+                self._sketches[key] = QuantileSketchSet(alpha, r['pid'], r['fid'], r['name'], r['bucket'], r['count'],
+                                                        r['call_stack_label'] if by_label else None)
+        return self._sketches[key]
+
+    #Compare the runtime distribution of every function in this run (the baseline) with that in 'candidate', a ProvenanceDatabase
+    #or a QuantileSketchSet (e.g. loaded from a file, or merged from several runs). Functions are matched by program index and name
+    #(and call stack label if by_label). Return a dictionary of arrays sorted by decreasing distance, see QuantileSketchSet.compare
+    #min_count : ignore functions with fewer executions than this in either run
+    def compareRuntimeDistributions(self, candidate, by_label = False, alpha = 0.01, min_count = 10):
+        if not isinstance(candidate, QuantileSketchSet):
+            candidate = candidate.runtimeSketches(by_label, alpha)
+        return self.runtimeSketches(by_label, alpha).compare(candidate, min_count)
+
     #Get the times in seconds (defined by the function *exit* event) of anomalies on a specific pid/rank, with optional 
     #specification of function idx
     #Results can be plotted using a histogram, e.g. matplotlib.pyplot.hist(times, bins=100)    
@@ -84,9 +485,60 @@ class ProvenanceDatabase:
             times = self(Query.from_(d).select(d.exit).where( (d.pid==pid) & (d.rid==rid) )).fetchnumpy()['exit']
         else:            
             times = self(Query.from_(d).select(d.exit).where( (d.pid==pid) & (d.rid==rid) & (d.fid==fid) )  ).fetchnumpy()['exit']        
-        times = (times - self.getRunStartTime(pid,rid))/1e6
+        times = self.toSecondsSinceStart(pid, rid, times)
         return times
     
+    #Bin the anomalies of program 'pid' over (rank, time bin) in the database, for heatmaps of the anomalies across a whole job
+    #The time of an anomaly is its exit time in seconds since the start of its rank's run, as for getAnomalyTimes
+    #nbins : the number of time bins
+    #tmax : the end of the time range; by default the end of the last io step of any rank. Anomalies beyond are placed in the last bin
+    #fid : optionally restrict to a function index or a list of function indices
+    #by_function : if True, bin separately for each function
+    #Return a dictionary of numpy arrays:
+    #  "rid" : the ranks, 0..nrank-1
+    #  "edges" : the nbins+1 time bin edges in seconds
+    #  "count", "severity" : the anomaly count and accumulated severity, of shape (nrank, nbins), or (nfunc, nrank, nbins) if by_function
+    #  "fid" : if by_function, the function indices of the first dimension (those with anomalies)
+    #This requires a single scan of the anomalies
+    def getAnomalyHeatmap(self, pid, nbins = 100, tmax = None, fid = None, by_function = False):
+        rs = self.runStartTimes()
+        rids = rs["rid"][rs["pid"] == pid]
+        if len(rids) == 0:
+            raise Exception("No ranks found for pid ", pid)
+        nrank = int(numpy.max(rids)) + 1
+        if tmax is None:
+            io = self.io_steps
+            rst = self.runStartTable()
+            tmax = self(Query.from_(io).select(fn.Max((io.io_step_tend - rst.run_start)/1e6).as_("tmax"))
+                        .inner_join(rst).on( (rst.pid == io.pid) & (rst.rid == io.rid) ).where(io.pid == pid)).fetchone()[0]
+        tmax = float(tmax)
+        if tmax <= 0:
+            tmax = 1.0
+        width = tmax / nbins
+
+        d = self.anomalies
+        where = "a.pid = %d" % pid
+        if fid is not None:
+            where += " AND a.fid IN (%s)" % ",".join(str(int(f)) for f in numpy.asarray(fid).ravel())
+        group = "a.fid, " if by_function else ""
+        r = self("SELECT %sa.rid, LEAST(GREATEST(FLOOR((a.exit - rs.run_start)/1e6/%r), 0), %d)::BIGINT AS bin, \
+COUNT(*) AS count, SUM(a.outlier_severity) AS severity FROM %s AS a INNER JOIN %s AS rs ON rs.pid = a.pid AND rs.rid = a.rid \
+WHERE %s GROUP BY ALL" % (group, width, nbins-1, d.get_sql(), self.runStartTable().get_sql(), where)).fetchnumpy()
+
+        out = { "rid" : numpy.arange(nrank), "edges" : width * numpy.arange(nbins+1) }
+        idx = (numpy.asarray(r["rid"], dtype=numpy.int64), numpy.asarray(r["bin"], dtype=numpy.int64))
+        shape = (nrank, nbins)
+        if by_function:
+            fids, fidx = numpy.unique(numpy.asarray(r["fid"], dtype=numpy.int64), return_inverse=True)
+            out["fid"] = fids
+            idx = (fidx,) + idx
+            shape = (len(fids),) + shape
+        out["count"] = numpy.zeros(shape, dtype=numpy.int64)
+        out["severity"] = numpy.zeros(shape, dtype=numpy.float64)
+        out["count"][idx] = r["count"]
+        out["severity"][idx] = r["severity"]
+        return out
+
     def getEventExecWindow(self, event_id : str):
         ew = self.exec_windows
         ewe = self.exec_window_events
@@ -96,6 +548,37 @@ class ProvenanceDatabase:
                     .inner_join(ewe).on( ew.exec_window_entry_id == ewe.event_id ) \
                     .inner_join(func).on( func.fid == ewe.fid ) )
 
+    #Differential analysis of the exec windows of the anomalies and normal executions of functions, computed in a single query for
+    #all the functions 'fids' (default: all functions). For each function (pid, fid) and each neighbouring function of the same program
+    #appearing in the exec windows of its events:
+    #  anomaly_events, normal_events : the number of anomalies / normal executions of the function whose window contains the neighbour
+    #  anomaly_freq, normal_freq : the above as a fraction of the function's anomalies / normal executions
+    #  anomaly_mean_runtime_exclusive, normal_mean_runtime_exclusive : the mean exclusive runtime of the neighbour in those windows
+    #  enrichment : the ratio of the frequencies, each regularized by adding 'pseudocount' to the counts, such that neighbours
+    #               that tend to appear around the anomalies but not the normal executions have a large enrichment
+    #The output is sorted by program index, function index and descending enrichment
+    def getExecWindowEnrichment(self, fids = None, pseudocount = 1.0):
+        where = ""
+        if fids is not None:
+            where = "WHERE fid IN (%s)" % ",".join(str(int(f)) for f in numpy.asarray(fids).ravel())
+        return self("WITH ev AS (SELECT event_id, pid, fid, 1 AS anom FROM %s %s UNION ALL SELECT event_id, pid, fid, 0 AS anom FROM %s %s), \
+tot AS (SELECT pid, fid, SUM(anom) AS na, SUM(1 - anom) AS nn FROM ev GROUP BY pid, fid), \
+per_event AS (SELECT ev.pid, ev.fid, ev.anom, ev.event_id, ewe.fid AS nfid, SUM(ewe.runtime_exclusive) AS rt, COUNT(*) AS occ \
+FROM ev INNER JOIN %s AS ew ON ew.event_id = ev.event_id INNER JOIN %s AS ewe ON ewe.event_id = ew.exec_window_entry_id \
+GROUP BY ev.pid, ev.fid, ev.anom, ev.event_id, ewe.fid), \
+agg AS (SELECT pid, fid, nfid, COUNT(*) FILTER (WHERE anom = 1) AS anomaly_events, COUNT(*) FILTER (WHERE anom = 0) AS normal_events, \
+SUM(rt) FILTER (WHERE anom = 1) / SUM(occ) FILTER (WHERE anom = 1) AS anomaly_mean_runtime_exclusive, \
+SUM(rt) FILTER (WHERE anom = 0) / SUM(occ) FILTER (WHERE anom = 0) AS normal_mean_runtime_exclusive FROM per_event GROUP BY pid, fid, nfid) \
+SELECT agg.pid, agg.fid, agg.nfid AS neighbour_fid, f.name AS neighbour_name, agg.anomaly_events, agg.normal_events, \
+agg.anomaly_events / NULLIF(tot.na, 0) AS anomaly_freq, agg.normal_events / NULLIF(tot.nn, 0) AS normal_freq, \
+agg.anomaly_mean_runtime_exclusive, agg.normal_mean_runtime_exclusive, \
+((agg.anomaly_events + %r) / (tot.na + %r)) / ((agg.normal_events + %r) / (tot.nn + %r)) AS enrichment \
+FROM agg INNER JOIN tot ON tot.pid = agg.pid AND tot.fid = agg.fid \
+LEFT JOIN (SELECT pid, fid, FIRST(name) AS name FROM %s GROUP BY pid, fid) AS f ON f.pid = agg.pid AND f.fid = agg.nfid \
+ORDER BY agg.pid, agg.fid, enrichment DESC" % (self.anomalies.get_sql(), where, self.normal_execs.get_sql(), where,
+                                      self.exec_windows.get_sql(), self.exec_window_events.get_sql(),
+                                      pseudocount, pseudocount, pseudocount, pseudocount, self.functions.get_sql()))
+
     def getEventCallStack(self, event_id : str):
         cs = self.call_stacks
         cse = self.call_stack_events
@@ -106,15 +589,25 @@ class ProvenanceDatabase:
 
     #Get the information on the call stack with the provided label/hash
     def getLabeledCallStack(self, label):
-        d=self.call_stack_labels
-        eids = self(Query.from_(d).select(d.star).where(d.call_stack_label == label)).fetchnumpy()['event_id']
-        if(len(eids) == 0):
-            raise Exception("Could not find the provided label in the map")
-        eid=eids[0]
-        r = self.getEventCallStack(eid).to_view("r")
-        rt = Table("r")
+        p = self.callStackPathTable()
         func = self.functions
-        return self(Query.from_(rt).select(rt.entry_idx,rt.fid,func.name).inner_join(func).on(rt.fid == func.fid).orderby(rt.entry_idx, order=Order.desc)   )
+        r = self(Query.from_(p).select(p.entry_idx,p.fid,func.name).where(p.call_stack_label == label)
+                 .inner_join(func).on(p.fid == func.fid)
+                 .orderby(p.entry_idx, order=Order.desc) )
+        if len(r) == 0:
+            raise Exception("Could not find the provided label in the map")
+        return r
+
+    #Return the counting column of the call stack label counts for the provided subset ("anomalies","normal_execs","both")
+    def _labelCountColumn(self, subset):
+        if subset == 'anomalies':
+            return "anomaly_count"
+        elif subset == 'normal_execs':
+            return "normal_count"
+        elif subset == 'both':
+            return "anomaly_count + normal_count"
+        else:
+            raise Exception("Invalid subset")
 
     #Return a dictionary of (call stack label)-> count for events in the provided subset ("anomalies","normal_execs","both")
     def getFunctionCallStackLabelsAndCounts(self, fid, subset = 'anomalies'):
@@ -125,20 +618,83 @@ class ProvenanceDatabase:
         if subset == 'anomalies':
             q = Query.from_(anom).select(lb.call_stack_label).inner_join(lb).on(anom.event_id == lb.event_id).where(anom.fid == fid)
         elif subset == 'normal_execs':
-            q = Query.from_(normal).select(normal.event_id, lb.call_stack_label).inner_join(lb).on(normal.event_id == lb.event_id).where(normal.fid == fid)
+            q = Query.from_(normal).select(lb.call_stack_label).inner_join(lb).on(normal.event_id == lb.event_id).where(normal.fid == fid)
         elif subset == 'both':
-            q = Query.from_(anom).select(anom.event_id, lb.call_stack_label).inner_join(lb).on(anom.event_id == lb.event_id).where(anom.fid == fid) + Query.from_(normal).select(normal.event_id, lb.call_stack_label).inner_join(lb).on(normal.event_id == lb.event_id).where(normal.fid == fid)
+            q = Query.from_(anom).select(lb.call_stack_label).inner_join(lb).on(anom.event_id == lb.event_id).where(anom.fid == fid) * Query.from_(normal).select(lb.call_stack_label).inner_join(lb).on(normal.event_id == lb.event_id).where(normal.fid == fid)
         else:
             raise Exception("Invalid subset")
-        
-        labels = self(q).fetchnumpy()['call_stack_label']
-        ulabels = dict()
-        for l in labels:
-            if l not in ulabels.keys():
-                ulabels[l] = 1
-            else:
-                ulabels[l] += 1
-        return ulabels
+
+        r = self("SELECT call_stack_label, COUNT(*) AS count FROM (%s) AS r GROUP BY call_stack_label" % q.get_sql()).fetchnumpy()
+        return { l : int(c) for l, c in zip(r['call_stack_label'], r['count']) }
+
+    #Call stack aggregation. The events are grouped by call stack label once per database into a table of per-label counts, and the
+    #call stack of each label is resolved once into a table of paths. The call tree (the prefix tree of all call stacks) with the
+    #counts attributed to each node is then derived from these, such that analyses across all functions or the whole run require
+    #a single query on small tables. The tables are stored in the summary store if one is in use
+
+    #Return the table (pid, fid, call_stack_label, anomaly_count, normal_count, accum_sev) of event counts and accumulated anomaly
+    #severity by function and call stack label, creating it on first call
+    def callStackLabelCountTable(self) -> Table:
+        anom = self.anomalies
+        normal = self.normal_execs
+        lb = self.call_stack_labels
+        return self._materializedTable("call_stack_label_counts", "SELECT e.pid, e.fid, lb.call_stack_label, \
+SUM(e.anom)::BIGINT AS anomaly_count, SUM(1 - e.anom)::BIGINT AS normal_count, SUM(e.outlier_severity) AS accum_sev \
+FROM (SELECT event_id, pid, fid, 1 AS anom, outlier_severity FROM %s UNION ALL SELECT event_id, pid, fid, 0 AS anom, 0.0 AS outlier_severity FROM %s) AS e \
+INNER JOIN %s AS lb ON lb.event_id = e.event_id GROUP BY e.pid, e.fid, lb.call_stack_label" % (anom.get_sql(), normal.get_sql(), lb.get_sql()))
+
+    #Return the table (call_stack_label, entry_idx, fid) of the call stack of every label, creating it on first call
+    #As for getEventCallStack, entry_idx 0 is the function itself and the largest entry_idx is the root
+    def callStackPathTable(self) -> Table:
+        lb = self.call_stack_labels
+        cs = self.call_stacks
+        cse = self.call_stack_events
+        return self._materializedTable("call_stack_paths", "SELECT r.call_stack_label, cs.entry_idx, cse.fid \
+FROM (SELECT call_stack_label, MIN(event_id) AS event_id FROM %s GROUP BY call_stack_label) AS r \
+INNER JOIN %s AS cs ON cs.event_id = r.event_id INNER JOIN %s AS cse ON cse.event_id = cs.call_stack_entry_id" % (lb.get_sql(), cs.get_sql(), cse.get_sql()))
+
+    #Return the call tree table, creating it on first call. Each node is a distinct call path prefix (from the root) within a program:
+    #  pid, node : the program index and the node identifier (a hash of the path, as text: the hash of a list does not distinguish
+    #              leading zeros, e.g. of paths [0, 5] and [5])
+    #  parent : the identifier of the parent node (NULL for roots)
+    #  depth : the depth of the node, starting at 1 for roots
+    #  fid : the function at the node
+    #  anomaly_count, normal_count, accum_sev : inclusive counts, over all call stacks passing through the node
+    #  self_anomaly_count, self_normal_count, self_accum_sev : counts of the events executing the function at the node
+    def callTreeTable(self) -> Table:
+        p = self.callStackPathTable()
+        c = self.callStackLabelCountTable()
+        return self._materializedTable("call_tree", "WITH paths AS (SELECT call_stack_label, list(fid ORDER BY entry_idx DESC) AS path FROM %s GROUP BY call_stack_label), \
+counts AS (SELECT pid, call_stack_label, SUM(anomaly_count) AS anom, SUM(normal_count) AS norm, SUM(accum_sev) AS sev FROM %s GROUP BY pid, call_stack_label), \
+depths AS (SELECT c.pid, p.path, unnest(range(1, len(p.path) + 1)) AS depth, c.anom, c.norm, c.sev FROM paths AS p INNER JOIN counts AS c ON c.call_stack_label = p.call_stack_label), \
+nodes AS (SELECT pid, path[1:depth] AS prefix, CASE WHEN depth = 1 THEN NULL ELSE hash(path[1:depth-1]::VARCHAR) END AS parent, depth, path[depth] AS fid, \
+depth = len(path) AS leaf, anom, norm, sev FROM depths) \
+SELECT pid, hash(prefix::VARCHAR) AS node, parent, depth, fid, \
+SUM(anom)::BIGINT AS anomaly_count, SUM(norm)::BIGINT AS normal_count, SUM(sev) AS accum_sev, \
+SUM(CASE WHEN leaf THEN anom ELSE 0 END)::BIGINT AS self_anomaly_count, SUM(CASE WHEN leaf THEN norm ELSE 0 END)::BIGINT AS self_normal_count, \
+SUM(CASE WHEN leaf THEN sev ELSE 0 END) AS self_accum_sev \
+FROM nodes GROUP BY pid, prefix, parent, depth, fid" % (p.get_sql(), c.get_sql()))
+
+    #Return the counts of events by call stack label for all functions (or those in 'fids') as a table with columns
+    #fid, call_stack_label, count, sorted by function index and descending count. 'subset' is as for getFunctionCallStackLabelsAndCounts
+    def getCallStackLabelCounts(self, fids = None, subset = 'anomalies', compact = False):
+        c = self.callStackLabelCountTable()
+        where = ""
+        if fids is not None:
+            where = "WHERE fid IN (%s)" % ",".join(str(int(f)) for f in numpy.asarray(fids).ravel())
+        return self._result(self("SELECT fid, call_stack_label, count FROM (SELECT fid, call_stack_label, SUM(%s)::BIGINT AS count FROM %s %s GROUP BY fid, call_stack_label) \
+WHERE count > 0 ORDER BY fid, count DESC, call_stack_label" % (self._labelCountColumn(subset), c.get_sql(), where)), compact)
+
+    #Return the call tree of program 'pid' with the function names, for flame-graph-style inclusive attribution of anomalies
+    #and executions to call paths. See callTreeTable for the columns. The output is sorted by depth and descending inclusive
+    #accumulated severity
+    #The nodes can be plotted as a flame graph using e.g. plotly.graph_objects.Icicle with ids=node, parents=parent (with "" for
+    #the roots), labels=name and values=anomaly_count, branchvalues="total"
+    def getCallTree(self, pid):
+        t = self.callTreeTable()
+        f = self.functions
+        return self(Query.from_(t).select(t.star, f.name).left_join(f).on( (f.pid == t.pid) & (f.fid == t.fid) )
+                    .where(t.pid == pid).orderby(t.depth).orderby(t.accum_sev, order=Order.desc) )
     
     #Return the function profile information
     def getFunctionProfile(self, fid, excl_or_incl):
@@ -153,28 +709,28 @@ class ProvenanceDatabase:
 
 
     #Get an application profile. If "exclusive" it will also show the accumulated severity and anomaly time fraction
-    def getApplicationProfile(self, excl_or_incl):
+    def getApplicationProfile(self, excl_or_incl, compact = False):
         if excl_or_incl == 'exclusive':
             exc = self.func_runtime_profile_exclusive_stats
             fname = self.functions
             sev = self.func_anomaly_severity_stats
-            return self( Query.from_(exc).select( \
+            r = self._summary("application_profile_exclusive", Query.from_(exc).select( \
                                           exc.accumulate.as_("runtime"), sev.accumulate.as_("accum_sev"), exc.fid, \
                                           fn.Cast( (sev.accumulate / exc.accumulate), 'DECIMAL(5, 4)' ).as_("anom_time_frac"), \
                                           fname.name, 
                                          )\
                  .inner_join(fname).on(fname.fid == exc.fid)\
-                 .inner_join(sev).on(sev.fid == exc.fid)\
-                 .orderby(exc.accumulate, order=Order.desc) )
+                 .inner_join(sev).on(sev.fid == exc.fid) )
+            return self._result(self( Query.from_(r).select('*').orderby(Field("runtime"), order=Order.desc) ), compact)
         elif excl_or_incl == 'inclusive':
             exc = self.func_runtime_profile_inclusive_stats
             fname = self.functions
-            return self( Query.from_(exc).select( \
+            r = self._summary("application_profile_inclusive", Query.from_(exc).select( \
                                           exc.accumulate.as_("runtime_incl"), exc.fid, \
                                           fname.name, 
                                          )\
-                 .inner_join(fname).on(fname.fid == exc.fid)\
-                 .orderby(exc.accumulate, order=Order.desc) )
+                 .inner_join(fname).on(fname.fid == exc.fid) )
+            return self._result(self( Query.from_(r).select('*').orderby(Field("runtime_incl"), order=Order.desc) ), compact)
         else:
             raise Exception("Invalid profile type")      
     
@@ -182,7 +738,12 @@ class ProvenanceDatabase:
     #  accumulated severity (order_by="anom_severity")
     #  anomaly count (order_by="anom_count")
     #  exclusive total runtime (order_by="total_time_excl")
-    def topFunctions(self, order_by = 'anom_severity'):
+    def topFunctions(self, order_by = 'anom_severity', compact = False):
+        r, ob = self._topFunctionsTable(order_by)
+        return self._result(self(Query.from_(r).select('*').orderby(Field(ob), order=Order.desc)), compact)
+
+    #Return the source of the topFunctions table (a stored summary or a query) and its column sorted by for 'order_by'
+    def _topFunctionsTable(self, order_by):
         sev = self.func_anomaly_severity_stats
         func = self.functions
         acnt = self.func_anomaly_count_stats
@@ -190,15 +751,15 @@ class ProvenanceDatabase:
 
         ob = None
         if order_by == 'anom_severity':
-            ob = sev.accumulate
+            ob = "accum_sev"
         elif order_by == 'anom_count':
-            ob = acnt.accumulate
+            ob = "anomalies"
         elif order_by == 'total_time_excl':
-            ob = ecnt.accumulate
+            ob = "total_time_excl"
         else:
             raise Exception("Unsupported sort order")
                     
-        return self(Query.from_(sev).select(sev.accumulate.as_("accum_sev"), \
+        r = self._summary("top_functions", Query.from_(sev).select(sev.accumulate.as_("accum_sev"), \
                                             ecnt.accumulate.as_("total_time_excl"), \
                                             sev.fid, func.pid, \
                                             acnt.accumulate.as_("anomalies"), ecnt.count.as_("calls"), \
@@ -207,104 +768,402 @@ class ProvenanceDatabase:
                                             func.name )
             .inner_join(func).on(func.fid == sev.fid)
             .inner_join(acnt).on(func.fid == acnt.fid)
-            .inner_join(ecnt).on(func.fid == ecnt.fid)
-            .orderby(ob, order=Order.desc))
+            .inner_join(ecnt).on(func.fid == ecnt.fid))
+        return r, ob
         
+    #Approximate analyses for a first look at very large runs. These compute the summaries from a random sample of a fraction
+    #'fraction' of the events rather than the full tables, and report confidence intervals at level 'confidence' for the estimates
+    #(columns suffixed by "_err" give the half-width of the interval). Totals are estimated by scaling the sample totals by 1/fraction
+    #sampling : the DuckDB sampling method; "system" samples blocks of rows and is fastest, "bernoulli" samples individual rows.
+    #           The intervals assume rows are sampled independently, hence are approximate for "system". As the blocks hold
+    #           thousands of rows, "system" is only suited to large tables; on small ones the sample is often empty
+    #seed : the seed of the sample, such that the results are repeatable
+    #Functions or call stacks without any event in the sample are absent from the results
+
+    #Return the SQL of a sample of the columns 'cols' of the table
+    def _sampleQuery(self, tab : Table, cols, fraction, sampling, seed, where = None):
+        if not (0 < fraction <= 1):
+            raise Exception("The sample fraction must be in (0, 1]")
+        if sampling not in ("system", "bernoulli"):
+            raise Exception("Invalid sampling method")
+        return "SELECT %s FROM %s %s USING SAMPLE %r PERCENT (%s, %d)" % (cols, tab.get_sql(), "" if where is None else "WHERE " + where, 100.0*fraction, sampling, seed)
+
+    def _z(self, confidence):
+        return statistics.NormalDist().inv_cdf(0.5 + confidence/2)
+
+    #Approximate version of topFunctions for order_by "anom_severity" or "anom_count", estimated from a sample of the anomalies
+    #Columns: fid, name, anomalies, anomalies_err, accum_sev, accum_sev_err, sampled (the number of sampled anomalies), and the
+    #bounds rank_best, rank_worst of the rank of the function implied by the confidence intervals. The functions that may be in
+    #the top n are those with rank_best <= n; see refineTopFunctions for an exact follow-up
+    def approxTopFunctions(self, order_by = 'anom_severity', fraction = 0.01, confidence = 0.95, sampling = "system", seed = 1234):
+        if order_by == 'anom_severity':
+            key = "accum_sev"
+        elif order_by == 'anom_count':
+            key = "anomalies"
+        else:
+            raise Exception("Unsupported sort order")
+        z = self._z(confidence)
+        f = float(fraction)
+        return self("WITH s AS (%s), \
+e AS (SELECT fid, COUNT(*) AS c, SUM(outlier_severity) AS sv, SUM(outlier_severity * outlier_severity) AS sv2 FROM s GROUP BY fid), \
+t AS (SELECT e.fid, fn.name, e.c / %r AS anomalies, %r * SQRT(e.c * (1 - %r)) / %r AS anomalies_err, \
+e.sv / %r AS accum_sev, %r * SQRT(e.sv2 * (1 - %r)) / %r AS accum_sev_err, e.c AS sampled \
+FROM e LEFT JOIN (SELECT fid, FIRST(name) AS name FROM %s GROUP BY fid) AS fn ON fn.fid = e.fid), \
+b AS (SELECT *, %s - %s_err AS _lo, %s + %s_err AS _hi FROM t) \
+SELECT b.* EXCLUDE (_lo, _hi), 1 + (SELECT COUNT(*) FROM b AS b2 WHERE b2._lo > b._hi) AS rank_best, \
+(SELECT COUNT(*) FROM b AS b2 WHERE b2._hi >= b._lo) AS rank_worst FROM b ORDER BY %s DESC" % (
+            self._sampleQuery(self.anomalies, "fid, outlier_severity", f, sampling, seed),
+            f, z, f, f, f, z, f, f, self.functions.get_sql(), key, key, key, key, key))
+
+    #Exact follow-up to approxTopFunctions: the exact top 'n' functions (as topFunctions) by 'order_by', computed only from the
+    #statistics of the candidate functions whose confidence intervals in 'approx' allow them to be in the top n
+    #order_by, confidence : as used to compute 'approx'
+    #The functions absent from the sample are candidates unless their total is bounded below the top n: for the anomaly count, by the
+    #largest count that goes unsampled with probability 1-confidence. Their severity is not bounded by the sample, hence for
+    #order_by="anom_severity" they are always candidates
+    def refineTopFunctions(self, approx, n = 10, order_by = 'anom_severity', confidence = 0.95):
+        r, ob = self._topFunctionsTable(order_by)
+        if ob == "total_time_excl":
+            raise Exception("Unsupported sort order")
+        a = approx.fetchnumpy()
+        sampled = numpy.asarray(a["fid"], dtype=numpy.int64)
+        est = numpy.asarray(a[ob], dtype=numpy.float64)
+        err = numpy.asarray(a[ob + "_err"], dtype=numpy.float64)
+        func = self.functions
+        unsampled = numpy.setdiff1d(numpy.asarray(self(Query.from_(func).select(func.fid).distinct()).fetchnumpy()["fid"], dtype=numpy.int64), sampled)
+
+        #Upper bound on the total of the unsampled functions. The sample fraction is that of the estimates
+        unsampled_hi = numpy.inf
+        if ob == "anomalies" and len(sampled) > 0:
+            f = float(a["sampled"][0]) / est[0]
+            unsampled_hi = 0.0 if f >= 1 else numpy.log(1 - confidence) / numpy.log(1 - f)
+
+        #A function may be in the top n if its upper bound reaches the n-th largest lower bound (0 for the unsampled functions)
+        lo = numpy.sort(numpy.concatenate((est - err, numpy.zeros(len(unsampled)))))[::-1]
+        nth = lo[n-1] if len(lo) >= n else -numpy.inf
+        cand = sampled[est + err >= nth]
+        if unsampled_hi >= nth:
+            cand = numpy.concatenate((cand, unsampled))
+        #Without any function in the database there is nothing to refine
+        if len(cand) == 0:
+            return self.topFunctions(order_by).limit(n)
+        return self(Query.from_(r).select('*').where(Field("fid").isin([ int(c) for c in cand ])).orderby(Field(ob), order=Order.desc).limit(n))
+
+    #Approximate version of getApplicationProfile, estimated from a sample of the recorded events (anomalies and normal executions)
+    #Columns: fid, name, runtime (or runtime_incl), runtime_err, the approximate median and 99th percentile of the execution time,
+    #the approximate number of distinct ranks on which the function was sampled, and the number of sampled events
+    #As Chimbuko records only a subset of the normal executions, the estimates describe the recorded events
+    def approxApplicationProfile(self, excl_or_incl, fraction = 0.01, confidence = 0.95, sampling = "system", seed = 1234):
+        if excl_or_incl == 'exclusive':
+            col, out = "runtime_exclusive", "runtime"
+        elif excl_or_incl == 'inclusive':
+            col, out = "runtime_total", "runtime_incl"
+        else:
+            raise Exception("Invalid profile type")
+        z = self._z(confidence)
+        f = float(fraction)
+        cols = "fid, rid, %s::DOUBLE AS v" % col
+        return self("WITH s AS (%s UNION ALL %s) \
+SELECT s.fid, FIRST(fn.name) AS name, SUM(s.v) / %r AS %s, %r * SQRT(SUM(s.v * s.v) * (1 - %r)) / %r AS %s_err, \
+APPROX_QUANTILE(s.v, 0.5) AS median, APPROX_QUANTILE(s.v, 0.99) AS p99, APPROX_COUNT_DISTINCT(s.rid) AS ranks, COUNT(*) AS sampled \
+FROM s LEFT JOIN (SELECT fid, FIRST(name) AS name FROM %s GROUP BY fid) AS fn ON fn.fid = s.fid GROUP BY s.fid ORDER BY %s DESC" % (
+            self._sampleQuery(self.anomalies, cols, f, sampling, seed), self._sampleQuery(self.normal_execs, cols, f, sampling, seed),
+            f, out, z, f, f, out, self.functions.get_sql(), out))
+
+    #Approximate version of getCallStackSummaries, estimated from a sample of the anomalies of program 'pid'
+    #Columns: call_stack_label, anomaly_count, anomaly_count_err, avg_severity, avg_severity_err, fname, fname_hash, sampled
+    def approxCallStackSummaries(self, pid, fraction = 0.01, confidence = 0.95, sampling = "system", seed = 1234):
+        z = self._z(confidence)
+        f = float(fraction)
+        return self("WITH s AS (%s) \
+SELECT cl.call_stack_label, COUNT(*) / %r AS anomaly_count, %r * SQRT(COUNT(*) * (1 - %r)) / %r AS anomaly_count_err, \
+AVG(s.outlier_severity) AS avg_severity, %r * COALESCE(STDDEV_SAMP(s.outlier_severity), 0) / SQRT(COUNT(*)) AS avg_severity_err, \
+FIRST(fn.name) AS fname, hash(FIRST(fn.name)) AS fname_hash, COUNT(*) AS sampled \
+FROM s INNER JOIN %s AS cl ON cl.event_id = s.event_id INNER JOIN %s AS fn ON fn.fid = s.fid \
+GROUP BY cl.call_stack_label ORDER BY avg_severity DESC" % (
+            self._sampleQuery(self.anomalies, "event_id, fid, outlier_severity", f, sampling, seed, "pid = %d" % pid),
+            f, z, f, f, z, self.call_stack_labels.get_sql(), self.functions.get_sql()))
+
+    #Time normalization. The start time of each rank's run is the start of its first io step. These are gathered once per
+    #database into a (pid, rid, run_start) table such that conversions to seconds since the start of the run require only a
+    #single hash join (in SQL) or a vectorized lookup (in numpy) rather than a query per row/call
+
+    #Return the table of run start times (pid, rid, run_start), creating it on first call
+    def runStartTable(self) -> Table:
+        with self.pdb_con.lock:
+            if self._run_start is None:
+                d = self.io_steps
+                q = Query.from_(d).select(d.pid, d.rid, fn.Min(d.io_step_tstart).as_("run_start")).where(d.io_step == 0).groupby(d.pid, d.rid)
+                self._run_start = self._materializedTable("run_start", q)
+        return self._run_start
+
+    #Return the run start times as a dictionary of numpy arrays "pid", "rid", "run_start" sorted by (pid, rid)
+    def runStartTimes(self):
+        with self.pdb_con.lock:
+            if self._run_start_times is None:
+                rs = self.runStartTable()
+                r = self.pdb_con(Query.from_(rs).select(rs.pid, rs.rid, rs.run_start).orderby(rs.pid, rs.rid)).fetchnumpy()
+                r = { k : numpy.asarray(v, dtype=numpy.int64) for k, v in r.items() }
+                r["nrank"] = (numpy.max(r["rid"]) + 1) if len(r["rid"]) > 0 else 0
+                r["key"] = r["pid"] * r["nrank"] + r["rid"]
+                self._run_start_times = r
+        return self._run_start_times
+
+    #Return the index into runStartTimes() for arrays of pid and rid
+    def _runStartIndex(self, pid, rid):
+        rs = self.runStartTimes()
+        keys = rs["key"]
+        if len(keys) == 0:
+            raise Exception("No run start times in the database")
+        pid, rid = numpy.broadcast_arrays(numpy.asarray(pid, dtype=numpy.int64), numpy.asarray(rid, dtype=numpy.int64))
+        key = pid * rs["nrank"] + rid
+        idx = numpy.minimum(numpy.searchsorted(keys, key), len(keys)-1)
+        found = (rid < rs["nrank"]) & (keys[idx] == key)
+        if not numpy.all(found):
+            raise Exception("Could not find the run start time for pid/rank ", pid[~found][0], rid[~found][0])
+        return idx
+
     def getRunStartTime(self, pid, rank):
-        d = self.io_steps
-        return self(Query.from_(d).select(d.io_step_tstart)
-            .where( (d.pid == pid) & (d.rid == rank) & (d.io_step) == 0 ) ).fetchnumpy()['io_step_tstart'][0]
+        return self.runStartTimes()["run_start"][self._runStartIndex(pid, rank)]
+
+    #Convert unix times (in microseconds) to seconds since the start of the run for the given pid and rank
+    #All arguments can be arrays (of the same length) or scalars
+    def toSecondsSinceStart(self, pid, rid, times):
+        return (numpy.asarray(times) - self.getRunStartTime(pid, rid))/1e6
 
     #Convert unix time column "col_name_in" to a new column "col_name_out" given as seconds since the start of the run
     #The table must contain a "pid" and "rid" column
+    #Multiple columns can be converted at once by passing lists for col_name_in and col_name_out
+    #A string 'table' is used as raw SQL, e.g. a qualified name such as "pdb_0.anomalies" or a parenthesized subquery
     def convertColumnToSecondsSinceStart(self, table: Table, col_name_in, col_name_out):
+        if isinstance(col_name_in, str):
+            col_name_in = [col_name_in]
+            col_name_out = [col_name_out]
         if isinstance(table, Table):
-            tab_nm = table.get_sql()
+            return self(self._secondsSinceStartQuery(Query.from_(table).select(table.star), table, col_name_in, col_name_out))
         elif isinstance(table, str):
-            tab_nm = table
+            return self("SELECT t.*, %s FROM %s AS t LEFT JOIN %s AS rs ON rs.pid = t.pid AND rs.rid = t.rid" % (
+                ", ".join("(%s - rs.run_start)/1e6 AS %s" % (i, o) for i, o in zip(col_name_in, col_name_out)), table, self.runStartTable().get_sql()))
         else:
             assert 0
-        io_steps_tab = self.io_steps.get_sql()
-        
-        return self("FROM %s SELECT *, (%s - (FROM %s SELECT FIRST(io_step_tstart) WHERE pid = %s.pid AND rid = %s.rid AND io_step = 0))/1e6 AS %s" % (tab_nm,col_name_in,io_steps_tab,tab_nm,tab_nm, col_name_out ) )
 
-    #List the anomalies/normal_execs for a particular function, with extra columns containing the entry and exit time in seconds since the rank's job started    
-    def getFunctionEvents(self, fid, etype):
-        tab = None
+    #Add the columns 'cols_out' containing the unix time columns 'cols_in' of 'tab' in seconds since the start of the run to the query 'q'
+    def _secondsSinceStartQuery(self, q, tab, cols_in, cols_out):
+        rs = self.runStartTable()
+        return q.select(*[ ((tab.field(i) - rs.run_start)/1e6).as_(o) for i, o in zip(cols_in, cols_out) ]) \
+                .left_join(rs).on( (rs.pid == tab.pid) & (rs.rid == tab.rid) )
+
+    #Return the primary table for the event type "anomalies" or "normal_execs"
+    def _eventTable(self, etype) -> Table:
         if etype == "anomalies":
-            tab = self.anomalies
+            return self.anomalies
         elif etype == "normal_execs":
-            tab = self.normal_execs
+            return self.normal_execs
         else:
             raise Exception("Invalid event type")
-        
-        ios = self.io_steps
-        self( Query.from_(tab).select(tab.star).where(tab.fid == fid).orderby(tab.exit, order=Order.desc) ).to_view("_getEvents_r1")
-        self.convertColumnToSecondsSinceStart("_getEvents_r1", "entry", "entry_s").to_view("_getEvents_r2")
-        return self.convertColumnToSecondsSinceStart("_getEvents_r2", "exit", "exit_s")
 
-    
+    def _functionEventsQuery(self, fid, etype, ordered = True):
+        tab = self._eventTable(etype)
+        q = Query.from_(tab).select(tab.star).where(tab.fid == fid)
+        if ordered:
+            q = q.orderby(tab.exit, order=Order.desc)
+        return self._secondsSinceStartQuery(q, tab, ["entry", "exit"], ["entry_s", "exit_s"])
+
+    #List the anomalies/normal_execs for a particular function, with extra columns containing the entry and exit time in seconds since the rank's job started    
+    def getFunctionEvents(self, fid, etype, compact = False):
+        return self._result(self(self._functionEventsQuery(fid, etype)), compact)
+
+    #Streaming access to large results. Rather than materializing the full result in memory, these yield Arrow record batches
+    #of at most 'batch_size' rows such that the memory usage is bounded regardless of the number of events. Requires pyarrow
+
+    #Stream the result of a query (query builder, SQL string or relation) as Arrow record batches
+    def iterRecordBatches(self, query, batch_size = 1000000):
+        requirePyarrow("Streaming")
+        rel = query if isinstance(query, duckdb.DuckDBPyRelation) else self(query, cache=False)
+        for batch in rel.fetch_arrow_reader(batch_size):
+            yield batch
+
+    #Stream the anomalies/normal_execs for a particular function with the columns of getFunctionEvents
+    #ordered : if True, order by descending exit time as getFunctionEvents. This requires the full result to be sorted before the
+    #          first batch is produced, hence it is disabled by default
+    def iterFunctionEvents(self, fid, etype, batch_size = 1000000, ordered = False):
+        return self.iterRecordBatches(self._functionEventsQuery(fid, etype, ordered), batch_size)
+
+    #Stream the anomaly times of getAnomalyTimes as numpy arrays of at most 'batch_size' entries
+    def iterAnomalyTimes(self, pid, rid, fid=None, batch_size = 1000000):
+        d = self.anomalies
+        cond = (d.pid==pid) & (d.rid==rid)
+        if fid is not None:
+            cond = cond & (d.fid==fid)
+        start = self.getRunStartTime(pid,rid)
+        for batch in self.iterRecordBatches(Query.from_(d).select(d.exit).where(cond), batch_size):
+            yield (batch.column(0).to_numpy() - start)/1e6
+
+    #Write the events (with the entry_s/exit_s columns of getFunctionEvents) to a Parquet dataset at 'path', partitioned into
+    #directories by the columns 'partition_by' (hive-style, e.g. path/pid=0/rid=3/fid=12/data_0.parquet)
+    #etype : "anomalies", "normal_execs" or "both". For "both" an additional "event_type" column records the source table
+    #fids : optionally restrict to a list of function indices
+    #The data are streamed from the database to the files by DuckDB such that memory usage is bounded
+    def exportEventsToParquet(self, path : str, etype = "both", fids = None, partition_by = ("pid", "rid", "fid"), overwrite = False):
+        etypes = ["anomalies", "normal_execs"] if etype == "both" else [etype]
+        qs = []
+        for e in etypes:
+            tab = self._eventTable(e)
+            q = Query.from_(tab).select(tab.star)
+            if etype == "both":
+                q = q.select(pypika.terms.ValueWrapper(e).as_("event_type"))
+            if fids is not None:
+                q = q.where(tab.fid.isin([ int(f) for f in numpy.asarray(fids).ravel() ]))
+            qs.append(self._secondsSinceStartQuery(q, tab, ["entry", "exit"], ["entry_s", "exit_s"]).get_sql())
+        opts = "FORMAT PARQUET, PARTITION_BY (%s)" % ", ".join(partition_by)
+        if overwrite:
+            opts += ", OVERWRITE_OR_IGNORE"
+        self.pdb_con("COPY (%s) TO '%s' (%s)" % (" UNION ALL ".join(qs), path.replace("'", "''"), opts), cache=False)
+        return path
+
+    #Event index. The event ids of both primary tables are gathered once per database into a single table
+    #  event_id, event_key : the event id and its hash
+    #  etype : the primary table of the event, "anomalies" or "normal_execs"
+    #  pid, rid, fid, entry, exit : as in the primary table
+    #sorted by event_key, such that a lookup of an event by its key reads only the block of the table containing it rather than
+    #scanning both primary tables. The index is stored in the summary store if one is in use
+
+    #Return the event index table, creating it on first call
+    def eventIndexTable(self) -> Table:
+        q = " UNION ALL ".join( "SELECT hash(event_id) AS event_key, event_id, '%s' AS etype, pid, rid, fid, entry, exit FROM %s" % (e, self._eventTable(e).get_sql())
+                                for e in ["anomalies", "normal_execs"] )
+        return self._materializedTable("event_index", "SELECT * FROM (%s) ORDER BY event_key" % q)
+
+    #Return the condition selecting the event from the event index 'ix'
+    def _eventIndexLookup(self, ix : Table, event_id):
+        return (ix.event_key == fn.Function("hash", str(event_id))) & (ix.event_id == str(event_id))
+
+    #Look up many events in the event index
+    #event_ids : an array/list of event ids, a relation or a table/query with an "event_id" column
+    #Return a table with the columns of the event index (excluding event_key) in the input order. Event ids that are not in the
+    #database are omitted. See _eventIdQuery for the form of the result
+    def lookupEvents(self, event_ids, compact = False):
+        ix = self.eventIndexTable()
+        return self._eventIdQuery(lambda ids: "SELECT ix.* EXCLUDE (event_key) FROM %s AS ids INNER JOIN %s AS ix ON ix.event_key = hash(ids.event_id) AND ix.event_id = ids.event_id \
+ORDER BY ids.pos" % (ids, ix.get_sql()), event_ids, compact)
+
     #Return the primary table (anomalies / normal_execs) for the specific event
     def getEventPrimaryTable(self, event_id):
-        d=self.anomalies
-        if(len(
-                self( Query.from_(d).select(d.event_id).where(d.event_id == event_id)).fetchnumpy()['event_id'] 
-        ) != 0):
-            return d
-        d=self.normal_execs
-        if(len(
-                self( Query.from_(d).select(d.event_id).where(d.event_id == event_id)).fetchnumpy()['event_id'] 
-        ) != 0):
-            return d
-        raise Exception("Could not find event ",event_id)
+        ix = self.eventIndexTable()
+        r = self(Query.from_(ix).select(ix.etype).where(self._eventIndexLookup(ix, event_id))).fetchone()
+        if r is None:
+            raise Exception("Could not find event ",event_id)
+        return self._eventTable(r[0])
 
-    #Return the node memory status recorded at a timestamp as close as possible to the function execution timestamp
-    def getEventNodeMemoryStatus(self, event_id):
-        prim=self.getEventPrimaryTable(event_id)
+    #Return the node state recorded for the given event along with the entry, exit and state timestamps in seconds since the start
+    #of the run. 'cols' is a list of (node_state column, output column name)
+    def _getEventNodeStatus(self, event_id, cols):
+        self.getEventPrimaryTable(event_id) #check the event exists
+        prim=self.eventIndexTable()
         ns=self.node_state
         nn=self.rank_node_map
-        r = self(Query.from_(prim).select(prim.entry,prim.exit,prim.pid,prim.rid,ns.star,nn.hostname)
-                 .inner_join(ns).on(ns.event_id == prim.event_id).where(prim.event_id == event_id)
-                 .inner_join(nn).on( (nn.pid == prim.pid) & (nn.rid == prim.rid) )
-                 ).to_view("r")
-
-        #Convert the times into seconds since start
-        rt = Table("r")
-        rid = r.fetchnumpy()['rid'][0]
-        pid = r.fetchnumpy()['pid'][0]
-        
-        start = self.getRunStartTime(rid,pid)
-        s = self(Query.from_(rt).select( ( (rt.entry - start)/1e6 ).as_("entry_s") , ( (rt.exit - start)/1e6 ).as_("exit_s"),  ( (rt.timestamp - start)/1e6 ).as_("state_timestamp_s"), rt.star    )).to_view("s")
-        return self('SELECT "pid", "rid", "hostname", "state_timestamp_s", "entry_s", "exit_s", \
-"meminfo:MemFree (MB)" AS "free_MB", \
-"meminfo:MemTotal (MB)" AS "total_MB", \
-"Memory Footprint (VmRSS) (KB)" AS "RSS_KB", \
-"Heap Memory Used (KB)" AS "heap_memory_used_KB", \
-FROM "s"')
+        rs=self.runStartTable()
+        return self(Query.from_(prim).select(prim.pid, prim.rid, nn.hostname,
+                                             ( (ns.timestamp - rs.run_start)/1e6 ).as_("state_timestamp_s"),
+                                             ( (prim.entry - rs.run_start)/1e6 ).as_("entry_s"),
+                                             ( (prim.exit - rs.run_start)/1e6 ).as_("exit_s"),
+                                             *[ ns.field(c).as_(o) for c, o in cols ])
+                    .inner_join(ns).on(ns.event_id == prim.event_id)
+                    .inner_join(nn).on( (nn.pid == prim.pid) & (nn.rid == prim.rid) )
+                    .inner_join(rs).on( (rs.pid == prim.pid) & (rs.rid == prim.rid) )
+                    .where(self._eventIndexLookup(prim, event_id)) )
+
+    #The node_state columns (node_state column, output column name) of the memory and CPU status
+    node_memory_columns = [ ("meminfo:MemFree (MB)", "free_MB"),
+                            ("meminfo:MemTotal (MB)", "total_MB"),
+                            ("Memory Footprint (VmRSS) (KB)", "RSS_KB"),
+                            ("Heap Memory Used (KB)", "heap_memory_used_KB") ]
+    node_cpu_columns = [ ("cpu: User %", "cpu_user_%"),
+                         ("cpu: Nice %", "cpu_nice_%"),
+                         ("cpu: System %", "cpu_system_%"),
+                         ("cpu: Idle %", "cpu_idle_%") ]
+
+    #Return the node memory status recorded at a timestamp as close as possible to the function execution timestamp
+    def getEventNodeMemoryStatus(self, event_id):
+        return self._getEventNodeStatus(event_id, self.node_memory_columns)
 
     #Return the node memory status recorded at a timestamp as close as possible to the function execution timestamp
     def getEventNodeCPUstatus(self, event_id):
-        prim=self.getEventPrimaryTable(event_id)
-        ns=self.node_state
-        nn=self.rank_node_map
-        r = self(Query.from_(prim).select(prim.entry,prim.exit,prim.pid,prim.rid,ns.star,nn.hostname)
-                 .inner_join(ns).on(ns.event_id == prim.event_id).where(prim.event_id == event_id)
-                 .inner_join(nn).on( (nn.pid == prim.pid) & (nn.rid == prim.rid) )
-                 ).to_view("r")
-
-        #Convert the times into seconds since start
-        rt = Table("r")
-        rid = r.fetchnumpy()['rid'][0]
-        pid = r.fetchnumpy()['pid'][0]
-        
-        start = self.getRunStartTime(rid,pid)
-        s = self(Query.from_(rt).select( ( (rt.entry - start)/1e6 ).as_("entry_s") , ( (rt.exit - start)/1e6 ).as_("exit_s"),  ( (rt.timestamp - start)/1e6 ).as_("state_timestamp_s"), rt.star    )).to_view("s")
-        return self('SELECT "pid", "rid", "hostname", "state_timestamp_s", "entry_s", "exit_s", \
-"cpu: User %" AS "cpu_user_%", \
-"cpu: Nice %" AS "cpu_nice_%", \
-"cpu: System %" AS "cpu_system_%", \
-"cpu: Idle %" AS "cpu_idle_%", \
-FROM "s"')
+        return self._getEventNodeStatus(event_id, self.node_cpu_columns)
+
+    #Execute the query 'query(ids)' on the table 'ids' (event_id, pos) of the event ids, where pos is the position in the input
+    #event_ids : an array/list of event ids, a relation or a table/query with an "event_id" column
+    #A table or query is used as a subquery, such that the result is a relation evaluated lazily. An array/list or a relation is
+    #registered on the cursor only for the duration of the query, such that nothing is left in the connection, hence the result
+    #is materialized; this requires pyarrow. With 'compact' the result is compacted as for _result
+    def _eventIdQuery(self, query, event_ids, compact = False):
+        if isinstance(event_ids, (Table, pypika.queries.QueryBuilder)):
+            src = event_ids.get_sql() if isinstance(event_ids, pypika.queries.QueryBuilder) else "SELECT event_id FROM %s" % event_ids.get_sql()
+            return self._result(self(query("(SELECT event_id, ROW_NUMBER() OVER () AS pos FROM (%s) AS r)" % src)), compact)
+        pa = requirePyarrow("Looking up an array or relation of events")
+        if isinstance(event_ids, duckdb.DuckDBPyRelation):
+            ids = event_ids.project("event_id::VARCHAR AS event_id").arrow()
+        else:
+            ids = pa.table({ "event_id" : pa.array([ str(e) for e in numpy.asarray(event_ids).ravel() ], type=pa.string()) })
+        ids = ids.append_column("pos", pa.array(numpy.arange(ids.num_rows, dtype=numpy.int64)))
+        nm = self.pdb_con.uniqueName("__event_ids")
+        sql = query(nm)
+        con = self.pdb_con.cursor()
+        con.register(nm, ids)
+        try:
+            rel = self(sql, cache=False)
+            return compactTable(rel) if compact else con.from_arrow(rel.arrow())
+        finally:
+            con.unregister(nm)
+
+    #Return the table of node state samples with the host on which they were recorded (hostname, timestamp, <node_state columns>),
+    #sorted by host and time, creating it on first call. Used to find the nearest sample for events without a node state record
+    def nodeStateSampleTable(self) -> Table:
+        ns = self.node_state
+        nn = self.rank_node_map
+        cols = ", ".join('ns."%s"' % c for c, o in self.node_memory_columns + self.node_cpu_columns)
+        return self._materializedTable("node_state_samples", "SELECT nn.hostname, ns.timestamp, %s FROM %s AS ns \
+INNER JOIN %s AS e ON e.event_id = ns.event_id \
+INNER JOIN %s AS nn ON nn.pid = e.pid AND nn.rid = e.rid ORDER BY nn.hostname, ns.timestamp" % (
+            cols, ns.get_sql(), self.eventIndexTable().get_sql(), nn.get_sql()))
+
+    #Bulk version of getEventNodeMemoryStatus/getEventNodeCPUstatus, resolving the node state of many events in a single query
+    #event_ids : an array/list of event ids, a relation or a table/query with an "event_id" column
+    #status : "memory", "cpu" or "both"
+    #nearest : if True, events without a node state record take the nearest sample recorded on the same node at or before the
+    #          event entry time (by an ASOF join)
+    #Return a table with the columns of getEventNodeMemoryStatus/getEventNodeCPUstatus preceded by the event_id, in the input
+    #order, and a column "state_source" that is "exact", "nearest" or NULL if no sample was found. Event ids that are not in the
+    #database are omitted
+    def getEventsNodeStatus(self, event_ids, status = 'both', nearest = True, compact = False):
+        if status == 'memory':
+            cols = self.node_memory_columns
+        elif status == 'cpu':
+            cols = self.node_cpu_columns
+        elif status == 'both':
+            cols = self.node_memory_columns + self.node_cpu_columns
+        else:
+            raise Exception("Invalid status type")
+        nn = self.rank_node_map
+        rs = self.runStartTable()
+        ix = self.eventIndexTable()
+        ev = lambda ids: "SELECT ids.pos, e.event_id, e.pid, e.rid, e.entry, e.exit, nn.hostname FROM %s AS ids \
+INNER JOIN %s AS e ON e.event_key = hash(ids.event_id) AND e.event_id = ids.event_id \
+INNER JOIN %s AS nn ON nn.pid = e.pid AND nn.rid = e.rid" % (ids, ix.get_sql(), nn.get_sql())
+        if nearest:
+            near = "ASOF LEFT JOIN %s AS s ON s.hostname = ev.hostname AND ev.entry >= s.timestamp" % self.nodeStateSampleTable().get_sql()
+            val = lambda c: 'CASE WHEN ns.event_id IS NOT NULL THEN ns."%s" ELSE s."%s" END' % (c,c)
+            source = "CASE WHEN ns.event_id IS NOT NULL THEN 'exact' WHEN s.timestamp IS NOT NULL THEN 'nearest' END"
+        else:
+            near = ""
+            val = lambda c: 'ns."%s"' % c
+            source = "CASE WHEN ns.event_id IS NOT NULL THEN 'exact' END"
+        return self._eventIdQuery(lambda ids: 'SELECT ev.event_id, ev.pid, ev.rid, ev.hostname, (%s - rs.run_start)/1e6 AS state_timestamp_s, \
+(ev.entry - rs.run_start)/1e6 AS entry_s, (ev.exit - rs.run_start)/1e6 AS exit_s, %s AS state_source, %s \
+FROM (%s) AS ev LEFT JOIN %s AS ns ON ns.event_id = ev.event_id %s \
+INNER JOIN %s AS rs ON rs.pid = ev.pid AND rs.rid = ev.rid ORDER BY ev.pos' % (
+            val("timestamp"), source, ", ".join('%s AS "%s"' % (val(c), o) for c, o in cols),
+            ev(ids), self.node_state.get_sql(), near, rs.get_sql()), event_ids, compact)
     
     #Produce a table for a specific process pid containing:
     #- the call stack label
@@ -313,12 +1172,157 @@ FROM "s"')
     #- the function name and a corresponding hash
     #
     #The output is sorted according to the average severity in descending order
-    def getCallStackSummaries(self, pid):
+    def getCallStackSummaries(self, pid, compact = False):
         d = self.anomalies
         cl = self.call_stack_labels
         f = self.functions
-        self(Query.from_(d).select(d.outlier_severity, cl.call_stack_label, f.name).where(d.pid==0).inner_join(cl).on(d.event_id == cl.event_id).inner_join(f).on(d.fid == f.fid) ).to_view("r")
-        return self("SELECT call_stack_label, count(*) as anomaly_count, AVG(outlier_severity) as avg_severity, first(name) as fname, hash(first(name)) as fname_hash, FROM r GROUP BY call_stack_label ORDER BY avg_severity DESC")
-    
-            
+        if self.summaries is not None:
+            r = Query.from_(d).select(d.pid, d.outlier_severity, cl.call_stack_label, f.name).inner_join(cl).on(d.event_id == cl.event_id).inner_join(f).on(d.fid == f.fid)
+            t = self.summaries.table("call_stack_summaries", "SELECT pid, call_stack_label, count(*) as anomaly_count, AVG(outlier_severity) as avg_severity, first(name) as fname, hash(first(name)) as fname_hash, FROM (%s) AS r GROUP BY pid, call_stack_label" % r.get_sql())
+            return self._result(self("SELECT * EXCLUDE (pid) FROM %s WHERE pid = %d ORDER BY avg_severity DESC" % (t.get_sql(), pid)), compact)
+        r = Query.from_(d).select(d.outlier_severity, cl.call_stack_label, f.name).where(d.pid==pid).inner_join(cl).on(d.event_id == cl.event_id).inner_join(f).on(d.fid == f.fid)
+        return self._result(self("SELECT call_stack_label, count(*) as anomaly_count, AVG(outlier_severity) as avg_severity, first(name) as fname, hash(first(name)) as fname_hash, FROM (%s) AS r GROUP BY call_stack_label ORDER BY avg_severity DESC" % r.get_sql()), compact)
+
+
+#A handle on a ProvenanceDatabase restricted to a subset of the run (a scope), obtained from ProvenanceDatabase.scope()
+#The event tables (anomalies, normal_execs) and the per-rank tables (io_steps, rank_node_map) are replaced by views that apply
+#the scope's predicates, which DuckDB pushes into the scans of the underlying tables such that row groups outside the scope are
+#skipped. The function statistics tables (func_*_stats) summarize the whole run and are instead recomputed from the events within
+#the scope, and materialized on first access. As Chimbuko records only a subset of the normal executions, these statistics
+#describe the recorded executions within the scope. All other tables are shared with the full database, and the run start times
+#are those of the full run
+#
+#Scopes can be nested, e.g. pdb.scope(rids=range(64)).scope(io_steps=(100, 200))
+#The views and tables of a scope are kept in the connection until the scope is closed (see close)
+class ScopedProvenanceDatabase(ProvenanceDatabase):
+    event_tables = ['anomalies', 'normal_execs']
+    rank_tables = ['io_steps', 'rank_node_map']
+    stats_tables = ['func_runtime_profile_exclusive_stats', 'func_runtime_profile_inclusive_stats', 'func_anomaly_severity_stats',
+                    'func_anomaly_count_stats']
+
+    def __init__(self, parent : ProvenanceDatabase, pids = None, rids = None, io_steps = None, time = None):
+        super().__init__(parent.pdb_con, parent.db_nm, parent.file, quiet=True)
+        self.parent = parent
+        self._tables = parent.tableNames()
+        self.name = parent.pdb_con.uniqueName("__scope")
+        self.pids = None if pids is None else [ int(p) for p in numpy.asarray(pids).ravel() ]
+        self.rids = None if rids is None else [ int(r) for r in numpy.asarray(rids).ravel() ]
+        #Not 'io_steps', which is the (scoped) table of io steps
+        self.io_step_range = None if io_steps is None else (int(io_steps[0]), int(io_steps[1]))
+        self.time = None if time is None else (float(time[0]), float(time[1]))
+        self._views = dict()
+        #The views and tables created for the scope (kind, name) in order of creation, dropped by close()
+        self._created = []
+        self._closed = False
+
+    #Drop the views and tables of the scope. The handle, and the relations and scopes derived from it, cannot be used afterwards
+    #The scope can also be used as a context manager, e.g.
+    #   with pdb.scope(rids=[0]) as s:
+    #       s.topFunctions().show()
+    def close(self):
+        with self.pdb_con.lock:
+            self._closed = True
+            while len(self._created) > 0:
+                kind, nm = self._created.pop()
+                self.pdb_con('DROP %s IF EXISTS "%s"' % (kind, nm), cache=False)
+                self.pdb_con.dropRelation(nm)
+            self._views = dict()
+            self._materialized = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _checkOpen(self):
+        if self._closed:
+            raise Exception("The scoped database has been closed")
+
+    def useSummaryStore(self, path = None, full_hash = False):
+        raise Exception("A summary store cannot be used with a scoped database; use the summary store of the full database")
 
+    #The run start times are those of the full run
+    def runStartTable(self) -> Table:
+        return self.parent.runStartTable()
+
+    def runStartTimes(self):
+        return self.parent.runStartTimes()
+
+    #The summaries of the scope are in-memory tables, dropped with the scope
+    def _materializedTable(self, name, query) -> Table:
+        with self.pdb_con.lock:
+            self._checkOpen()
+            if name not in self._materialized:
+                self._created.append(("TABLE", "__%s_%s" % (name, self.name)))
+            return super()._materializedTable(name, query)
+
+    def tableColumns(self, table):
+        name = table.get_table_name() if isinstance(table, Table) else table
+        if name.startswith(self.name + "_"):
+            with self.pdb_con.lock:
+                if name not in self._columns:
+                    self._columns[name] = self.pdb_con('SELECT * FROM "%s" LIMIT 0' % name, cache=False).columns
+            return self._columns[name]
+        return super().tableColumns(table)
+
+    def __getattr__(self, name):
+        if name in self.event_tables or name in self.rank_tables or name in self.stats_tables:
+            return self.view(name)
+        return super().__getattr__(name)
+
+    #Return the predicates of the scope on the pid, rid and io_step columns of the table aliased 't'
+    def _predicates(self, io_step = True):
+        cond = []
+        if self.pids is not None:
+            cond.append("t.pid IN (%s)" % ",".join(str(p) for p in self.pids))
+        if self.rids is not None:
+            cond.append("t.rid IN (%s)" % ",".join(str(r) for r in self.rids))
+        if io_step and self.io_step_range is not None:
+            cond.append("t.io_step BETWEEN %d AND %d" % self.io_step_range)
+        return cond
+
+    #Return the scoped view of the given table, creating it if necessary
+    def view(self, name) -> Table:
+        with self.pdb_con.lock:
+            self._checkOpen()
+            if name not in self._views:
+                self._views[name] = self._createView(name)
+        return self._views[name]
+
+    def _createView(self, name):
+        nm = "%s_%s" % (self.name, name)
+        src = getattr(self.parent, name).get_sql()
+        if name in self.event_tables:
+            cond = self._predicates()
+            join = ""
+            if self.time is not None:
+                join = "INNER JOIN %s AS rs ON rs.pid = t.pid AND rs.rid = t.rid" % self.runStartTable().get_sql()
+                cond.append("t.exit >= rs.run_start + %r AND t.entry <= rs.run_start + %r" % (self.time[0]*1e6, self.time[1]*1e6))
+            sql = "SELECT t.* FROM %s AS t %s %s" % (src, join, "" if len(cond) == 0 else "WHERE " + " AND ".join(cond))
+            self._created.append(("VIEW", nm))
+            self.pdb_con('CREATE OR REPLACE VIEW "%s" AS %s' % (nm, sql), cache=False)
+            self.pdb_con.registerRelation(nm, (self.db_nm,))
+        elif name in self.rank_tables:
+            cond = self._predicates(io_step = name == 'io_steps')
+            self._created.append(("VIEW", nm))
+            self.pdb_con('CREATE OR REPLACE VIEW "%s" AS SELECT t.* FROM %s AS t %s' % (nm, src, "" if len(cond) == 0 else "WHERE " + " AND ".join(cond)), cache=False)
+            self.pdb_con.registerRelation(nm, (self.db_nm,))
+        else:
+            anom = self.anomalies.get_sql()
+            normal = self.normal_execs.get_sql()
+            if name == 'func_runtime_profile_exclusive_stats':
+                v = "SELECT pid, fid, runtime_exclusive AS v FROM %s UNION ALL SELECT pid, fid, runtime_exclusive AS v FROM %s" % (anom, normal)
+            elif name == 'func_runtime_profile_inclusive_stats':
+                v = "SELECT pid, fid, runtime_total AS v FROM %s UNION ALL SELECT pid, fid, runtime_total AS v FROM %s" % (anom, normal)
+            elif name == 'func_anomaly_severity_stats':
+                v = "SELECT pid, fid, outlier_severity AS v FROM %s" % anom
+            else:
+                #Anomaly counts are sampled per rank and io step
+                v = "SELECT pid, fid, COUNT(*) AS v FROM %s GROUP BY pid, rid, io_step, fid" % anom
+            self._created.append(("TABLE", nm))
+            self.pdb_con('CREATE OR REPLACE TABLE "%s" AS SELECT f.pid, f.fid, COUNT(e.v) AS count, COALESCE(SUM(e.v), 0)::DOUBLE AS accumulate, \
+COALESCE(AVG(e.v), 0) AS mean, COALESCE(STDDEV_POP(e.v), 0) AS stddev, COALESCE(MIN(e.v), 0)::DOUBLE AS minimum, COALESCE(MAX(e.v), 0)::DOUBLE AS maximum \
+FROM %s AS f LEFT JOIN (%s) AS e ON e.pid = f.pid AND e.fid = f.fid GROUP BY f.pid, f.fid' % (nm, self.functions.get_sql(), v), cache=False)
+            self.pdb_con.registerRelation(nm, (self.db_nm,))
+        return Table(nm)
@@ -0,0 +1,183 @@
+import os
+import re
+from collections import OrderedDict
+import duckdb
+from .optional import requirePyarrow
+
+#An opt-in LRU cache of query results for a ProvenanceDatabaseConnection
+#As all provenance databases are attached read-only, the result of a query depends only on its SQL and the database files it
+#references. Results are materialized as Arrow tables and keyed by the normalized SQL and the identity (path, size, mtime) of the
+#referenced databases. The in-memory tables and views created by the package (materialized summaries, scope and federation
+#views; see ProvenanceDatabaseConnection.registerRelation) are derived from the databases only, and queries on them are keyed by
+#the databases they are derived from. Queries that depend on other, mutable, state (other in-memory views/tables, catalog
+#metadata) are never cached. The in-memory relations are listed from the catalog only after a statement other than a query has
+#been executed through the connection; views or tables created directly on the DuckDB connection are not seen until then.
+#Results are fetched in batches on a miss; a result larger than the budget is not materialized beyond it, and is returned as a lazily
+#evaluated relation (counted as bypassed)
+#
+#max_bytes : the total size budget of the cached results; least-recently-used results are evicted once it is exceeded
+#max_entries : optional limit on the number of cached results
+class QueryCache:
+    def __init__(self, pdb_con, max_bytes = 256*1024*1024, max_entries = None):
+        requirePyarrow("The query cache")
+        self.pdb_con = pdb_con
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (arrow table, nbytes, catalogs)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+        self.batch_rows = 100000
+        self._identity = dict()
+        self._mutable = None  # (ddl_version, names of the in-memory relations)
+
+    _literal_or_space = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+    _catalog = re.compile(r"\bpdb_\d+\b")
+    _identifier = re.compile(r"'(?:[^']|'')*'|\"((?:[^\"]|\"\")*)\"|([A-Za-z_]\w*)")
+    _metadata = re.compile(r"information_schema|duckdb_\w+\s*\(|pragma_\w+\s*\(", re.IGNORECASE)
+
+    #Normalize the SQL such that trivially different formatting of the same query maps to the same key
+    #Whitespace is collapsed outside of quoted literals/identifiers
+    @classmethod
+    def normalize(cls, sql : str):
+        sql = cls._literal_or_space.sub(lambda m: m.group(1) if m.group(1) is not None else ' ', sql)
+        return sql.strip().rstrip(';').strip()
+
+    #The identity of an attached database: (path, size, mtime)
+    def _catalogIdentity(self, db_nm):
+        with self.pdb_con.lock:
+            return self._catalogIdentityLocked(db_nm)
+
+    def _catalogIdentityLocked(self, db_nm):
+        if db_nm not in self._identity:
+            path = None
+            for pdb in self.pdb_con.db:
+                if pdb.db_nm == db_nm:
+                    path = pdb.file
+            if path is None:
+                return None
+            st = os.stat(path)
+            self._identity[db_nm] = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        return self._identity[db_nm]
+
+    #Return the (lower case) identifiers of the SQL, quoted or not, outside of string literals
+    @classmethod
+    def identifiers(cls, sql : str):
+        return set( (m.group(1) if m.group(1) is not None else m.group(2) or "").lower() for m in cls._identifier.finditer(sql) ) - {""}
+
+    #Return the (lower case) names of the views and tables in the in-memory catalogs, listed again only if a statement other than
+    #a query has been executed since the last call
+    def _inMemoryRelations(self):
+        version = self.pdb_con.ddl_version
+        m = self._mutable
+        if m is None or m[0] != version:
+            con = self.pdb_con.cursor()
+            r = con.sql("SELECT view_name AS nm FROM duckdb_views() WHERE NOT internal UNION ALL \
+SELECT table_name AS nm FROM duckdb_tables() WHERE database_name IN ('memory', 'temp')").fetchnumpy()['nm']
+            m = (version, set( str(n).lower() for n in r ))
+            self._mutable = m
+        return m[1]
+
+    #Return the cache key for the query, or None if the query cannot be cached
+    def key(self, sql : str):
+        nsql = self.normalize(sql)
+        if not re.match(r"(SELECT|FROM|WITH)\b", nsql, re.IGNORECASE):
+            return None
+        if self._metadata.search(nsql):
+            return None
+        #The identifiers include all referenced relations, but also e.g. column names: a column named as a mutable relation only
+        #prevents caching
+        names = self.identifiers(nsql)
+        catalogs = set(self._catalog.findall(nsql))
+        with self.pdb_con.lock:
+            relations = self.pdb_con.relations
+            for n in names & relations.keys():
+                catalogs.update(relations[n])
+            if len(catalogs) == 0:
+                return None
+            if any( n not in relations for n in names & self._inMemoryRelations() ):
+                return None
+        catalogs = tuple(sorted(catalogs))
+        ident = tuple( self._catalogIdentity(c) for c in catalogs )
+        if None in ident:
+            return None
+        return (nsql, ident)
+
+    def __call__(self, sql : str) -> duckdb.DuckDBPyRelation:
+        con = self.pdb_con.cursor()
+        k = self.key(sql)
+        if k is None:
+            with self.pdb_con.lock:
+                self.bypassed += 1
+            return con.sql(sql)
+
+        with self.pdb_con.lock:
+            e = self.entries.get(k)
+            if e is not None:
+                self.hits += 1
+                self.entries.move_to_end(k)
+            else:
+                self.misses += 1
+        if e is not None:
+            return con.from_arrow(e[0])
+
+        #Stream the result, giving up as soon as it exceeds the budget: such a result is not cached and is returned as a lazily
+        #evaluated relation instead
+        import pyarrow
+        reader = con.sql(sql).fetch_arrow_reader(self.batch_rows)
+        batches = []
+        nbytes = 0
+        for b in reader:
+            batches.append(b)
+            nbytes += b.nbytes
+            if nbytes > self.max_bytes:
+                reader.close()
+                with self.pdb_con.lock:
+                    self.bypassed += 1
+                return con.sql(sql)
+        tab = pyarrow.Table.from_batches(batches, schema=reader.schema)
+        with self.pdb_con.lock:
+            if k not in self.entries:
+                self.entries[k] = (tab, nbytes, k[1])
+                self.nbytes += nbytes
+                self._evict()
+        return con.from_arrow(tab)
+
+    def _evict(self):
+        while len(self.entries) > 0 and (self.nbytes > self.max_bytes or (self.max_entries is not None and len(self.entries) > self.max_entries)):
+            k, (tab, nbytes, ident) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    #Drop cached results. If 'db' (a ProvenanceDatabase or its catalog name) is provided, only results referencing that database are dropped
+    def invalidate(self, db = None):
+        with self.pdb_con.lock:
+            self._invalidateLocked(db)
+
+    def _invalidateLocked(self, db):
+        if db is None:
+            self.entries.clear()
+            self.nbytes = 0
+            self._identity.clear()
+            return
+        db_nm = db if isinstance(db, str) else db.db_nm
+        ident = self._identity.pop(db_nm, None)
+        if ident is None:
+            return
+        for k in [ k for k, e in self.entries.items() if ident in e[2] ]:
+            self.nbytes -= self.entries.pop(k)[1]
+
+    #Drop the cached results of queries referencing the relation 'name'
+    def invalidateRelation(self, name):
+        name = name.lower()
+        with self.pdb_con.lock:
+            for k in [ k for k in self.entries if name in self.identifiers(k[0]) ]:
+                self.nbytes -= self.entries.pop(k)[1]
+
+    #Return a dictionary of cache statistics
+    def stats(self):
+        with self.pdb_con.lock:
+            return { "entries" : len(self.entries), "bytes" : self.nbytes, "max_bytes" : self.max_bytes,
+                     "hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions, "bypassed" : self.bypassed }
@@ -0,0 +1,94 @@
+import numpy
+
+#The histogram-based anomaly detection models (HBOS/COPOD) of all functions, packed into contiguous arrays
+#  pid, fid : the program and function indices of the models, sorted by program and then function
+#  first_edge, bin_width : the left edge of the first bin and the bin width of each model
+#  offsets : the models' bins are counts[offsets[i]:offsets[i+1]]
+#  counts : the bin counts of all models, concatenated
+#As the function indices of different programs overlap, the models are keyed by (pid, fid). The program index can be omitted
+#when looking up the models of functions found in a single program
+#
+#Obtain from ProvenanceDatabase.loadADModels()
+class ADModelSet:
+    def __init__(self, pid, fid, first_edge, bin_width, bin_counts):
+        pid = numpy.asarray(pid, dtype=numpy.int64)
+        fid = numpy.asarray(fid, dtype=numpy.int64)
+        order = numpy.lexsort((fid, pid))
+        self.pid = pid[order]
+        self.fid = fid[order]
+        self.first_edge = numpy.asarray(first_edge, dtype=numpy.float64)[order]
+        self.bin_width = numpy.asarray(bin_width, dtype=numpy.float64)[order]
+        bin_counts = [ numpy.asarray(bin_counts[i], dtype=numpy.float64) for i in order ]
+        self.nbins = numpy.array([ len(c) for c in bin_counts ], dtype=numpy.int64)
+        self.offsets = numpy.zeros(len(self.fid)+1, dtype=numpy.int64)
+        numpy.cumsum(self.nbins, out=self.offsets[1:])
+        self.counts = numpy.concatenate(bin_counts) if len(bin_counts) > 0 else numpy.zeros(0)
+        csum = numpy.concatenate(([0.0], numpy.cumsum(self.counts)))
+        self.total = csum[self.offsets[1:]] - csum[self.offsets[:-1]]
+        #The cumulative fraction of the counts up to and including each bin, per model, for COPOD
+        self.cdf = (csum[1:] - numpy.repeat(csum[self.offsets[:-1]], self.nbins)) / numpy.repeat(numpy.maximum(self.total, 1e-300), self.nbins)
+        #The lookup keys: pid * span + fid, which are sorted as the models are. The models sorted by function index alone resolve
+        #lookups without a program index
+        self._span = int(self.fid.max()) + 1 if len(self.fid) > 0 else 1
+        self._key = self.pid * self._span + self.fid
+        self._by_fid = numpy.argsort(self.fid, kind="stable")
+
+    def __len__(self):
+        return len(self.fid)
+
+    #Return the histogram (edges, counts) of function 'fid' with the conventions of ProvenanceDatabase.getFunctionADmodelHistogram
+    #pid : the program index of the function, required if the function index is found in several programs
+    def histogram(self, fid, pid = None):
+        i = self.modelIndex([fid], pid)[0]
+        if i < 0:
+            raise Exception("Could not find the model of function ", fid)
+        return self.first_edge[i] + self.bin_width[i] * numpy.arange(self.nbins[i]+1), self.counts[self.offsets[i]:self.offsets[i+1]]
+
+    #Return the index of the model of each of the function indices, or -1 if there is none
+    #pid : the program index of the functions, or an array of program indices aligned with the function indices. If not
+    #      provided, a function index found in several programs raises an exception
+    def modelIndex(self, fids, pid = None):
+        fids = numpy.asarray(fids, dtype=numpy.int64)
+        if len(self.fid) == 0:
+            return numpy.full(fids.shape, -1, dtype=numpy.int64)
+        if pid is None:
+            sfid = self.fid[self._by_fid]
+            lo = numpy.searchsorted(sfid, fids, side="left")
+            hi = numpy.searchsorted(sfid, fids, side="right")
+            if numpy.any(hi - lo > 1):
+                raise Exception("Function(s) found in several programs, specify the pid: ", numpy.unique(fids[hi - lo > 1]))
+            return numpy.where(hi > lo, self._by_fid[numpy.minimum(lo, len(sfid)-1)], -1)
+        pids = numpy.broadcast_to(numpy.asarray(pid, dtype=numpy.int64), fids.shape)
+        valid = (fids >= 0) & (fids < self._span) & (pids >= 0)
+        key = numpy.where(valid, pids * self._span + fids, -1)
+        idx = numpy.minimum(numpy.searchsorted(self._key, key), len(self._key)-1)
+        return numpy.where(valid & (self._key[idx] == key), idx, -1)
+
+    #Score the executions of functions 'fids' with exclusive runtimes 'runtimes' (arrays of the same length) against the models
+    #algorithm : "hbos" : -log2 of the fraction of the model's counts in the bin containing the runtime
+    #            "copod" : -log2 of the smaller of the two tail probabilities of the runtime under the model's distribution
+    #alpha : a regularization added to the probabilities, bounding the score of runtimes outside the histogram
+    #pid : the program index of the executions, or an array aligned with 'fids', as for modelIndex
+    #Executions of functions without a model are given a score of NaN
+    def score(self, fids, runtimes, algorithm = "hbos", alpha = 1e-32, pid = None):
+        x = numpy.asarray(runtimes, dtype=numpy.float64)
+        if algorithm not in ("hbos", "copod"):
+            raise Exception("Invalid algorithm")
+        s = numpy.full(len(x), numpy.nan)
+        if len(self.fid) == 0:
+            return s
+        m = self.modelIndex(fids, pid)
+        has = m >= 0
+        m = m[has]
+        b = numpy.floor((x[has] - self.first_edge[m]) / self.bin_width[m]).astype(numpy.int64)
+        inside = (b >= 0) & (b < self.nbins[m])
+        flat = self.offsets[m[inside]] + b[inside]
+        frac = self.counts[flat] / numpy.maximum(self.total[m[inside]], 1e-300)
+        #Outside the histogram the probability is zero (HBOS), or the runtime is in the extreme of one of the tails (COPOD)
+        p = numpy.zeros(len(m))
+        if algorithm == "hbos":
+            p[inside] = frac
+        else:
+            p[inside] = numpy.minimum(self.cdf[flat], 1.0 - (self.cdf[flat] - frac))
+        s[has] = -numpy.log2(p + alpha)
+        return s
@@ -0,0 +1,191 @@
+import numpy
+
+#Mergeable quantile sketches of the exclusive runtime distribution of every function (optionally of every function and call stack
+#label), packed into contiguous arrays
+#Each sketch is a histogram over logarithmically spaced buckets: a runtime x (in microseconds) falls into bucket ceil(log_gamma(x))
+#with gamma = (1+alpha)/(1-alpha), and runtimes up to 1 into bucket 0. The quantiles derived from a sketch are then within a relative
+#error 'alpha' of the true quantiles, independently of the number of executions. Sketches with the same 'alpha' are merged by
+#adding the bucket counts
+#  pid, fid, name, label : the key of each sketch (label is None if the sketches are not split by call stack label)
+#  offsets : the buckets of sketch i are buckets[offsets[i]:offsets[i+1]], in increasing order
+#  buckets, counts : the bucket indices and counts of all sketches, concatenated
+#Sketches of different runs are matched by program index, function name and, if present, call stack label, as the function
+#indices need not be the same across runs
+#
+#Obtain from ProvenanceDatabase.runtimeSketches(), or load a saved set with QuantileSketchSet.load()
+class QuantileSketchSet:
+    #pid, fid, name, label, bucket, count : one entry per non-empty bucket, with the key of its sketch. The entries need not be sorted
+    def __init__(self, alpha, pid, fid, name, bucket, count, label = None):
+        if not (0 < alpha < 1):
+            raise Exception("The relative accuracy must be in (0, 1)")
+        self.alpha = float(alpha)
+        self.gamma = (1.0 + self.alpha) / (1.0 - self.alpha)
+        self.log_gamma = numpy.log(self.gamma)
+        pid = numpy.asarray(pid, dtype=numpy.int64)
+        fid = numpy.asarray(fid, dtype=numpy.int64)
+        name = numpy.asarray(name).astype(str)
+        bucket = numpy.asarray(bucket, dtype=numpy.int64)
+        count = numpy.asarray(count, dtype=numpy.int64)
+        if label is not None:
+            label = numpy.asarray(label)
+            if label.dtype == object:
+                label = label.astype(str)
+
+        #Group the entries by key, sorted by key and then bucket
+        keys = [pid, name] + ([] if label is None else [label])
+        kid = numpy.zeros(len(bucket), dtype=numpy.int64)
+        first = numpy.zeros(0, dtype=numpy.int64)
+        if len(bucket) > 0:
+            order = numpy.lexsort([bucket] + keys[::-1])
+            pid, fid, name, bucket, count = pid[order], fid[order], name[order], bucket[order], count[order]
+            label = None if label is None else label[order]
+            keys = [pid, name] + ([] if label is None else [label])
+            new = numpy.zeros(len(bucket), dtype=bool)
+            new[0] = True
+            for k in keys:
+                new[1:] |= k[1:] != k[:-1]
+            kid = numpy.cumsum(new) - 1
+            first = numpy.flatnonzero(new)
+        #Entries of the same key and bucket (e.g. from unsorted input) are combined
+        dup = numpy.zeros(len(bucket), dtype=bool)
+        dup[1:] = (kid[1:] == kid[:-1]) & (bucket[1:] == bucket[:-1])
+        if numpy.any(dup):
+            count = numpy.bincount(numpy.cumsum(~dup) - 1, weights=count).astype(numpy.int64)
+            kid, bucket = kid[~dup], bucket[~dup]
+        self.pid = pid[first]
+        self.fid = fid[first]
+        self.name = name[first]
+        self.label = None if label is None else label[first]
+        self.buckets = bucket
+        self.counts = count
+        self.offsets = numpy.searchsorted(kid, numpy.arange(len(first)+1)).astype(numpy.int64)
+        csum = numpy.concatenate(([0], numpy.cumsum(self.counts)))
+        self.total = csum[self.offsets[1:]] - csum[self.offsets[:-1]]
+
+    def __len__(self):
+        return len(self.pid)
+
+    #Return the value represented by each bucket index: the value with the smallest relative error to all values of the bucket
+    def bucketValues(self, buckets):
+        return 2.0 * numpy.power(self.gamma, numpy.asarray(buckets, dtype=numpy.float64)) / (self.gamma + 1.0)
+
+    #Return the index of the sketch of each row of keys, or -1 if there is none
+    def keyIndex(self, pids, names, labels = None):
+        ix = { k : i for i, k in enumerate(self.keyTuples()) }
+        ks = zip(pids, names) if labels is None else zip(pids, names, labels)
+        return numpy.array([ ix.get(tuple(k), -1) for k in ks ], dtype=numpy.int64)
+
+    #Return the keys of the sketches as a list of tuples (pid, name) or (pid, name, label)
+    def keyTuples(self):
+        pids = self.pid.tolist()
+        names = self.name.tolist()
+        return list(zip(pids, names)) if self.label is None else list(zip(pids, names, self.label.tolist()))
+
+    #Return the quantiles 'qs' (in [0, 1]) of every sketch as an array of shape (len(self), len(qs))
+    def quantiles(self, qs):
+        qs = numpy.atleast_1d(numpy.asarray(qs, dtype=numpy.float64))
+        csum = numpy.cumsum(self.counts)
+        start = csum[self.offsets[1:]-1] - self.total if len(self) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        out = numpy.empty((len(self), len(qs)))
+        for j, q in enumerate(qs):
+            idx = numpy.searchsorted(csum, start + numpy.floor(q * (self.total - 1)), side="right")
+            out[:, j] = self.bucketValues(self.buckets[idx])
+        return out
+
+    #Return the mean of the logarithm of the runtimes of every sketch
+    def meanLog(self):
+        kid = numpy.repeat(numpy.arange(len(self)), numpy.diff(self.offsets))
+        return numpy.bincount(kid, weights=self.counts * self.buckets, minlength=len(self)) / numpy.maximum(self.total, 1) * self.log_gamma
+
+    def _checkCompatible(self, other):
+        if self.alpha != other.alpha:
+            raise Exception("Sketches of different relative accuracy cannot be combined")
+        if (self.label is None) != (other.label is None):
+            raise Exception("Sketches split by call stack label cannot be combined with sketches that are not")
+
+    #Return a new set with the sketches of this set and 'other' merged, e.g. to combine several runs into a baseline
+    def merge(self, other):
+        self._checkCompatible(other)
+        n = [ numpy.diff(s.offsets) for s in (self, other) ]
+        cat = lambda f: numpy.concatenate([ numpy.repeat(f(s), k) for s, k in zip((self, other), n) ])
+        return QuantileSketchSet(self.alpha, cat(lambda s: s.pid), cat(lambda s: s.fid), cat(lambda s: s.name),
+                                 numpy.concatenate((self.buckets, other.buckets)), numpy.concatenate((self.counts, other.counts)),
+                                 None if self.label is None else cat(lambda s: s.label))
+
+    #Compare the runtime distributions of this set (the baseline) with those of 'other' (the candidate), for every sketch present
+    #in both with at least 'min_count' executions in each. Return a dictionary of arrays, sorted in descending order by the score:
+    #  pid, name, label : the key (label only if the sketches are split by call stack label)
+    #  fid, fid_candidate : the function index in either run
+    #  count, count_candidate : the number of executions
+    #  p50, p50_candidate, p99, p99_candidate : the median and 99th percentile of the runtimes
+    #  ks : the Kolmogorov-Smirnov distance, the largest difference between the cumulative distributions (in [0, 1])
+    #  score : the Wasserstein (earth mover's) distance between the distributions of the logarithm of the runtimes, i.e. the
+    #          average factor by which the runtimes must be scaled to turn one distribution into the other, on a log scale
+    #          (e.g. 0.69 ~ a factor of 2)
+    #  shift : the difference of the mean logarithm of the runtimes, positive if the candidate is slower
+    def compare(self, other, min_count = 10):
+        self._checkCompatible(other)
+        ib = other.keyIndex(self.pid, self.name, self.label)
+        ia = numpy.flatnonzero((ib >= 0) & (self.total >= min_count))
+        ib = ib[ia]
+        keep = other.total[ib] >= min_count
+        ia, ib = ia[keep], ib[keep]
+        m = len(ia)
+
+        #The entries of the matched sketches of both sets, labeled by the position of the match
+        rows = []
+        for s, i in ((self, ia), (other, ib)):
+            k = numpy.diff(s.offsets)[i]
+            sel = numpy.repeat(s.offsets[:-1][i], k) + (numpy.arange(k.sum()) - numpy.repeat(numpy.cumsum(k) - k, k))
+            rows.append((numpy.repeat(numpy.arange(m), k), s.buckets[sel], s.counts[sel]))
+        bmin = min([ r[1].min() for r in rows if len(r[1]) > 0 ], default=0)
+        span = max([ r[1].max() for r in rows if len(r[1]) > 0 ], default=0) - bmin + 1
+        code = numpy.concatenate([ r[0] * span + (r[1] - bmin) for r in rows ])
+        u, inv = numpy.unique(code, return_inverse=True)
+        ca = numpy.bincount(inv[:len(rows[0][0])], weights=rows[0][2], minlength=len(u))
+        cb = numpy.bincount(inv[len(rows[0][0]):], weights=rows[1][2], minlength=len(u))
+        seg = u // span
+        bucket = u % span
+
+        #The cumulative distributions of both sets over the union of their buckets
+        ta = self.total[ia].astype(numpy.float64)
+        tb = other.total[ib].astype(numpy.float64)
+        starts = numpy.flatnonzero(numpy.r_[True, seg[1:] != seg[:-1]]) if len(u) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        cum_a = numpy.cumsum(ca)
+        cum_b = numpy.cumsum(cb)
+        base_a = (cum_a - ca)[starts]
+        base_b = (cum_b - cb)[starts]
+        diff = numpy.abs((cum_a - base_a[seg]) / ta[seg] - (cum_b - base_b[seg]) / tb[seg])
+        ks = numpy.maximum.reduceat(diff, starts) if m > 0 else numpy.zeros(0)
+        width = numpy.zeros(len(u))
+        width[:-1] = numpy.where(seg[1:] == seg[:-1], bucket[1:] - bucket[:-1], 0)
+        score = numpy.bincount(seg, weights=diff * width, minlength=m) * self.log_gamma
+
+        qa = self.quantiles([0.5, 0.99])[ia]
+        qb = other.quantiles([0.5, 0.99])[ib]
+        out = { "pid" : self.pid[ia], "name" : self.name[ia] }
+        if self.label is not None:
+            out["label"] = self.label[ia]
+        out.update({ "fid" : self.fid[ia], "fid_candidate" : other.fid[ib],
+                     "count" : self.total[ia], "count_candidate" : other.total[ib],
+                     "p50" : qa[:,0], "p50_candidate" : qb[:,0], "p99" : qa[:,1], "p99_candidate" : qb[:,1],
+                     "ks" : ks, "score" : score, "shift" : other.meanLog()[ib] - self.meanLog()[ia] })
+        order = numpy.argsort(-score, kind="stable")
+        return { c : v[order] for c, v in out.items() }
+
+    #Save the set to a numpy .npz file at 'path'
+    def save(self, path):
+        n = numpy.diff(self.offsets)
+        arrays = { "alpha" : numpy.array(self.alpha), "pid" : numpy.repeat(self.pid, n), "fid" : numpy.repeat(self.fid, n),
+                   "name" : numpy.repeat(self.name, n), "bucket" : self.buckets, "count" : self.counts }
+        if self.label is not None:
+            arrays["label"] = numpy.repeat(self.label, n)
+        numpy.savez_compressed(path, **arrays)
+        return path
+
+    #Load a set saved with save()
+    @staticmethod
+    def load(path):
+        with numpy.load(path) as d:
+            return QuantileSketchSet(float(d["alpha"]), d["pid"], d["fid"], d["name"], d["bucket"], d["count"],
+                                     d["label"] if "label" in d.files else None)
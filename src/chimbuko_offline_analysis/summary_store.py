@@ -0,0 +1,101 @@
+import os
+import hashlib
+from pypika import *
+
+#A persistent sidecar store of materialized summary tables for a provenance database
+#As the provenance databases are read-only after conversion, summaries that require joins/aggregations over the full database
+#(e.g. topFunctions, getApplicationProfile, getCallStackSummaries and the run start times) need only be computed once. They are
+#written to a separate DuckDB file alongside the source and reused by later sessions.
+#
+#The store is fingerprinted by the size, modification time and a content hash of the source file. If the source changes the
+#stored summaries are dropped and rebuilt on demand. By default the content hash is computed over the head, tail and a fixed
+#number of evenly spaced blocks of the file, such that opening the store does not require reading a large database in full;
+#full_hash=True hashes the entire file
+#
+#Obtain from ProvenanceDatabase.useSummaryStore() or ProvenanceDatabaseConnection.connect(file, summaries=True)
+class SummaryStore:
+    version = 2
+    block_size = 1024*1024
+    nblocks = 64
+
+    #pdb : the ProvenanceDatabase
+    #path : the path of the sidecar DuckDB file (default: the source path with suffix ".summaries.duckdb")
+    #full_hash : if True, hash the full contents of the source file rather than a sample of blocks
+    def __init__(self, pdb, path = None, full_hash = False):
+        if pdb.file is None:
+            raise Exception("A summary store requires a database file")
+        self.pdb = pdb
+        self.pdb_con = pdb.pdb_con
+        self.path = path if path is not None else pdb.file + ".summaries.duckdb"
+        self.full_hash = full_hash
+        self.db_nm = "%s_summaries" % pdb.db_nm
+        self.built = 0
+        self.reused = 0
+        with self.pdb_con.lock:
+            self.pdb_con("ATTACH '%s' AS %s" % (self.path.replace("'", "''"), self.db_nm), cache=False)
+            #The stored summaries are derived from the source database only and are dropped if it changes
+            self.pdb_con.registerRelation(self.db_nm, (pdb.db_nm,))
+            self._tables = None
+            self.refresh()
+
+    #Compute the fingerprint (size, mtime_ns, hash) of the source file
+    def fingerprint(self):
+        st = os.stat(self.pdb.file)
+        h = hashlib.blake2b(digest_size=16)
+        with open(self.pdb.file, "rb") as f:
+            if self.full_hash or st.st_size <= self.block_size * self.nblocks:
+                for b in iter(lambda: f.read(self.block_size), b""):
+                    h.update(b)
+            else:
+                for i in range(self.nblocks):
+                    f.seek((st.st_size - self.block_size) * i // (self.nblocks - 1))
+                    h.update(f.read(self.block_size))
+        return (st.st_size, st.st_mtime_ns, h.hexdigest())
+
+    #Check the stored fingerprint against the source file, dropping all stored summaries if it does not match
+    def refresh(self):
+        with self.pdb_con.lock:
+            fp = self.fingerprint()
+            stored = None
+            if "__fingerprint" in self.tableNames():
+                stored = self.pdb_con("SELECT size, mtime_ns, hash, version FROM %s.__fingerprint" % self.db_nm, cache=False).fetchone()
+            if stored != fp + (self.version,):
+                for t in self.tableNames():
+                    self.pdb_con('DROP TABLE %s."%s"' % (self.db_nm,t), cache=False)
+                self.pdb_con("CREATE TABLE %s.__fingerprint AS SELECT %d::BIGINT AS size, %d::BIGINT AS mtime_ns, '%s' AS hash, %d AS version" % (
+                    self.db_nm, fp[0], fp[1], fp[2], self.version), cache=False)
+                self._tables = None
+            self.fp = fp
+
+    #Return the names of the tables in the store
+    def tableNames(self):
+        with self.pdb_con.lock:
+            if self._tables is None:
+                self._tables = list(self.pdb_con("SELECT table_name FROM duckdb_tables() WHERE database_name = '%s'" % self.db_nm, cache=False).fetchnumpy()["table_name"])
+        return self._tables
+
+    #Return the stored summary table 'name', materializing it from 'query' (a query builder or SQL string on the source database) if it
+    #is not yet in the store
+    def table(self, name, query) -> Table:
+        with self.pdb_con.lock:
+            if name in self.tableNames():
+                self.reused += 1
+            else:
+                sql = query if isinstance(query, str) else query.get_sql()
+                self.pdb_con('CREATE TABLE %s."%s" AS %s' % (self.db_nm,name,sql), cache=False)
+                self._tables.append(name)
+                self.built += 1
+        return Table(name, Database(self.db_nm))
+
+    #Drop all stored summaries such that they are rebuilt on next use
+    def clear(self):
+        with self.pdb_con.lock:
+            for t in self.tableNames():
+                if t != "__fingerprint":
+                    self.pdb_con('DROP TABLE %s."%s"' % (self.db_nm,t), cache=False)
+            self._tables = None
+
+    def close(self):
+        with self.pdb_con.lock:
+            self.pdb_con("DETACH %s" % self.db_nm, cache=False)
+            self.pdb_con.dropRelation(self.db_nm)
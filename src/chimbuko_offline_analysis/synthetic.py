@@ -0,0 +1,130 @@
+import os
+import duckdb
+
+#Generate a synthetic provenance database in DuckDB format at 'path', following the schema produced by ChimbukoProvDBconvert
+#The size of the database is controlled by:
+#  npid : the number of programs
+#  nrank : the number of ranks per program
+#  nfunc : the number of functions per program
+#  nevent : the total number of recorded events (anomalies + normal executions) per program
+#  anomaly_frac : the fraction of events that are anomalies
+#  nstep : the number of io steps per rank
+#  ncallpath : the number of distinct call paths per function
+#  window : the number of neighbouring executions recorded in each event's exec window
+#  node_state_frac : the fraction of normal executions that carry a node state sample (anomalies always do)
+#All values are generated deterministically from 'seed' such that repeated calls produce identical databases
+def generateProvenanceDatabase(path : str, npid=1, nrank=4, nfunc=50, nevent=10000, anomaly_frac=0.02, nstep=20,
+                               ncallpath=3, window=4, node_state_frac=0.1, ranks_per_node=4, nbin=20, seed=1234, overwrite=True):
+    if os.path.exists(path):
+        if not overwrite:
+            raise Exception("Database already exists: %s" % path)
+        os.remove(path)
+
+    con = duckdb.connect(path)
+    step_us = 1000000 #length of an io step in microseconds
+    t0 = 1700000000000000 #unix time of the start of the job in microseconds
+
+    #Deterministic pseudo-random number in [0,1) derived from a key
+    con.sql("CREATE MACRO rnd(k) AS (hash(k, %d) %% 1000003)::DOUBLE / 1000003" % seed)
+    con.sql("CREATE MACRO rndint(k, n) AS floor(rnd(k) * n)::BIGINT")
+
+    con.sql("CREATE TABLE functions AS SELECT p.range AS pid, f.range AS fid, 'func_' || f.range AS name FROM range(%d) p, range(%d) f" % (npid,nfunc))
+
+    con.sql("CREATE TABLE rank_node_map AS SELECT p.range AS pid, r.range AS rid, 'node' || (r.range // %d) AS hostname FROM range(%d) p, range(%d) r" % (ranks_per_node,npid,nrank))
+
+    #Ranks start with a small random offset relative to the job start
+    con.sql("""CREATE TABLE io_steps AS SELECT p.range AS pid, r.range AS rid, s.range AS io_step,
+               (%d + (rnd(p.range * 100003 + r.range) * 50000)::BIGINT + s.range * %d) AS io_step_tstart,
+               (%d + (rnd(p.range * 100003 + r.range) * 50000)::BIGINT + (s.range + 1) * %d) AS io_step_tend
+               FROM range(%d) p, range(%d) r, range(%d) s""" % (t0,step_us,t0,step_us,npid,nrank,nstep))
+
+    #All recorded events. Each function has a characteristic exclusive runtime scale
+    con.sql("""CREATE TEMP TABLE _events AS
+               SELECT e.pid, e.rid, 0 AS tid, e.fid, e.io_step,
+                      e.pid || ':' || e.rid || ':' || e.io_step || ':' || e.idx AS event_id,
+                      s.io_step_tstart + (rnd(e.key * 7 + 1) * %d)::BIGINT AS entry,
+                      e.runtime_exclusive,
+                      e.runtime_exclusive + (rnd(e.key * 7 + 2) * e.runtime_exclusive)::BIGINT AS runtime_total,
+                      e.anom,
+                      rndint(e.key * 7 + 3, %d) AS path
+               FROM (SELECT p.range AS pid, i.range AS idx, p.range * 1000000007 + i.range AS key,
+                            rndint(p.range * 1000000007 + i.range, %d) AS rid,
+                            rndint(p.range * 1000000007 + i.range + 11, %d) AS io_step,
+                            rndint(p.range * 1000000007 + i.range + 13, %d) AS fid,
+                            rnd(p.range * 1000000007 + i.range + 17) < %f AS anom,
+                            ((10 + rnd(p.range * 1000000007 + i.range + 13) * 1000) * (1 + rnd(p.range * 1000000007 + i.range + 19))
+                             * CASE WHEN rnd(p.range * 1000000007 + i.range + 17) < %f THEN 5 ELSE 1 END)::BIGINT AS runtime_exclusive
+                     FROM range(%d) p, range(%d) i) e
+               INNER JOIN io_steps s ON s.pid = e.pid AND s.rid = e.rid AND s.io_step = e.io_step""" %
+            (step_us//2, ncallpath, nrank, nstep, nfunc, anomaly_frac, anomaly_frac, npid, nevent))
+
+    cols = "event_id, pid, rid, tid, fid, entry, entry + runtime_total AS exit, runtime_total, runtime_exclusive, io_step"
+    con.sql("""CREATE TABLE anomalies AS SELECT %s, rnd(hash(event_id) + 1) * 100 AS outlier_score, runtime_exclusive::DOUBLE AS outlier_severity
+               FROM _events WHERE anom ORDER BY pid, rid, entry""" % cols)
+    con.sql("""CREATE TABLE normal_execs AS SELECT %s, rnd(hash(event_id) + 1) AS outlier_score, 0.0 AS outlier_severity
+               FROM _events WHERE NOT anom ORDER BY pid, rid, entry""" % cols)
+
+    #Call stacks: entry_idx 0 is the function itself, increasing indices are the parents up to the root.
+    #Each function has 'ncallpath' distinct paths with depth 1-4 and the label is the hash of the path
+    con.sql("""CREATE TEMP TABLE _paths AS
+               SELECT f.pid, f.fid, c.range AS path, d.range AS entry_idx,
+                      CASE WHEN d.range = 0 THEN f.fid ELSE rndint(f.fid * 1009 + c.range * 31 + d.range, %d) END AS frame_fid
+               FROM functions f, range(%d) c, range(4) d
+               WHERE d.range <= rndint(f.fid * 1009 + c.range, 4)""" % (nfunc,ncallpath))
+    con.sql("""CREATE TEMP TABLE _labels AS SELECT pid, fid, path, hash(list(frame_fid ORDER BY entry_idx)) AS call_stack_label
+               FROM _paths GROUP BY pid, fid, path""")
+    con.sql("""CREATE TABLE call_stack_labels AS SELECT e.event_id, l.call_stack_label
+               FROM _events e INNER JOIN _labels l ON l.pid = e.pid AND l.fid = e.fid AND l.path = e.path""")
+    con.sql("""CREATE TABLE call_stacks AS SELECT e.event_id, p.entry_idx, e.event_id || ':cs' || p.entry_idx AS call_stack_entry_id
+               FROM _events e INNER JOIN _paths p ON p.pid = e.pid AND p.fid = e.fid AND p.path = e.path""")
+    con.sql("""CREATE TABLE call_stack_events AS SELECT e.event_id || ':cs' || p.entry_idx AS event_id, e.pid, e.rid, e.tid, p.frame_fid AS fid,
+                      e.entry - p.entry_idx * 10 AS entry, e.entry + e.runtime_total + p.entry_idx * 10 AS exit
+               FROM _events e INNER JOIN _paths p ON p.pid = e.pid AND p.fid = e.fid AND p.path = e.path""")
+
+    #Exec windows: the 'window' executions on the same thread preceding each event
+    con.sql("""CREATE TEMP TABLE _window AS
+               SELECT e.event_id, w.range AS widx, e.event_id || ':ew' || w.range AS exec_window_entry_id, e.pid, e.rid, e.tid,
+                      rndint(hash(e.event_id) + w.range, %d) AS fid,
+                      e.entry - (w.range + 1) * 100 AS entry,
+                      (5 + rnd(hash(e.event_id) + w.range + 5) * 90)::BIGINT AS runtime_exclusive
+               FROM _events e, range(%d) w""" % (nfunc,window))
+    con.sql("CREATE TABLE exec_windows AS SELECT event_id, exec_window_entry_id FROM _window")
+    con.sql("""CREATE TABLE exec_window_events AS SELECT exec_window_entry_id AS event_id, pid, rid, tid, fid, entry,
+                      entry + runtime_exclusive AS exit, runtime_exclusive FROM _window""")
+
+    #Node state samples are attached to all anomalies and a fraction of the normal executions
+    con.sql("""CREATE TABLE node_state AS
+               SELECT e.event_id, e.entry + (rnd(hash(e.event_id) + 21) * 1000)::BIGINT AS timestamp,
+                      (64000 * rnd(hash(e.event_id) + 22))::DOUBLE AS "meminfo:MemFree (MB)",
+                      128000.0::DOUBLE AS "meminfo:MemTotal (MB)",
+                      (1000000 * rnd(hash(e.event_id) + 23))::DOUBLE AS "Memory Footprint (VmRSS) (KB)",
+                      (500000 * rnd(hash(e.event_id) + 24))::DOUBLE AS "Heap Memory Used (KB)",
+                      100 * rnd(hash(e.event_id) + 25) AS "cpu: User %%",
+                      0.0::DOUBLE AS "cpu: Nice %%",
+                      10 * rnd(hash(e.event_id) + 26) AS "cpu: System %%",
+                      100 - 100 * rnd(hash(e.event_id) + 25) AS "cpu: Idle %%"
+               FROM _events e WHERE e.anom OR rnd(hash(e.event_id) + 20) < %f""" % node_state_frac)
+
+    #HBOS/COPOD style histogram models of the exclusive runtime with 'nbin' bins
+    con.sql("""CREATE TABLE ad_models AS
+               WITH rng AS (SELECT pid, fid, MIN(runtime_exclusive)::DOUBLE AS lo, MAX(runtime_exclusive)::DOUBLE AS hi FROM _events GROUP BY pid, fid),
+               binned AS (SELECT e.pid, e.fid, LEAST(((e.runtime_exclusive - r.lo) / GREATEST((r.hi - r.lo) / %d, 1e-9))::BIGINT, %d) AS b, COUNT(*) AS cnt
+                          FROM _events e INNER JOIN rng r ON r.pid = e.pid AND r.fid = e.fid GROUP BY ALL)
+               SELECT r.pid, r.fid, GREATEST((r.hi - r.lo) / %d, 1e-9) AS bin_width, r.lo AS first_edge,
+                      list(COALESCE(b.cnt, 0)::DOUBLE ORDER BY g.range) AS bin_counts
+               FROM rng r CROSS JOIN range(%d) g LEFT JOIN binned b ON b.pid = r.pid AND b.fid = r.fid AND b.b = g.range
+               GROUP BY r.pid, r.fid, r.hi, r.lo""" % (nbin,nbin-1,nbin,nbin))
+
+    #Function statistics. All functions appear in all statistics tables
+    stats = "COUNT(v) AS count, COALESCE(SUM(v), 0)::DOUBLE AS accumulate, COALESCE(AVG(v), 0) AS mean, COALESCE(STDDEV_POP(v), 0) AS stddev, COALESCE(MIN(v), 0)::DOUBLE AS minimum, COALESCE(MAX(v), 0)::DOUBLE AS maximum"
+    con.sql("""CREATE TABLE func_runtime_profile_exclusive_stats AS SELECT f.pid, f.fid, %s
+               FROM functions f LEFT JOIN (SELECT pid, fid, runtime_exclusive AS v FROM _events) e ON e.pid = f.pid AND e.fid = f.fid GROUP BY f.pid, f.fid""" % stats)
+    con.sql("""CREATE TABLE func_runtime_profile_inclusive_stats AS SELECT f.pid, f.fid, %s
+               FROM functions f LEFT JOIN (SELECT pid, fid, runtime_total AS v FROM _events) e ON e.pid = f.pid AND e.fid = f.fid GROUP BY f.pid, f.fid""" % stats)
+    con.sql("""CREATE TABLE func_anomaly_severity_stats AS SELECT f.pid, f.fid, %s
+               FROM functions f LEFT JOIN (SELECT pid, fid, outlier_severity AS v FROM anomalies) e ON e.pid = f.pid AND e.fid = f.fid GROUP BY f.pid, f.fid""" % stats)
+    #Anomaly counts are sampled per (rank, io step)
+    con.sql("""CREATE TABLE func_anomaly_count_stats AS SELECT f.pid, f.fid, %s
+               FROM functions f LEFT JOIN (SELECT pid, fid, COUNT(*) AS v FROM anomalies GROUP BY pid, rid, io_step, fid) e ON e.pid = f.pid AND e.fid = f.fid GROUP BY f.pid, f.fid""" % stats)
+    con.close()
+    return path
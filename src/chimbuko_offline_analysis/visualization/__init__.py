@@ -1,2 +1,13 @@
-from . import lollipop
-from . import parallel_coords
+import importlib
+from .rendering import setRenderer, getRenderer, showFigure
+
+#The chart modules are imported on first access, e.g. visualization.lollipop, such that plotly is loaded only when a chart is built
+_lazy_submodules = ["lollipop", "parallel_coords"]
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + _lazy_submodules)
@@ -1,17 +1,23 @@
-import plotly.express as px
 import plotly.graph_objs as go
-import plotly.io as pio
 import numpy
-import duckdb
-from pypika import *
-from ...provenance_database import *
-pio.renderers.default = 'browser'
+from pypika import Query, Table
+from ...provenance_database import ProvenanceDatabaseConnection, ProvenanceDatabase
+from ..rendering import showFigure
 
 def toColor(val):
     return 'hsl(' + str(hash(val) % 360) + ', 50%, 50%)' 
 def toSize(val):
     assert(val >= 0.0 and val <= 1.0)
     return 10 + 20*val
+
+#Vectorized versions of the above. toColors maps integer keys (e.g. hashes) to a hue and toSizes maps values in [0,1] to marker sizes
+def toColors(keys):
+    hue = (numpy.asarray(keys).astype(numpy.uint64) % numpy.uint64(360)).astype(str)
+    return numpy.char.add(numpy.char.add('hsl(', hue), ', 50%, 50%)')
+def toSizes(vals):
+    vals = numpy.asarray(vals, dtype=numpy.float64)
+    assert numpy.all((vals >= 0.0) & (vals <= 1.0))
+    return 10 + 20*vals
 def getTableName(tab):
     if isinstance(tab, Table):
         return tab.get_sql()
@@ -20,6 +26,16 @@ def getTableName(tab):
     else:
         assert 0
 
+#Fetch the columns (list of (SQL expression, output name)) of the table in a single query as a dictionary of numpy arrays
+def fetchColumns(con, comb_table, cols):
+    uniq = dict()
+    for expr, nm in cols:
+        uniq[nm] = expr
+    return con("SELECT %s FROM %s" % (", ".join('%s AS "%s"' % (expr, nm) for nm, expr in uniq.items()), comb_table) ).fetchnumpy()
+
+#The columns below provide the SQL columns they require (columns()) and transform the fetched data into the plotted values
+#(transform()) such that the chart fetches the data for all columns in a single query
+
 #Comparison colums are those columns for which separate columns exist for the two data sets
 class ComparisonColumn:
     #norm: Normalize the data to range (0, 1). Required for the "size" column, optional otherwise
@@ -30,26 +46,25 @@ class ComparisonColumn:
         self.col_B = col_B        
         self.norm = norm
         self.descr = descr
-                       
-    def getData(self,dtype,comb_table, con):
-        adata = con("SELECT %s FROM %s" % (self.col_A, comb_table) ).fetchnumpy()[self.col_A]
-        bdata = con("SELECT %s FROM %s" % (self.col_B, comb_table) ).fetchnumpy()[self.col_B]
-        mina = numpy.min(adata)
-        minb = numpy.min(bdata)
-        maxa = numpy.max(adata)
-        maxb = numpy.max(bdata)
-        minv = mina if mina < minb else minb
-        maxv = maxa if maxa > maxb else maxb
 
+    def columns(self):
+        return [ (self.col_A, self.col_A), (self.col_B, self.col_B) ]
+
+    def transform(self, dtype, data):
+        adata = numpy.asarray(data[self.col_A], dtype=numpy.float64)
+        bdata = numpy.asarray(data[self.col_B], dtype=numpy.float64)
         rdata = numpy.concatenate((adata, bdata))
         uadata = adata
         ubdata = bdata
-        if self.norm == True:
-            uadata = (adata - minv)/(maxv - minv)
-            ubdata = (bdata - minv)/(maxv - minv)            
+        if self.norm == True and len(rdata) > 0:
+            minv = numpy.min(rdata)
+            rng = numpy.max(rdata) - minv
+            if rng == 0:
+                rng = 1
+            uadata = (adata - minv)/rng
+            ubdata = (bdata - minv)/rng
 
         udata = numpy.concatenate((uadata, ubdata))
-        print(udata)
         
         if dtype == "x":
             return numpy.concatenate((-uadata, ubdata)),  rdata
@@ -57,12 +72,15 @@ class ComparisonColumn:
             return udata, rdata
         elif dtype == "size":
             assert self.norm == True, "Size columns require normalization"
-            return numpy.array([toSize(val) for val in udata]), rdata
+            return toSizes(udata), rdata
         elif dtype == "color":
-            return [toColor(val) for val in udata], rdata
+            return toColors(numpy.round(udata * 359)), rdata
         else:
             assert 0
 
+    def getData(self,dtype,comb_table, con):
+        return self.transform(dtype, fetchColumns(con, comb_table, self.columns()))
+
     def getHoverDescription(self):
         return self.descr
 
@@ -71,7 +89,7 @@ class LabelColumn:
     #descr: Description of the column, used for hover textdescr: Description of the column, used for hover text
     #col : The column name
     #post_trans:
-    #  "hash" : Convert the entries to hashes via python hash
+    #  "hash" : Convert the entries to hashes (computed by the database)
     #  "index" : Instead of values, simply replace the entries by numbered indices in the table order
     #  None : Show labels directly
     def __init__(self, descr, col, post_trans = None):
@@ -79,13 +97,18 @@ class LabelColumn:
         self.post_trans = post_trans
         self.descr = descr
 
-    def getData(self,dtype,comb_table, con):
-        rdata = con("SELECT %s FROM %s" % (self.col, comb_table) ).fetchnumpy()[self.col]        
+    def columns(self):
+        if self.post_trans == "hash":
+            return [ (self.col, self.col), ("hash(%s)" % self.col, self.col + "__hash") ]
+        return [ (self.col, self.col) ]
+
+    def transform(self, dtype, data):
+        rdata = data[self.col]
         
         if(self.post_trans == "hash"):
-            tdata = numpy.array([ hash(i) for i in rdata ])
+            tdata = data[self.col + "__hash"]
         elif(self.post_trans == "index"):
-            tdata = numpy.array([ i for i in range(len(rdata)) ] )
+            tdata = numpy.arange(len(rdata))
         else:
             tdata = rdata
 
@@ -95,23 +118,33 @@ class LabelColumn:
         if dtype == "x" or dtype == "y":
             return tdata_dup,rdata_dup
         elif dtype == "color":
-            return [toColor(val) for val in tdata_dup], rdata_dup
+            if self.post_trans is None and not numpy.issubdtype(tdata_dup.dtype, numpy.integer):
+                return [toColor(val) for val in tdata_dup], rdata_dup
+            return toColors(tdata_dup), rdata_dup
         else:
             assert 0
+
+    def getData(self,dtype,comb_table, con):
+        return self.transform(dtype, fetchColumns(con, comb_table, self.columns()))
             
     def getHoverDescription(self):
         return self.descr
 
 
+#A lollipop chart. The markers are drawn with a single WebGL (Scattergl) trace and the stems with a single line trace in which the
+#stems are separated by gaps, such that charts with many thousands of rows remain responsive
 class LollipopChart:
     def __init__(self, pdb_con : ProvenanceDatabaseConnection, comb_table : Table):
         self.con = pdb_con
         self.table = getTableName(comb_table)
 
-    def _create_data(self, xdata, ydata, color_data, size_data, hover_text):
+    #hover_data : the raw values shown in the hover text, as an array of shape (N, 4)
+    #hover_template : the plotly hover template referencing the hover data
+    def _create_data(self, xdata, ydata, color_data, size_data, hover_data, hover_template):
         # reference: https://plotly.com/python/line-and-scatter/        
         return [
-            go.Scatter(
+            self._create_stems(xdata, ydata),
+            go.Scattergl(
                 x=xdata,
                 y=ydata,
                 mode='markers',
@@ -120,48 +153,41 @@ class LollipopChart:
                     size=size_data,
                     sizemode='diameter',
                 ),
-                text=hover_text,
-                hovertemplate='%{text}',
+                customdata=hover_data,
+                hovertemplate=hover_template,
+                showlegend=False,
             )
         ]
 
-    def _create_shapes(self, xdata, ydata):
-        shapes = []
-        for i in range(len(xdata)):
-            shape = dict(
-                    type='line',
-                    xref='x',
-                    yref='y',
-                    x0=0,
-                    y0=ydata[i],
-                    x1=xdata[i],
-                    y1=ydata[i],
-                    line=dict(color='black', width=2)
-                )
-            shapes.append(shape)
-        return shapes
-
-    def _create_hover_text(self, xdata, ydata, color_data, size_data, xdescr, ydescr, color_descr, size_descr):
-            return ["%s: %s<br>%s: %s<br>%s: %s<br>%s: %s" % 
-                    (xdescr, xdata[i], ydescr, ydata[i], color_descr, color_data[i], size_descr, size_data[i]) for i in range(len(xdata))]
+    #The stems from x=0 to the markers, as a single line trace with a gap (None) after each stem
+    def _create_stems(self, xdata, ydata):
+        n = len(xdata)
+        sx = numpy.empty(3*n, dtype=object)
+        sy = numpy.empty(3*n, dtype=object)
+        sx[0::3] = 0
+        sx[1::3] = xdata
+        sy[0::3] = ydata
+        sy[1::3] = ydata
+        return go.Scattergl(x=sx, y=sy, mode='lines', line=dict(color='black', width=2), hoverinfo='skip', showlegend=False)
+
+    def _create_hover_template(self, xdescr, ydescr, color_descr, size_descr):
+        return "%s: %%{customdata[0]}<br>%s: %%{customdata[1]}<br>%s: %%{customdata[2]}<br>%s: %%{customdata[3]}<extra></extra>" % (
+            xdescr, ydescr, color_descr, size_descr)
 
     #Generate the lollipop as a plotly graph objects Figure
     def create_lollipop(self, xcol, ycol, color_col, size_col, xaxis_label, yaxis_label):
-        xdata, xdata_raw = xcol.getData("x", self.table, self.con)
-        ydata, ydata_raw = ycol.getData("y", self.table, self.con)
-        color_data, color_data_raw = color_col.getData("color", self.table, self.con)
-        size_data, size_data_raw = size_col.getData("size", self.table, self.con)
-        print("Sizes : ", len(xdata) , " " , len(ydata) , " " , len(color_data) , " " , len(size_data) )
-
-        hover_text = self._create_hover_text(xdata_raw, ydata_raw, color_data_raw, size_data_raw, 
-                                            xcol.getHoverDescription(), ycol.getHoverDescription(),
-                                            color_col.getHoverDescription(), size_col.getHoverDescription() )
-        plot_data = self._create_data(xdata, ydata, color_data, size_data, hover_text)
-        shapes = self._create_shapes(xdata,ydata)
-        
+        data = fetchColumns(self.con, self.table, xcol.columns() + ycol.columns() + color_col.columns() + size_col.columns())
+        xdata, xdata_raw = xcol.transform("x", data)
+        ydata, ydata_raw = ycol.transform("y", data)
+        color_data, color_data_raw = color_col.transform("color", data)
+        size_data, size_data_raw = size_col.transform("size", data)
+
+        hover_data = numpy.stack([ numpy.asarray(d, dtype=object) for d in [xdata_raw, ydata_raw, color_data_raw, size_data_raw] ], axis=-1)
+        hover_template = self._create_hover_template(xcol.getHoverDescription(), ycol.getHoverDescription(),
+                                                     color_col.getHoverDescription(), size_col.getHoverDescription() )
+        plot_data = self._create_data(xdata, ydata, color_data, size_data, hover_data, hover_template)
         
         layout = go.Layout(
-            shapes=shapes,
             width=1000,
             height=1000,
         )
@@ -169,44 +195,55 @@ class LollipopChart:
         fig = go.Figure(plot_data, layout)
 
         #Add vertical line marking 0 on x axis
-        fig.add_shape(
-            type='line',
-            x0=0,
-            y0=numpy.min(ydata),
-            x1=0,
-            y1=numpy.max(ydata),
-            line=dict(color='black', width=2)
-        )
+        if len(ydata) > 0:
+            fig.add_shape(
+                type='line',
+                x0=0,
+                y0=numpy.min(ydata),
+                x1=0,
+                y1=numpy.max(ydata),
+                line=dict(color='black', width=2)
+            )
         fig.update_xaxes(title_text=xaxis_label)
         fig.update_yaxes(title_text=yaxis_label)
         
         return fig
 
-    #Create and show the lollipop chart; this is the default interface
+    #Create and show the lollipop chart (see visualization.setRenderer); this is the default interface
     def show(self, x_col, y_col, color_col, size_col, xaxis_label, yaxis_label):
         fig = self.create_lollipop(x_col, y_col, color_col, size_col, xaxis_label, yaxis_label)
-        pio.show(fig)    
+        showFigure(fig)
 
 
 #Show a lollipop chart comparing the call stack summaries
-def CallStackSummariesComparison(pdb: ProvenanceDatabase, pdb2: ProvenanceDatabase):
+#limit : if not None, show only the 'limit' call stacks with the largest combined average severity (default: all)
+#show : if False, only build the figure and return it
+def CallStackSummariesComparison(pdb: ProvenanceDatabase, pdb2: ProvenanceDatabase, limit = None, show = True):
     assert pdb.pdb_con is pdb2.pdb_con
     con = pdb.pdb_con
 
-    #Build combined table from call stack summaries
-    pdb.getCallStackSummaries(0).to_view("__CallStackSummariesComparison__tmp1")
-    pdb2.getCallStackSummaries(0).to_view("__CallStackSummariesComparison__tmp2")
-    r2 = Table("__CallStackSummariesComparison__tmp1")
-    r3 = Table("__CallStackSummariesComparison__tmp2")
-    con(Query.from_(r2).select(r2.call_stack_label, r2.fname, r2.fname_hash, r2.anomaly_count.as_("anomaly_count_A"), r3.anomaly_count.as_("anomaly_count_B"), r2.avg_severity.as_("avg_severity_A"),  r3.avg_severity.as_("avg_severity_B")  )
-    .inner_join(r3).on( (r3.call_stack_label == r2.call_stack_label) & (r3.fname_hash == r2.fname_hash) )).to_view("__CallStackSummariesComparison__tmp3")
-    con("SELECT * FROM __CallStackSummariesComparison__tmp3 ORDER BY avg_severity_A + avg_severity_B DESC LIMIT 10").to_view("__CallStackSummariesComparison__tmp4")
-
-    #Generate chart
-    chart = LollipopChart(con, "__CallStackSummariesComparison__tmp4")
-    xcol = ComparisonColumn("Anomaly count","anomaly_count_A","anomaly_count_B",True)
-    ycol = LabelColumn("Call stack label", "call_stack_label",post_trans="index")
-    color_col = LabelColumn("Function name","fname",post_trans="hash")
-    size_col = ComparisonColumn("Severity","avg_severity_A","avg_severity_B",True)
-
-    chart.show(xcol,ycol,color_col,size_col,"Normalized anomaly count","Call stack index")
+    #Build combined table from call stack summaries. The intermediate views are uniquely named such that concurrent comparisons do not
+    #collide, and are dropped once the chart is built
+    tmp = [ con.uniqueName("__CallStackSummariesComparison__tmp") for i in range(4) ]
+    try:
+        pdb.getCallStackSummaries(0).to_view(tmp[0])
+        pdb2.getCallStackSummaries(0).to_view(tmp[1])
+        r2 = Table(tmp[0])
+        r3 = Table(tmp[1])
+        con(Query.from_(r2).select(r2.call_stack_label, r2.fname, r2.fname_hash, r2.anomaly_count.as_("anomaly_count_A"), r3.anomaly_count.as_("anomaly_count_B"), r2.avg_severity.as_("avg_severity_A"),  r3.avg_severity.as_("avg_severity_B")  )
+        .inner_join(r3).on( (r3.call_stack_label == r2.call_stack_label) & (r3.fname_hash == r2.fname_hash) )).to_view(tmp[2])
+        con("SELECT * FROM %s ORDER BY avg_severity_A + avg_severity_B DESC%s" % (tmp[2], "" if limit is None else " LIMIT %d" % limit)).to_view(tmp[3])
+
+        #Generate chart
+        chart = LollipopChart(con, tmp[3])
+        xcol = ComparisonColumn("Anomaly count","anomaly_count_A","anomaly_count_B",True)
+        ycol = LabelColumn("Call stack label", "call_stack_label",post_trans="index")
+        color_col = LabelColumn("Function name","fname",post_trans="hash")
+        size_col = ComparisonColumn("Severity","avg_severity_A","avg_severity_B",True)
+
+        if not show:
+            return chart.create_lollipop(xcol,ycol,color_col,size_col,"Normalized anomaly count","Call stack index")
+        chart.show(xcol,ycol,color_col,size_col,"Normalized anomaly count","Call stack index")
+    finally:
+        for nm in reversed(tmp):
+            con("DROP VIEW IF EXISTS %s" % nm, cache=False)
@@ -1,11 +1,7 @@
-import plotly.express as px
 import plotly.graph_objs as go
-import plotly.io as pio
 import numpy
-import duckdb
-from pypika import *
-from ...provenance_database import *
-pio.renderers.default = 'browser'
+from pypika import Table
+from ..rendering import showFigure
 
 class ParcoordsChart:
     def __init__(self, table : Table, pdb):
@@ -21,13 +17,7 @@ class ParcoordsChart:
         return string.strip("\"'")
     
     def create_parcoords_plot(self, list_of_param, updated_labels, color_col):
-        query = "FROM " + self.table + " SELECT"
-        for i, par in enumerate(list_of_param):
-            query += " " + par 
-            if i != len(list_of_param)-1:
-                query += ","
-        df_pars = self.pdb(query).fetchnumpy()            
-        print(df_pars)
+        df_pars = self.pdb("SELECT %s FROM %s" % (", ".join(list_of_param), self.table)).fetchnumpy()
         
         dimensions = []
         for i, par in enumerate(list_of_param):
@@ -39,33 +29,110 @@ class ParcoordsChart:
             line=dict(color=df_pars[color_col_s],
                       colorscale='Bluered',
                       showscale=True,
-                      cmax=numpy.max(df_pars[color_col_s]),
-                      cmin=numpy.min(df_pars[color_col_s])),
+                      cmax=numpy.max(df_pars[color_col_s]) if len(df_pars[color_col_s]) > 0 else None,
+                      cmin=numpy.min(df_pars[color_col_s]) if len(df_pars[color_col_s]) > 0 else None),
             dimensions=dimensions
         ))
         
 
         return fig
 
+    #Binned-density version of create_parcoords_plot for large numbers of rows. Each parameter is divided into 'nbins' equal bins
+    #over its range and the rows are aggregated in the database by their combination of bins. A line is drawn through the bin
+    #centers of each occupied combination, colored by the (log10) number of rows it represents
+    def create_density_plot(self, list_of_param, updated_labels, nbins = 50):
+        n = len(list_of_param)
+        cols = ", ".join("%s AS c%d" % (par,i) for i, par in enumerate(list_of_param))
+        ranges = ", ".join("MIN(c%d) AS lo%d, MAX(c%d) AS hi%d" % (i,i,i,i) for i in range(n))
+        centers = ", ".join("(LEAST(FLOOR((c%d - lo%d) / GREATEST(hi%d - lo%d, 1e-300) * %d), %d) + 0.5) * (hi%d - lo%d) / %d + lo%d AS c%d" % (
+            i,i,i,i,nbins,nbins-1,i,i,nbins,i,i) for i in range(n))
+        df_pars = self.pdb("WITH t AS (SELECT %s FROM %s), r AS (SELECT %s FROM t) SELECT %s, COUNT(*) AS count FROM t, r GROUP BY ALL ORDER BY count" % (
+            cols, self.table, ranges, centers)).fetchnumpy()
+
+        dimensions = [ dict(label=updated_labels[i], values=df_pars["c%d" % i]) for i in range(n) ]
+        color = numpy.log10(numpy.asarray(df_pars["count"], dtype=numpy.float64))
+        fig = go.Figure(data=go.Parcoords(
+            line=dict(color=color,
+                      colorscale='Viridis',
+                      showscale=True,
+                      colorbar=dict(title="log10(count)")),
+            dimensions=dimensions
+        ))
+        return fig
+
     def show(self, list_of_param, updated_labels, color_col, font_size=25, tick_font_size=18, height=700):
         fig = self.create_parcoords_plot(list_of_param, updated_labels, color_col)
-        
+        showFigure(self._layout(fig, font_size, tick_font_size, height))
+
+    #As show, but drawing the binned density (see create_density_plot)
+    def show_density(self, list_of_param, updated_labels, nbins=50, font_size=25, tick_font_size=18, height=700):
+        fig = self.create_density_plot(list_of_param, updated_labels, nbins)
+        showFigure(self._layout(fig, font_size, tick_font_size, height))
+
+    #Apply the font sizes and height to the figure, returning it
+    def _layout(self, fig, font_size=25, tick_font_size=18, height=700):
         # Set font size for the tick labels
         fig.update_layout(font=dict(size=font_size))
         fig.update_traces(tickfont_size=tick_font_size, selector=dict(type='parcoords'))
         fig.update_layout(height=height)
-        
-        pio.show(fig)
+        return fig
+
+#Return the query selecting the anomalies (event_id, pid, rid, fid, entry, outlier_severity) to be shown by AnomalySummary
+#  topn : the 'topn' anomalies by severity
+#  sample : if not None, a sample of at most 'sample' anomalies instead, stratified according to 'stratify':
+#     None : a uniform random sample
+#     "rank_function" : proportional allocation over the (pid, rank, function) strata, such that every stratum is represented in
+#                       proportion to its number of anomalies. The fractional parts of the quotas are allocated by largest
+#                       remainder, such that the sample has exactly 'sample' anomalies and strata too small for a whole
+#                       anomaly are represented only if there are anomalies left over
+#     "severity" : equal allocation over 'nstrata' severity quantile bins, such that the tail of the severity distribution is
+#                  represented as well as the bulk
+#The sample is a deterministic function of 'seed'
+#source : optionally the SQL of a query to select from in place of the anomalies table, e.g. a subset of the anomalies, with at least
+#         the columns listed above
+def anomalySelectionQuery(pdb, topn = 10, sample = None, stratify = None, nstrata = 10, seed = 1234, source = None):
+    d = pdb.anomalies.get_sql() if source is None else "(%s) AS _src" % source
+    cols = "event_id, pid, rid, fid, entry, outlier_severity"
+    if sample is None:
+        return "SELECT %s FROM %s ORDER BY outlier_severity DESC LIMIT %d" % (cols,d,topn)
+    if stratify is None:
+        return "SELECT %s FROM %s USING SAMPLE reservoir(%d ROWS) REPEATABLE (%d)" % (cols,d,sample,seed)
+    if stratify == "rank_function":
+        return "WITH q AS (SELECT pid, rid, fid, %d * COUNT(*) / SUM(COUNT(*)) OVER () AS _q FROM %s GROUP BY pid, rid, fid), \
+k AS (SELECT pid, rid, fid, FLOOR(_q) + CASE WHEN ROW_NUMBER() OVER (ORDER BY _q - FLOOR(_q) DESC, hash(pid, rid, fid, %d)) <= %d - SUM(FLOOR(_q)) OVER () \
+THEN 1 ELSE 0 END AS _k FROM q) \
+SELECT %s FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY pid, rid, fid ORDER BY hash(event_id, %d)) AS _rn FROM %s) AS e \
+INNER JOIN k ON k.pid = e.pid AND k.rid = e.rid AND k.fid = e.fid WHERE e._rn <= k._k" % (sample,d,seed,sample,", ".join("e." + c for c in cols.split(", ")),seed,d)
+    if stratify == "severity":
+        return "SELECT %s FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY _bin ORDER BY hash(event_id, %d)) AS _rn \
+FROM (SELECT %s, NTILE(%d) OVER (ORDER BY outlier_severity) AS _bin FROM %s)) WHERE _rn <= %d + CASE WHEN _bin <= %d THEN 1 ELSE 0 END" % (
+            cols,seed,cols,nstrata,d,sample // nstrata,sample % nstrata)
+    raise Exception("Invalid stratification")
 
-#Produce a parallel coordinates plot of some important variables for the top 'topn' anomalies by severity
-def AnomalySummary(pdb, topn=10):
-    #Generate a table with the required information
-    d = pdb.anomalies
-    nn = pdb.node_state
-    pdb(Query.from_(d).select(d.star,nn.star).inner_join(nn).on(d.event_id == nn.event_id).orderby('outlier_severity', order=Order.desc).limit(topn)).to_view("__AnomalySummary_tmp1")
-    pdb.convertColumnToSecondsSinceStart("__AnomalySummary_tmp1","entry","entry_s").to_view("__AnomalySummary_tmp2")
-    pdb("FROM __AnomalySummary_tmp2 SELECT *, \"Memory Footprint (VmRSS) (KB)\"/1024 AS RSS_MB").to_view("__AnomalySummary_tmp3")
+#Produce a parallel coordinates plot of some important variables for the top 'topn' anomalies by severity, or for a sample of the
+#anomalies (see anomalySelectionQuery for the options)
+#density : if True, draw the binned density of the anomalies with 'nbins' bins per variable rather than one line per anomaly (see
+#          ParcoordsChart.create_density_plot); suited to plotting large numbers of anomalies, e.g. all anomalies with topn=None
+#show : if False, only build the figure and return it
+def AnomalySummary(pdb, topn=10, sample=None, stratify=None, nstrata=10, density=False, nbins=50, seed=1234, show=True):
+    #The anomalies are selected among those with a node state record, such that anomalies without one do not take the place of
+    #those that have one, and only the selected anomalies are then joined with their node state and the run start times. The chart
+    #reads the result as a subquery, such that nothing is left in the connection
+    src = "SELECT * FROM %s WHERE event_id IN (SELECT event_id FROM %s)" % (pdb.anomalies.get_sql(), pdb.node_state.get_sql())
+    sel = src if topn is None and sample is None else anomalySelectionQuery(pdb, topn, sample, stratify, nstrata, seed, src)
+    q = "SELECT (a.entry - rs.run_start)/1e6 AS entry_s, nn.\"Memory Footprint (VmRSS) (KB)\"/1024 AS RSS_MB, nn.\"meminfo:MemFree (MB)\" AS free_MB, \
+a.outlier_severity FROM (%s) AS a INNER JOIN %s AS nn ON nn.event_id = a.event_id INNER JOIN %s AS rs ON rs.pid = a.pid AND rs.rid = a.rid" % (
+        sel, pdb.node_state.get_sql(), pdb.runStartTable().get_sql())
+    params = ['entry_s', 'RSS_MB', 'free_MB', 'outlier_severity']
 
     #Generate the chart
-    par = ParcoordsChart("__AnomalySummary_tmp3",pdb)
-    par.show(['entry_s', 'RSS_MB', '"meminfo:MemFree (MB)"', 'outlier_severity'],['Entry time (s)', 'Resident set size (MB)', 'Mem free (MB)', 'Severity'], 'outlier_severity')
+    par = ParcoordsChart("(%s)" % q,pdb)
+    labels = ['Entry time (s)', 'Resident set size (MB)', 'Mem free (MB)', 'Severity']
+    if density:
+        fig = par.create_density_plot(params, labels, nbins)
+    else:
+        fig = par.create_parcoords_plot(params, labels, 'outlier_severity')
+    fig = par._layout(fig)
+    if not show:
+        return fig
+    showFigure(fig)
@@ -0,0 +1,36 @@
+import os
+import sys
+
+#The choice of plotly renderer with which the charts are shown. Setting the renderer does not import plotly
+#The default (renderer None) is:
+#  - the renderer named by the PLOTLY_RENDERER environment variable, if set
+#  - plotly's own default within a Jupyter kernel
+#  - "browser" if a display is available
+#  - otherwise "none": the charts are built but not shown, such that headless jobs neither fail nor block
+_renderer = None
+
+#Set the renderer: a plotly renderer name (e.g. "browser", "notebook", "png"), "none" to never show the charts, or None for the default
+def setRenderer(name):
+    global _renderer
+    _renderer = name
+
+#Return the renderer with which the charts are shown: a plotly renderer name, "none", or None for plotly's default
+def getRenderer():
+    if _renderer is not None:
+        return _renderer
+    if "PLOTLY_RENDERER" in os.environ:
+        return os.environ["PLOTLY_RENDERER"]
+    if "ipykernel" in sys.modules:
+        return None
+    if sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        return "none"
+    return "browser"
+
+#Show the figure with the chosen renderer
+#Nothing is returned, such that a chart shown by the last statement of a Jupyter cell is not rendered a second time as the output
+#of the cell
+def showFigure(fig):
+    r = getRenderer()
+    if r != "none":
+        import plotly.io as pio
+        pio.show(fig, renderer=r)
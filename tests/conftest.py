@@ -0,0 +1,35 @@
+import pytest
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+from chimbuko_offline_analysis.synthetic import generateProvenanceDatabase
+
+#Synthetic databases shared by all tests. They are generated once per session and attached read-only by each test on a new
+#connection, such that the state of one test (cache, materialized tables, profiler) does not leak into another
+
+@pytest.fixture(scope="session")
+def db_path(tmp_path_factory):
+    return generateProvenanceDatabase(str(tmp_path_factory.mktemp("db") / "run.duckdb"), nrank=4, nfunc=20, nevent=4000,
+                                      anomaly_frac=0.05, nstep=10, seed=1)
+
+#A second run of the same application, e.g. for comparisons across runs
+@pytest.fixture(scope="session")
+def db_path2(tmp_path_factory):
+    return generateProvenanceDatabase(str(tmp_path_factory.mktemp("db") / "run2.duckdb"), nrank=4, nfunc=20, nevent=4000,
+                                      anomaly_frac=0.05, nstep=10, seed=2)
+
+#A run of two programs, whose function indices overlap
+@pytest.fixture(scope="session")
+def db_path_multi(tmp_path_factory):
+    return generateProvenanceDatabase(str(tmp_path_factory.mktemp("db") / "multi.duckdb"), npid=2, nrank=4, nfunc=20, nevent=4000,
+                                      anomaly_frac=0.05, nstep=10, seed=3)
+
+@pytest.fixture
+def con():
+    return ProvenanceDatabaseConnection()
+
+@pytest.fixture
+def pdb(con, db_path):
+    return con.connect(db_path, quiet=True)
+
+@pytest.fixture
+def pdb_multi(con, db_path_multi):
+    return con.connect(db_path_multi, quiet=True)
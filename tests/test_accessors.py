@@ -0,0 +1,199 @@
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+
+#The accessors that were rewritten for performance (batched, materialized or vectorized) are checked against the straightforward
+#per-row queries of the original implementation
+
+def ref(pdb, sql):
+    return pdb.pdb_con.cursor().sql(sql.replace("{db}", pdb.db_nm))
+
+def test_batched_function_accessors(pdb):
+    fids = [3, 0, 7, 3, 19]
+    assert list(pdb.getFunctionNames(fids)) == [ pdb.getFunctionName(f) for f in fids ]
+    assert list(pdb.getFunctionAnomalyCounts(fids)) == [ pdb.getFunctionAnomalyCount(f) for f in fids ]
+    assert list(pdb.getFunctionExecutionCounts(fids)) == [ pdb.getFunctionExecutionCount(f) for f in fids ]
+    for t in ['exclusive', 'inclusive']:
+        assert pdb.getFunctionProfiles(fids, t).fetchall() == [ pdb.getFunctionProfile(f, t).fetchall()[0] for f in fids ]
+    edges, counts = pdb.getFunctionADmodelHistograms(fids)
+    for f, e, c in zip(fids, edges, counts):
+        e0, c0 = pdb.getFunctionADmodelHistogram(f)
+        numpy.testing.assert_allclose(e, e0)
+        numpy.testing.assert_array_equal(c, c0)
+
+def test_batched_function_accessors_missing(pdb):
+    with pytest.raises(Exception, match="Could not find function"):
+        pdb.getFunctionNames([0, 1000])
+
+def test_call_stack_label_counts(pdb):
+    for subset, tabs in [ ('anomalies', ['anomalies']), ('normal_execs', ['normal_execs']), ('both', ['anomalies', 'normal_execs']) ]:
+        ev = " UNION ALL ".join("SELECT event_id, fid FROM {db}.%s" % t for t in tabs)
+        r = ref(pdb, "SELECT e.fid, lb.call_stack_label, COUNT(*) AS count FROM (%s) AS e INNER JOIN {db}.call_stack_labels AS lb \
+ON lb.event_id = e.event_id GROUP BY ALL ORDER BY e.fid, count DESC, lb.call_stack_label" % ev).fetchall()
+        assert pdb.getCallStackLabelCounts(subset=subset).fetchall() == r
+        assert pdb.getCallStackLabelCounts([4, 2], subset=subset).fetchall() == [ x for x in r if x[0] in (2, 4) ]
+        assert pdb.getFunctionCallStackLabelsAndCounts(4, subset) == { l : c for f, l, c in r if f == 4 }
+
+def test_labeled_call_stack(pdb):
+    eid, label = ref(pdb, "SELECT event_id, call_stack_label FROM {db}.call_stack_labels ORDER BY event_id LIMIT 1").fetchone()
+    cs = pdb.getEventCallStack(eid).fetchnumpy()
+    r = pdb.getLabeledCallStack(label).fetchnumpy()
+    numpy.testing.assert_array_equal(r["entry_idx"], cs["entry_idx"])
+    numpy.testing.assert_array_equal(r["fid"], cs["fid"])
+    assert list(r["name"]) == [ "func_%d" % f for f in cs["fid"] ]
+    with pytest.raises(Exception, match="Could not find the provided label"):
+        pdb.getLabeledCallStack(2**63 + 12345)
+
+def test_top_functions(pdb):
+    for order_by, col in [ ('anom_severity', 'accum_sev'), ('anom_count', 'anomalies'), ('total_time_excl', 'total_time_excl') ]:
+        r = ref(pdb, "SELECT sev.accumulate AS accum_sev, e.accumulate AS total_time_excl, sev.fid, f.pid, a.accumulate AS anomalies, \
+e.count AS calls, CAST(a.accumulate / e.count AS DECIMAL(5, 4)) AS anom_call_frac, CAST(sev.accumulate / e.accumulate AS DECIMAL(5, 4)) AS anom_time_frac, \
+f.name FROM {db}.func_anomaly_severity_stats AS sev INNER JOIN {db}.functions AS f ON f.fid = sev.fid \
+INNER JOIN {db}.func_anomaly_count_stats AS a ON a.fid = f.fid INNER JOIN {db}.func_runtime_profile_exclusive_stats AS e ON e.fid = f.fid \
+ORDER BY %s DESC, sev.fid" % col).fetchall()
+        assert pdb.topFunctions(order_by).order("%s DESC, fid" % col).fetchall() == r
+    with pytest.raises(Exception, match="Unsupported sort order"):
+        pdb.topFunctions("name")
+
+def test_application_profile(pdb):
+    r = ref(pdb, "SELECT e.accumulate AS runtime, sev.accumulate AS accum_sev, e.fid, CAST(sev.accumulate / e.accumulate AS DECIMAL(5, 4)) AS anom_time_frac, \
+f.name FROM {db}.func_runtime_profile_exclusive_stats AS e INNER JOIN {db}.functions AS f ON f.fid = e.fid \
+INNER JOIN {db}.func_anomaly_severity_stats AS sev ON sev.fid = e.fid ORDER BY runtime DESC, e.fid").fetchall()
+    assert pdb.getApplicationProfile('exclusive').order("runtime DESC, fid").fetchall() == r
+    r = ref(pdb, "SELECT e.accumulate AS runtime_incl, e.fid, f.name FROM {db}.func_runtime_profile_inclusive_stats AS e \
+INNER JOIN {db}.functions AS f ON f.fid = e.fid ORDER BY runtime_incl DESC, e.fid").fetchall()
+    assert pdb.getApplicationProfile('inclusive').order("runtime_incl DESC, fid").fetchall() == r
+
+def test_run_start_times(pdb):
+    for pid, rid, start in ref(pdb, "SELECT pid, rid, io_step_tstart FROM {db}.io_steps WHERE io_step = 0").fetchall():
+        assert pdb.getRunStartTime(pid, rid) == start
+    with pytest.raises(Exception, match="Could not find the run start time"):
+        pdb.getRunStartTime(0, 100)
+
+#Tables are accepted as pypika tables or as raw SQL, e.g. a qualified name or a subquery
+def test_convert_column_to_seconds_since_start(pdb):
+    r = ref(pdb, "FROM {db}.anomalies AS a SELECT *, (exit - (FROM {db}.io_steps SELECT FIRST(io_step_tstart) WHERE pid = a.pid AND rid = a.rid \
+AND io_step = 0))/1e6 AS exit_s ORDER BY event_id").fetchall()
+    for tab in [ pdb.anomalies, "%s.anomalies" % pdb.db_nm, "(SELECT * FROM %s.anomalies)" % pdb.db_nm ]:
+        got = pdb.convertColumnToSecondsSinceStart(tab, "exit", "exit_s").order("event_id").fetchall()
+        assert got == r
+    got = pdb.convertColumnToSecondsSinceStart("%s.anomalies" % pdb.db_nm, ["entry", "exit"], ["entry_s", "exit_s"]).order("event_id").fetchnumpy()
+    numpy.testing.assert_allclose(got["exit_s"] - got["entry_s"], (got["exit"] - got["entry"])/1e6)
+
+def test_anomaly_times(pdb):
+    start = ref(pdb, "SELECT io_step_tstart FROM {db}.io_steps WHERE pid = 0 AND rid = 2 AND io_step = 0").fetchone()[0]
+    ex = ref(pdb, "SELECT exit FROM {db}.anomalies WHERE pid = 0 AND rid = 2 ORDER BY exit").fetchnumpy()["exit"]
+    numpy.testing.assert_allclose(numpy.sort(pdb.getAnomalyTimes(0, 2)), (ex - start)/1e6)
+    streamed = numpy.concatenate(list(pdb.iterAnomalyTimes(0, 2, batch_size=7)))
+    numpy.testing.assert_allclose(numpy.sort(streamed), (ex - start)/1e6)
+
+def test_function_events(pdb):
+    r = pdb.getFunctionEvents(5, "anomalies").fetchnumpy()
+    starts = numpy.array([ pdb.getRunStartTime(p, q) for p, q in zip(r["pid"], r["rid"]) ])
+    numpy.testing.assert_allclose(r["entry_s"], (r["entry"] - starts)/1e6)
+    numpy.testing.assert_allclose(r["exit_s"], (r["exit"] - starts)/1e6)
+    assert numpy.all(numpy.diff(r["exit"]) <= 0)
+
+def test_event_lookup(pdb):
+    a = ref(pdb, "SELECT event_id FROM {db}.anomalies ORDER BY event_id LIMIT 3").fetchnumpy()["event_id"]
+    n = ref(pdb, "SELECT event_id FROM {db}.normal_execs ORDER BY event_id LIMIT 3").fetchnumpy()["event_id"]
+    assert pdb.getEventPrimaryTable(a[0]) == pdb.anomalies
+    assert pdb.getEventPrimaryTable(n[0]) == pdb.normal_execs
+    with pytest.raises(Exception, match="Could not find event"):
+        pdb.getEventPrimaryTable("no such event")
+    ids = [n[1], a[2], "no such event", a[0], n[0]]
+    r = pdb.lookupEvents(ids).fetchnumpy()
+    assert list(r["event_id"]) == [n[1], a[2], a[0], n[0]]
+    assert list(r["etype"]) == ["normal_execs", "anomalies", "anomalies", "normal_execs"]
+
+def test_events_node_status(pdb):
+    ids = ref(pdb, "SELECT event_id FROM {db}.anomalies ORDER BY event_id LIMIT 5").fetchnumpy()["event_id"]
+    r = pdb.getEventsNodeStatus(ids, 'memory', nearest=False).fetchnumpy()
+    assert list(r["event_id"]) == list(ids)
+    for i, eid in enumerate(ids):
+        s = pdb.getEventNodeMemoryStatus(eid).fetchnumpy()
+        for c in ["hostname", "state_timestamp_s", "entry_s", "exit_s", "free_MB", "total_MB", "RSS_KB", "heap_memory_used_KB"]:
+            assert r[c][i] == s[c][0]
+        assert r["state_source"][i] == "exact"
+
+def test_call_stack_summaries(pdb):
+    r = ref(pdb, "SELECT lb.call_stack_label, COUNT(*) AS anomaly_count, AVG(a.outlier_severity) AS avg_severity, FIRST(f.name) AS fname \
+FROM {db}.anomalies AS a INNER JOIN {db}.call_stack_labels AS lb ON lb.event_id = a.event_id INNER JOIN {db}.functions AS f ON f.fid = a.fid \
+WHERE a.pid = 0 GROUP BY lb.call_stack_label ORDER BY lb.call_stack_label").fetchall()
+    s = pdb.getCallStackSummaries(0).fetchnumpy()
+    assert numpy.all(numpy.diff(s["avg_severity"]) <= 0)
+    order = numpy.argsort(s["call_stack_label"])
+    assert list(s["call_stack_label"][order]) == [ x[0] for x in r ]
+    assert list(s["anomaly_count"][order]) == [ x[1] for x in r ]
+    numpy.testing.assert_allclose(s["avg_severity"][order], [ x[2] for x in r ])
+    assert list(s["fname"][order]) == [ x[3] for x in r ]
+
+#The summaries stored in the sidecar file give the same results as those computed on the fly
+def test_summary_store(pdb, db_path, tmp_path):
+    plain = pdb
+    stored = ProvenanceDatabaseConnection().connect(db_path, quiet=True, summaries=str(tmp_path / "summaries.duckdb"))
+    assert stored.topFunctions().order("accum_sev DESC, fid").fetchall() == plain.topFunctions().order("accum_sev DESC, fid").fetchall()
+    assert stored.getApplicationProfile('inclusive').order("runtime_incl DESC, fid").fetchall() == \
+        plain.getApplicationProfile('inclusive').order("runtime_incl DESC, fid").fetchall()
+    assert stored.getCallStackSummaries(0).order("call_stack_label").fetchall() == plain.getCallStackSummaries(0).order("call_stack_label").fetchall()
+    assert stored.getCallStackLabelCounts().fetchall() == plain.getCallStackLabelCounts().fetchall()
+    for k in ["pid", "rid", "run_start"]:
+        numpy.testing.assert_array_equal(stored.runStartTimes()[k], plain.runStartTimes()[k])
+
+#The quantiles of the runtime sketches are within the relative accuracy of the exact quantiles
+def test_runtime_sketches(pdb):
+    alpha = 0.01
+    sk = pdb.runtimeSketches(alpha=alpha)
+    v = ref(pdb, "SELECT runtime_exclusive FROM {db}.anomalies WHERE fid = 3 UNION ALL SELECT runtime_exclusive FROM {db}.normal_execs WHERE fid = 3").fetchnumpy()["runtime_exclusive"]
+    v = numpy.sort(v)
+    i = sk.keyIndex([0], ["func_3"])[0]
+    assert sk.total[i] == len(v)
+    for q, x in zip([0.1, 0.5, 0.9], sk.quantiles([0.1, 0.5, 0.9])[i]):
+        exact = max(v[int(numpy.floor(q * (len(v) - 1)))], 1)
+        assert abs(x - exact) <= alpha * exact * (1 + 1e-9)
+    assert sk.merge(sk).total[i] == 2 * len(v)
+
+#The function indices of different programs overlap, such that the batched accessors must be given the program
+def test_batched_function_accessors_multi_program(pdb_multi):
+    fids = [3, 0, 7]
+    with pytest.raises(Exception, match="specify the pid"):
+        pdb_multi.getFunctionNames(fids)
+    pids = numpy.array([1, 0, 1])
+    ref = lambda tab, col: [ pdb_multi.pdb_con.cursor().sql("SELECT %s FROM %s.%s WHERE pid = %d AND fid = %d" % (col, pdb_multi.db_nm, tab, p, f)).fetchone()[0]
+                             for p, f in zip(pids, fids) ]
+    assert list(pdb_multi.getFunctionNames(fids, pid=1)) == [ "func_%d" % f for f in fids ]
+    assert list(pdb_multi.getFunctionAnomalyCounts(fids, pids)) == ref("func_anomaly_count_stats", "accumulate")
+    assert list(pdb_multi.getFunctionExecutionCounts(fids, pids)) == ref("func_runtime_profile_exclusive_stats", "count")
+    r = pdb_multi.getFunctionProfiles(fids, 'inclusive', pids).fetchnumpy()
+    assert list(r["pid"]) == list(pids) and list(r["fid"]) == fids
+    edges, counts = pdb_multi.getFunctionADmodelHistograms(fids, pids)
+    assert [ e[0] for e in edges ] == ref("ad_models", "first_edge")
+    with pytest.raises(Exception, match="Could not find function"):
+        pdb_multi.getFunctionNames(fids, pid=5)
+
+#The bulk event methods accept the event ids in several forms, and leave no intermediate tables in the connection
+def test_event_id_inputs(pdb):
+    a = pdb.anomalies
+    q = a.select(a.event_id).orderby(a.event_id).limit(20)
+    ids = pdb(q).fetchnumpy()["event_id"]
+    expect = pdb.lookupEvents(ids).fetchall()
+    assert [ r[0] for r in expect ] == list(ids)
+    assert pdb.lookupEvents(list(ids)).fetchall() == expect
+    assert pdb.lookupEvents(pdb(q)).fetchall() == expect
+    assert pdb.lookupEvents(q).fetchall() == expect
+    status = pdb.getEventsNodeStatus(ids).fetchall()
+    assert pdb.getEventsNodeStatus(q).fetchall() == status
+    assert pdb.getEventsNodeStatus(pdb(q)).fetchall() == status
+    assert pdb.lookupEvents(ids, compact=True).num_rows == len(ids)
+
+def test_event_id_tables_dropped(pdb):
+    ids = ref(pdb, "SELECT event_id FROM {db}.anomalies LIMIT 10").fetchnumpy()["event_id"]
+    def run(i):
+        pdb.lookupEvents(ids).fetchall()
+        pdb.getEventsNodeStatus(ids).fetchall()
+    with ThreadPoolExecutor(4) as ex:
+        list(ex.map(run, range(16)))
+    run(0)
+    assert ref(pdb, "SELECT view_name AS nm FROM duckdb_views() WHERE view_name LIKE '__event_ids%' UNION ALL \
+SELECT table_name FROM duckdb_tables() WHERE table_name LIKE '__event_ids%'").fetchall() == []
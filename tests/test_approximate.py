@@ -0,0 +1,22 @@
+import pytest
+
+#The exact follow-up of the approximate ranking gives the exact top functions, including functions absent from the sample
+@pytest.mark.parametrize("order_by, col", [ ('anom_severity', 'accum_sev'), ('anom_count', 'anomalies') ])
+@pytest.mark.parametrize("fraction", [0.05, 0.3])
+def test_refine_top_functions(pdb, order_by, col, fraction):
+    n = 5
+    exact = pdb.topFunctions(order_by).limit(n).fetchnumpy()
+    for seed in range(5):
+        approx = pdb.approxTopFunctions(order_by, fraction=fraction, sampling="bernoulli", seed=seed)
+        r = pdb.refineTopFunctions(approx, n, order_by).fetchnumpy()
+        assert list(r["fid"]) == list(exact["fid"])
+        assert list(r[col]) == list(exact[col])
+
+def test_refine_top_functions_unsampled(pdb):
+    exact = pdb.topFunctions('anom_severity').limit(3).fetchall()
+    approx = pdb.approxTopFunctions(fraction=0.3, sampling="bernoulli").filter("fid <> %d" % exact[0][2])
+    assert pdb.refineTopFunctions(approx, 3).fetchall() == exact
+    #Without any sampled function all functions are candidates
+    assert pdb.refineTopFunctions(approx.filter("false"), 3).fetchall() == exact
+    with pytest.raises(Exception, match="Unsupported sort order"):
+        pdb.refineTopFunctions(approx, 3, 'total_time_excl')
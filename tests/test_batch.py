@@ -0,0 +1,39 @@
+import json
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.compute as pc
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+from chimbuko_offline_analysis.batch import analyzeDatabases, heatmapTable, main
+
+#The results of all runs are merged, labeled by run, and match the analyses of each run
+def test_analyze_databases(db_path, db_path2):
+    results, errors = analyzeDatabases([db_path, db_path2], ["topFunctions", "heatmap"], processes=2, opts={ "nbins" : 5 })
+    assert errors == {}
+    for i, path in enumerate([db_path, db_path2]):
+        pdb = ProvenanceDatabaseConnection().connect(path, quiet=True)
+        t = results["topFunctions"].filter(pc.equal(results["topFunctions"]["run_idx"], i))
+        assert set(t["run"].to_pylist()) == {path}
+        assert t.drop_columns(["run", "run_idx"]).to_pylist() == pdb.topFunctions().arrow().to_pylist()
+        h = results["heatmap"].filter(pc.equal(results["heatmap"]["run_idx"], i))
+        assert h.drop_columns(["run", "run_idx"]).to_pylist() == heatmapTable(pdb.getAnomalyHeatmap(0, 5), 0).to_pylist()
+    with pytest.raises(Exception, match="Unknown analysis"):
+        analyzeDatabases([db_path], ["noSuchAnalysis"])
+
+#The command line writes a single report, and reports the databases that could not be analyzed in its exit code
+def test_batch_cli(db_path, db_path2, tmp_path, capsys):
+    out = str(tmp_path / "report.json")
+    assert main([db_path, db_path2, "-o", out, "--analyses", "topFunctions,callStackSummaries", "--processes", "2"]) == 0
+    with open(out) as f:
+        report = json.load(f)
+    assert sorted(report) == ["callStackSummaries", "topFunctions"]
+    assert set( r["run"] for r in report["topFunctions"] ) == {db_path, db_path2}
+    n = len(ProvenanceDatabaseConnection().connect(db_path, quiet=True).topFunctions())
+    assert sum( r["run_idx"] == 0 for r in report["topFunctions"] ) == n
+
+    out = str(tmp_path / "report.parquet")
+    assert main([db_path, str(tmp_path / "missing.duckdb"), "-o", out, "--analyses", "heatmap", "--processes", "1"]) == 1
+    assert "missing.duckdb" in capsys.readouterr().err
+    import pyarrow.parquet
+    t = pyarrow.parquet.read_table(out)
+    assert set(t["analysis"].to_pylist()) == {"heatmap"} and set(t["run"].to_pylist()) == {db_path}
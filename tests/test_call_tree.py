@@ -0,0 +1,33 @@
+import numpy
+
+#Every call path prefix is a separate node, including those starting with function 0. The inclusive counts of every node are those
+#of its own events plus the inclusive counts of its children, and the counts of the roots add up to all labeled events of the program
+def test_call_tree_sums(pdb):
+    t = pdb.getCallTree(0).fetchnumpy()
+    node = dict( (n, i) for i, n in enumerate(t["node"]) )
+    assert len(node) == len(t["node"])
+    cols = [ ("anomaly_count", "self_anomaly_count"), ("normal_count", "self_normal_count"), ("accum_sev", "self_accum_sev") ]
+    children = { c : numpy.zeros(len(node)) for c, s in cols }
+    root = numpy.ma.getmaskarray(t["parent"])
+    assert numpy.array_equal(root, t["depth"] == 1)
+    for i, p in enumerate(t["parent"]):
+        if root[i]:
+            continue
+        j = node[int(p)]
+        assert t["depth"][i] == t["depth"][j] + 1
+        for c, s in cols:
+            children[c][j] += t[c][i]
+    for c, s in cols:
+        numpy.testing.assert_allclose(numpy.asarray(t[c], dtype=numpy.float64), numpy.asarray(t[s], dtype=numpy.float64) + children[c])
+
+    db = pdb.db_nm
+    for c, s, tab, v in [ ("anomaly_count", "self_anomaly_count", "anomalies", "COUNT(*)"), ("normal_count", "self_normal_count", "normal_execs", "COUNT(*)"),
+                          ("accum_sev", "self_accum_sev", "anomalies", "SUM(e.outlier_severity)") ]:
+        total = pdb("SELECT %s FROM %s.%s AS e INNER JOIN %s.call_stack_labels AS lb ON lb.event_id = e.event_id WHERE e.pid = 0" % (v, db, tab, db)).fetchone()[0]
+        assert numpy.isclose(numpy.sum(numpy.asarray(t[c])[root]), total)
+        assert numpy.isclose(numpy.sum(t[s]), total)
+
+    #Sorted by depth and descending inclusive severity, with the function names
+    key = numpy.lexsort((-numpy.asarray(t["accum_sev"]), t["depth"]))
+    assert numpy.array_equal(numpy.asarray(t["depth"])[key], t["depth"])
+    assert all( n == "func_%d" % f for n, f in zip(t["name"], t["fid"]) )
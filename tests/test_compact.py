@@ -0,0 +1,32 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+from chimbuko_offline_analysis.compact import compactTable, compactionReport, narrowestIntegerType
+
+def test_narrowest_integer_type():
+    assert narrowestIntegerType(pa, 0, 255) == pa.uint8()
+    assert narrowestIntegerType(pa, 0, 256) == pa.uint16()
+    assert narrowestIntegerType(pa, -128, 127) == pa.int8()
+    assert narrowestIntegerType(pa, -129, 0) == pa.int16()
+    assert narrowestIntegerType(pa, 0, 2**40) == pa.uint64()
+    assert narrowestIntegerType(pa, -1, 2**40) == pa.int64()
+
+#Repeated strings are dictionary encoded and integers narrowed, while unique ids are left plain, such that the result only shrinks
+def test_compact_sizes(pdb):
+    rel = pdb.getEventsNodeStatus(pdb("SELECT event_id FROM %s.anomalies" % pdb.db_nm))
+    plain = rel.arrow()
+    tab = pdb.getEventsNodeStatus(pdb("SELECT event_id FROM %s.anomalies" % pdb.db_nm), compact=True)
+    assert pa.types.is_string(tab.schema.field("event_id").type)
+    assert pa.types.is_dictionary(tab.schema.field("hostname").type)
+    assert tab.schema.field("pid").type == pa.uint8()
+    for c in ("event_id", "hostname"):
+        assert tab.column(c).nbytes <= plain.column(c).nbytes
+    rep = compactionReport(tab)
+    assert rep["bytes_before"] == plain.nbytes and rep["bytes_after"] == tab.nbytes and rep["ratio"] < 1
+    assert tab.to_pylist() == plain.to_pylist()
+
+    #All string columns are encoded with a threshold of 1
+    tab = compactTable(plain, max_distinct_fraction=1.0)
+    assert pa.types.is_dictionary(tab.schema.field("event_id").type)
+    tab = compactTable(plain, dictionary=False, downcast=False)
+    assert tab.schema == plain.schema.with_metadata(tab.schema.metadata)
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+#Each thread queries on its own cursor, which it keeps across calls
+def test_thread_cursors(con, pdb):
+    def cursors():
+        return con.cursor(), con.cursor(), threading.get_ident()
+    with ThreadPoolExecutor(4) as ex:
+        res = [ f.result() for f in [ ex.submit(cursors) for i in range(16) ] ]
+    for a, b, t in res:
+        assert a is b and a is not con.con
+    by_thread = dict( (t, a) for a, b, t in res )
+    assert len(set( id(c) for c in by_thread.values() )) == len(by_thread)
+    assert con.cursor() is con.con
+
+#Analyses run concurrently on several threads give the results of running them one after the other
+def test_concurrent_analyses(con, pdb):
+    calls = [ lambda: pdb.topFunctions('anom_count').fetchall(), lambda: pdb.getCallStackSummaries(0).fetchall(),
+              lambda: pdb.getApplicationProfile('exclusive').fetchall(), lambda: pdb.getCallStackLabelCounts().fetchall() ]
+    ref = [ c() for c in calls ]
+    with ThreadPoolExecutor(8) as ex:
+        fs = [ ex.submit(calls[i % len(calls)]) for i in range(32) ]
+        for i, f in enumerate(fs):
+            assert f.result() == ref[i % len(calls)]
+
+#The asynchronous variants return the results of the synchronous methods, as relations on the calling thread's cursor
+def test_async_methods(con, pdb, db_path2):
+    pytest.importorskip("pyarrow")
+    pdb2 = con.connect(db_path2, quiet=True)
+    fed = con.federate()
+
+    async def run():
+        return await asyncio.gather(pdb.topFunctions_async('anom_count'), pdb.getCallStackSummaries_async(0), pdb2.getRunStartTime_async(0, 1),
+                                    fed.topFunctions_async(limit=2))
+    top, summ, start, ftop = asyncio.run(run())
+    assert top.fetchall() == pdb.topFunctions('anom_count').fetchall()
+    assert summ.fetchall() == pdb.getCallStackSummaries(0).fetchall()
+    assert start == pdb2.getRunStartTime(0, 1)
+    assert ftop.fetchall() == fed.topFunctions(limit=2).fetchall()
+    with pytest.raises(AttributeError):
+        pdb.noSuchMethod_async
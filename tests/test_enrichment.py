@@ -0,0 +1,49 @@
+import numpy
+from collections import defaultdict
+
+#Reference computation of the exec window enrichment of the functions 'fids', in Python
+def referenceEnrichment(pdb, fids, pseudocount):
+    db = pdb.db_nm
+    ev = pdb("SELECT event_id, pid, fid, 1 AS anom FROM %s.anomalies UNION ALL SELECT event_id, pid, fid, 0 AS anom FROM %s.normal_execs" % (db, db)).fetchall()
+    win = defaultdict(list)
+    for eid, nfid, rt in pdb("SELECT ew.event_id, ewe.fid, ewe.runtime_exclusive FROM %s.exec_windows AS ew \
+INNER JOIN %s.exec_window_events AS ewe ON ewe.event_id = ew.exec_window_entry_id" % (db, db)).fetchall():
+        win[eid].append((nfid, rt))
+    tot = defaultdict(lambda: [0, 0])
+    events = defaultdict(lambda: [0, 0])
+    rt = defaultdict(lambda: [0.0, 0.0])
+    occ = defaultdict(lambda: [0, 0])
+    for eid, pid, fid, anom in ev:
+        if fid not in fids:
+            continue
+        tot[(pid, fid)][anom] += 1
+        for nfid in set( n for n, r in win[eid] ):
+            events[(pid, fid, nfid)][anom] += 1
+        for nfid, r in win[eid]:
+            rt[(pid, fid, nfid)][anom] += r
+            occ[(pid, fid, nfid)][anom] += 1
+    out = dict()
+    for k, (nn, na) in events.items():
+        tn, ta = tot[k[:2]]
+        out[k] = (na, nn, rt[k][1] / occ[k][1] if occ[k][1] > 0 else None, ((na + pseudocount) / (ta + pseudocount)) / ((nn + pseudocount) / (tn + pseudocount)))
+    return out
+
+#The neighbours of the functions of every program are counted separately, although the function indices of the programs overlap
+def test_exec_window_enrichment_multi_program(pdb_multi):
+    fids = [1, 4, 9]
+    r = pdb_multi.getExecWindowEnrichment(fids, pseudocount=0.5).fetchnumpy()
+    ref = referenceEnrichment(pdb_multi, fids, 0.5)
+    assert set(numpy.unique(r["pid"])) == {0, 1}
+    assert len(r["fid"]) == len(ref)
+    names = dict( ((p, f), n) for p, f, n in pdb_multi("SELECT pid, fid, name FROM %s.functions" % pdb_multi.db_nm).fetchall() )
+    for i in range(len(r["fid"])):
+        k = (r["pid"][i], r["fid"][i], r["neighbour_fid"][i])
+        na, nn, mean, enrichment = ref[k]
+        assert (r["anomaly_events"][i], r["normal_events"][i]) == (na, nn)
+        assert numpy.isclose(r["enrichment"][i], enrichment)
+        if mean is not None:
+            assert numpy.isclose(r["anomaly_mean_runtime_exclusive"][i], mean)
+        assert r["neighbour_name"][i] == names[(k[0], k[2])]
+    #Sorted by program, function and descending enrichment
+    key = numpy.lexsort((-r["enrichment"], r["fid"], r["pid"]))
+    assert numpy.array_equal(key, numpy.arange(len(key)))
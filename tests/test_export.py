@@ -0,0 +1,25 @@
+import os
+import pytest
+
+#The exported dataset holds the selected events, partitioned into directories, with the times since the start of the run
+def test_export_events_to_parquet(pdb, tmp_path):
+    path = str(tmp_path / "events")
+    assert pdb.exportEventsToParquet(path, "both", fids=[1, 2]) == path
+    assert sorted(os.listdir(path)) == ["pid=0"]
+    assert sorted(os.listdir(os.path.join(path, "pid=0"))) == [ "rid=%d" % r for r in range(4) ]
+    assert sorted(os.listdir(os.path.join(path, "pid=0", "rid=0"))) == ["fid=1", "fid=2"]
+
+    exported = pdb("SELECT * FROM read_parquet('%s/**/*.parquet', hive_partitioning = true)" % path)
+    for etype in ["anomalies", "normal_execs"]:
+        got = exported.filter("event_type = '%s'" % etype)
+        n = pdb("SELECT COUNT(*) FROM %s.%s WHERE fid IN (1, 2)" % (pdb.db_nm, etype)).fetchone()[0]
+        assert len(got) == n
+        ref = pdb.getFunctionEvents(1, etype).project("event_id, entry_s, exit_s").order("event_id").fetchall()
+        assert got.filter("fid = 1").project("event_id, entry_s, exit_s").order("event_id").fetchall() == ref
+
+    #Files are only written into an existing directory if requested
+    with pytest.raises(Exception):
+        pdb.exportEventsToParquet(path, "anomalies", fids=[1])
+    pdb.exportEventsToParquet(path, "anomalies", fids=[3], partition_by=("fid",), overwrite=True)
+    n = pdb("SELECT COUNT(*) FROM %s.anomalies WHERE fid = 3" % pdb.db_nm).fetchone()[0]
+    assert pdb("SELECT COUNT(*) FROM read_parquet('%s/fid=3/*.parquet')" % path).fetchone()[0] == n
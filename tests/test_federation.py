@@ -0,0 +1,29 @@
+import numpy
+
+#Rows of a relation as sorted tuples, with the floating point values rounded such that sums in different orders compare equal
+def rows(rel):
+    return sorted( tuple(round(v, 6) if isinstance(v, float) else v for v in r) for r in rel.fetchall() )
+
+#The analyses of a federation give, for every run, the results of the analysis of that run alone
+def test_federation(con, db_path, db_path2):
+    pdbs = [ con.connect(db_path, quiet=True), con.connect(db_path2, quiet=True) ]
+    runs = ["a", "b"]
+    fed = con.federate(runs=runs)
+    for run, pdb in zip(runs, pdbs):
+        sel = lambda rel: rel.filter("run = '%s'" % run)
+        t = sel(fed.topFunctions('anom_count'))
+        assert rows(t.project(", ".join(pdb.topFunctions().columns))) == rows(pdb.topFunctions('anom_count'))
+        assert [ r[0] for r in t.project("rank").fetchall() ] == list(range(1, len(t) + 1))
+        assert len(sel(fed.topFunctions(limit=3))) == 3
+        p = sel(fed.getApplicationProfile('exclusive'))
+        assert rows(p.project(", ".join(pdb.getApplicationProfile('exclusive').columns))) == rows(pdb.getApplicationProfile('exclusive'))
+        s = sel(fed.getCallStackSummaries(0))
+        assert rows(s.project(", ".join(pdb.getCallStackSummaries(0).columns))) == rows(pdb.getCallStackSummaries(0))
+        n = fed("SELECT COUNT(*) FROM %s WHERE run = '%s'" % (fed.anomalies.get_sql(), run)).fetchone()[0]
+        assert n == pdb("SELECT COUNT(*) FROM %s" % pdb.anomalies.get_sql()).fetchone()[0]
+
+    #The views and tables of the federation are dropped by close
+    names = [ v.get_table_name() for v in fed._views.values() ]
+    fed.close()
+    left = con("SELECT view_name FROM duckdb_views() UNION ALL SELECT table_name FROM duckdb_tables() WHERE database_name = 'memory'").fetchnumpy()
+    assert len(set(names) & set(numpy.concatenate(list(left.values())))) == 0
@@ -0,0 +1,26 @@
+import numpy
+
+#The anomalies are counted in the (rank, time bin) of their exit time
+def test_anomaly_heatmap_counts(pdb):
+    nbins = 7
+    hm = pdb.getAnomalyHeatmap(0, nbins=nbins)
+    assert hm["count"].shape == hm["severity"].shape == (4, nbins) and len(hm["edges"]) == nbins + 1
+    width = hm["edges"][1]
+    for rid in hm["rid"]:
+        times = pdb.getAnomalyTimes(0, rid)
+        b = numpy.clip(numpy.floor(times / width), 0, nbins - 1).astype(numpy.int64)
+        assert numpy.array_equal(hm["count"][rid], numpy.bincount(b, minlength=nbins))
+    total, sev = pdb("SELECT COUNT(*), SUM(outlier_severity) FROM %s.anomalies WHERE pid = 0" % pdb.db_nm).fetchone()
+    assert hm["count"].sum() == total and numpy.isclose(hm["severity"].sum(), sev)
+
+    #Per function, and restricted to some functions
+    byf = pdb.getAnomalyHeatmap(0, nbins=nbins, by_function=True)
+    assert numpy.array_equal(byf["count"].sum(axis=0), hm["count"])
+    i = list(byf["fid"]).index(3)
+    sub = pdb.getAnomalyHeatmap(0, nbins=nbins, fid=[3])
+    assert numpy.array_equal(sub["count"], byf["count"][i])
+    numpy.testing.assert_allclose(sub["severity"], byf["severity"][i])
+
+    #Anomalies beyond tmax are placed in the last bin
+    clipped = pdb.getAnomalyHeatmap(0, nbins=2, tmax=1e-9)
+    assert clipped["count"][:, 0].sum() == 0 and clipped["count"].sum() == total
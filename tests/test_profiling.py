@@ -0,0 +1,38 @@
+import pytest
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+
+pytest.importorskip("pyarrow")
+
+#Every statement issued by the package is recorded, including those creating intermediate tables and views
+def test_profiler_records_statements(con, db_path, tmp_path):
+    prof = con.enableProfiling()
+    pdb = con.connect(db_path, quiet=True)
+    pdb.getCallStackLabelCounts().fetchall()
+    pdb.runStartTimes()
+    pdb.exportEventsToParquet(str(tmp_path / "events"), "anomalies", fids=[1])
+    with pdb.scope(rids=[0]) as s:
+        s.topFunctions().fetchall()
+    pdb.rescoreEvents(0.5, "anomalies", fids=[1])
+    sqls = [ " ".join(r.sql.split()) for r in prof.records ]
+    #The API method called from the test, at the start of the chain of methods that issued the statement
+    entry = { " ".join(r.sql.split()) : r.path[0] for r in prof.records }
+    def find(prefix, contains):
+        m = [ q for q in sqls if q.startswith(prefix) and contains in q ]
+        assert len(m) > 0, (prefix, contains)
+        return entry[m[0]]
+    assert sqls[0].startswith("ATTACH")
+    assert find("CREATE OR REPLACE TABLE", "__call_stack_label_counts") == "ProvenanceDatabase.getCallStackLabelCounts"
+    assert find("SELECT", "__run_start_") == "ProvenanceDatabase.runStartTimes"
+    assert find("COPY", "anomalies") == "ProvenanceDatabase.exportEventsToParquet"
+    assert find("CREATE OR REPLACE VIEW", s.name) == "ProvenanceDatabase.topFunctions"
+    assert find("CREATE OR REPLACE TABLE", s.name + "_func_anomaly_severity_stats") == "ProvenanceDatabase.topFunctions"
+    assert find("DROP VIEW", s.name) == "ScopedProvenanceDatabase.close"
+    assert find("INSERT INTO", "__rescored") == "ProvenanceDatabase.rescoreEvents"
+
+def test_profiler_records_summary_store(db_path, tmp_path):
+    con = ProvenanceDatabaseConnection()
+    prof = con.enableProfiling()
+    pdb = con.connect(db_path, quiet=True, summaries=str(tmp_path / "summaries.duckdb"))
+    pdb.topFunctions().fetchall()
+    assert any( r.sql.startswith('CREATE TABLE %s."top_functions"' % pdb.summaries.db_nm) and r.path[0] == "ProvenanceDatabase.topFunctions"
+                for r in prof.records )
@@ -0,0 +1,55 @@
+import pytest
+import duckdb
+
+pytest.importorskip("pyarrow")
+
+#Small results are cached and served from the cache on repeated queries
+def test_cache_hit(con, pdb):
+    cache = con.enableCache()
+    sql = "SELECT fid, COUNT(*) AS n FROM %s.anomalies GROUP BY fid ORDER BY fid" % pdb.db_nm
+    a = con(sql).fetchall()
+    b = con(sql).fetchall()
+    assert a == b == con(sql, cache=False).fetchall()
+    st = cache.stats()
+    assert (st["entries"], st["hits"], st["misses"]) == (1, 1, 1)
+    assert 0 < st["bytes"] <= st["max_bytes"]
+
+#Results larger than the budget are neither cached nor materialized, but returned as a lazy relation
+def test_cache_oversized(con, pdb):
+    cache = con.enableCache(max_bytes=4096)
+    cache.batch_rows = 64
+    sql = "SELECT * FROM %s.normal_execs ORDER BY event_id" % pdb.db_nm
+    rel = con(sql)
+    assert isinstance(rel, duckdb.DuckDBPyRelation)
+    assert rel.limit(5).fetchall() == con(sql, cache=False).limit(5).fetchall()
+    assert rel.count("*").fetchone() == con(sql, cache=False).count("*").fetchone()
+    st = cache.stats()
+    assert (st["entries"], st["bytes"], st["bypassed"]) == (0, 0, 1)
+
+#Queries on the in-memory summary tables and scope views of the package are cached, and the in-memory catalog is only listed
+#again after a statement other than a query
+def test_cache_package_relations(con, pdb):
+    cache = con.enableCache()
+    for i in range(2):
+        a = pdb.topFunctions().fetchall()
+        b = pdb.getFunctionEvents(1, "anomalies").fetchall()
+        c = pdb("SELECT * FROM %s.functions JOIN %s.anomalies USING (pid, fid) ORDER BY event_id" % (pdb.db_nm, pdb.db_nm)).fetchall()
+    st = cache.stats()
+    assert st["bypassed"] == 0 and st["hits"] == st["misses"] == 3
+    assert a == pdb.topFunctions().fetchall() and b == pdb.getFunctionEvents(1, "anomalies").fetchall()
+    listed = cache._mutable
+    pdb.topFunctions().fetchall()
+    assert cache._mutable is listed
+
+    #A table created through the connection is mutable, queries on it are not cached
+    con("CREATE TABLE my_functions AS SELECT * FROM %s.functions" % pdb.db_nm, cache=False)
+    con("SELECT * FROM my_functions JOIN %s.anomalies USING (pid, fid)" % pdb.db_nm).fetchall()
+    assert cache._mutable is not listed
+    assert cache.stats()["bypassed"] == 1
+
+    #The cached results of queries on the views of a scope are dropped with the scope
+    s = pdb.scope(rids=[0])
+    s.topFunctions().fetchall()
+    n = cache.stats()["entries"]
+    s.close()
+    assert cache.stats()["entries"] < n
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+
+#The models of a database with several programs are keyed by (pid, fid)
+def test_models_multi_program(pdb_multi):
+    models = pdb_multi.loadADModels()
+    fids = pdb_multi("SELECT DISTINCT fid FROM %s.ad_models ORDER BY fid" % pdb_multi.db_nm).fetchnumpy()['fid']
+    for pid in (0, 1):
+        ref_edges, ref_counts = pdb_multi.getFunctionADmodelHistograms(fids, pid=pid)
+        for fid, e, c in zip(fids, ref_edges, ref_counts):
+            edges, counts = models.histogram(fid, pid=pid)
+            assert numpy.allclose(edges, e) and numpy.array_equal(counts, c)
+    with pytest.raises(Exception, match="several programs"):
+        models.histogram(fids[0])
+    assert numpy.all(models.modelIndex(fids, pid=2) == -1)
+
+#Every execution is scored against the model of its own program
+def test_rescore_multi_program(pdb_multi):
+    pytest.importorskip("pyarrow")
+    models = pdb_multi.loadADModels()
+    rescored = pdb_multi.rescoreEvents(-1.0, etype="both")
+    r = pdb_multi("SELECT pid, fid, runtime_exclusive, score FROM %s" % rescored.get_sql()).fetchnumpy()
+    n = pdb_multi("SELECT (SELECT COUNT(*) FROM %s.anomalies) + (SELECT COUNT(*) FROM %s.normal_execs)" % (pdb_multi.db_nm, pdb_multi.db_nm)).fetchone()[0]
+    assert len(r['score']) == n
+    for pid in (0, 1):
+        sel = r['pid'] == pid
+        ref = numpy.empty(numpy.sum(sel))
+        for i, (fid, x) in enumerate(zip(r['fid'][sel], r['runtime_exclusive'][sel])):
+            m = models.modelIndex([fid], pid=pid)[0]
+            assert models.pid[m] == pid and models.fid[m] == fid
+            counts = models.counts[models.offsets[m]:models.offsets[m+1]]
+            b = int(numpy.floor((x - models.first_edge[m]) / models.bin_width[m]))
+            ref[i] = -numpy.log2((counts[b] / counts.sum() if 0 <= b < len(counts) else 0.0) + 1e-32)
+        assert numpy.allclose(r['score'][sel], ref)
+
+    #All executions are re-scored as anomalies, hence every recorded anomaly is retained in the group of its own program
+    cmp = pdb_multi.compareAnomalySets(rescored).fetchnumpy()
+    ref = pdb_multi("SELECT pid, fid, COUNT(*) AS n FROM %s.anomalies GROUP BY pid, fid ORDER BY pid, fid" % pdb_multi.db_nm).fetchnumpy()
+    rec = cmp['recorded'] > 0
+    assert numpy.array_equal(cmp['pid'][rec], ref['pid']) and numpy.array_equal(cmp['fid'][rec], ref['fid'])
+    assert numpy.array_equal(cmp['recorded'][rec], ref['n']) and numpy.array_equal(cmp['retained'], cmp['recorded'])
+    assert numpy.sum(cmp['rescored']) == n and numpy.all(cmp['dropped'] == 0)
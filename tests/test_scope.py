@@ -0,0 +1,48 @@
+import numpy
+import pytest
+from test_accessors import ref
+
+#Scoped handles, on which all analysis methods operate only on the events within the scope
+
+def test_scoped_events(pdb):
+    s = pdb.scope(rids=[1, 2], io_steps=(2, 5))
+    n = ref(pdb, "SELECT COUNT(*) FROM {db}.anomalies WHERE rid IN (1, 2) AND io_step BETWEEN 2 AND 5").fetchone()[0]
+    assert s("SELECT COUNT(*) FROM %s" % s.anomalies.get_sql()).fetchone()[0] == n
+    assert int(s.topFunctions('anom_count').fetchnumpy()["anomalies"].sum()) == n
+    assert sorted(ref(pdb, "SELECT DISTINCT io_step FROM %s" % s.io_steps.get_sql()).fetchnumpy()["io_step"]) == [2, 3, 4, 5]
+
+def test_scoped_heatmap(pdb):
+    s = pdb.scope(rids=[1, 2], io_steps=(2, 5))
+    h = s.getAnomalyHeatmap(0, nbins=10)
+    full = pdb.getAnomalyHeatmap(0, nbins=10, tmax=h["edges"][-1])
+    assert h["count"].sum() == ref(pdb, "SELECT COUNT(*) FROM {db}.anomalies WHERE rid IN (1, 2) AND io_step BETWEEN 2 AND 5").fetchone()[0]
+    assert h["count"][[0, 3]].sum() == 0
+    assert numpy.all(h["count"] <= full["count"])
+    #The time range ends with the last io step of the scope
+    tend = ref(pdb, "SELECT MAX(io_step_tend) FROM {db}.io_steps WHERE rid IN (1, 2) AND io_step <= 5").fetchone()[0]
+    assert h["edges"][-1] <= (tend - min(pdb.getRunStartTime(0, r) for r in [1, 2]))/1e6
+
+def test_scoped_time_conversion(pdb):
+    s = pdb.scope(rids=[1], time=(2.0, 4.0))
+    start = pdb.getRunStartTime(0, 1)
+    numpy.testing.assert_allclose(s.toSecondsSinceStart(0, 1, [start + 3000000]), [3.0])
+    ex = ref(pdb, "SELECT exit FROM {db}.anomalies WHERE rid = 1 AND exit >= %d AND entry <= %d" % (start + 2000000, start + 4000000)).fetchnumpy()["exit"]
+    assert len(ex) > 0
+    numpy.testing.assert_allclose(numpy.sort(s.getAnomalyTimes(0, 1)), numpy.sort((ex - start)/1e6))
+
+def scopeObjects(pdb, s):
+    return ref(pdb, "SELECT view_name AS name FROM duckdb_views() WHERE view_name LIKE '%%%s%%' UNION ALL \
+SELECT table_name FROM duckdb_tables() WHERE table_name LIKE '%%%s%%'" % (s.name, s.name)).fetchall()
+
+def test_scope_close(pdb):
+    with pdb.scope(rids=[1], io_steps=(2, 5)) as s:
+        s.topFunctions().fetchall()
+        s.getCallStackLabelCounts().fetchall()
+        s.getAnomalyHeatmap(0, nbins=10)
+        assert len(scopeObjects(pdb, s)) > 0
+    assert scopeObjects(pdb, s) == []
+    with pytest.raises(Exception, match="closed"):
+        s.topFunctions()
+    s.close()
+    #The full database is unaffected
+    pdb.topFunctions().fetchall()
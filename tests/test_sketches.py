@@ -0,0 +1,64 @@
+import numpy
+import pytest
+from chimbuko_offline_analysis.sketches import QuantileSketchSet
+
+#The exclusive runtimes of every function of the run, as { (pid, name) : sorted array }
+def runtimes(pdb):
+    r = pdb("SELECT e.pid, f.name, e.runtime_exclusive FROM (SELECT pid, fid, runtime_exclusive FROM %s.anomalies UNION ALL \
+SELECT pid, fid, runtime_exclusive FROM %s.normal_execs) AS e INNER JOIN %s.functions AS f ON f.pid = e.pid AND f.fid = e.fid" % (
+        pdb.db_nm, pdb.db_nm, pdb.db_nm)).fetchnumpy()
+    out = dict()
+    for k in set(zip(r["pid"], r["name"])):
+        out[k] = numpy.sort(r["runtime_exclusive"][(r["pid"] == k[0]) & (r["name"] == k[1])].astype(numpy.float64))
+    return out
+
+#The quantiles of the sketches are within the relative accuracy of the exact quantiles
+def test_sketch_quantiles(pdb):
+    alpha = 0.01
+    s = pdb.runtimeSketches(alpha=alpha)
+    rt = runtimes(pdb)
+    assert len(s) == len(rt)
+    q = s.quantiles([0.1, 0.5, 0.99])
+    for i, k in enumerate(s.keyTuples()):
+        x = rt[k]
+        assert s.total[i] == len(x)
+        exact = x[numpy.floor(numpy.array([0.1, 0.5, 0.99]) * (len(x) - 1)).astype(numpy.int64)]
+        assert numpy.all(numpy.abs(q[i] - exact) <= alpha * exact * (1 + 1e-9) + (exact <= 1))
+
+#The arrays (pid, fid, name, bucket, count) of the sketches of the runtimes scaled by 'factor'
+def build(keys, rt, factor):
+    gamma = 1.01 / 0.99
+    cols = [ [], [], [], [], [] ]
+    for i, (pid, name) in enumerate(keys):
+        x = rt[(pid, name)] * factor
+        b = numpy.where(x <= 1, 0, numpy.ceil(numpy.log(numpy.maximum(x, 1)) / numpy.log(gamma))).astype(numpy.int64)
+        u, n = numpy.unique(b, return_counts=True)
+        for v, a in zip(cols, [ [pid] * len(u), [i] * len(u), [name] * len(u), u, n ]):
+            v.extend(a)
+    return cols
+
+#A run compared with itself has no distance, and with a run of twice the runtimes a shift of log(2)
+def test_sketch_comparison(pdb, tmp_path):
+    c = pdb.compareRuntimeDistributions(pdb)
+    assert len(c["score"]) > 0
+    assert numpy.all(c["ks"] == 0) and numpy.all(c["score"] == 0) and numpy.all(c["shift"] == 0)
+
+    rt = runtimes(pdb)
+    keys = sorted(rt)
+    make = lambda f: QuantileSketchSet(0.01, *build(keys, rt, f))
+    base, slow = make(1.0), make(2.0)
+    c = base.compare(slow)
+    assert len(c["score"]) == len(keys)
+    numpy.testing.assert_allclose(c["shift"], numpy.log(2), atol=0.03)
+    numpy.testing.assert_allclose(c["score"], numpy.log(2), atol=0.03)
+    assert numpy.all(c["p50_candidate"] > c["p50"])
+    assert numpy.all(numpy.diff(c["score"]) <= 0)
+
+    #Merging a set with itself doubles the counts and keeps the quantiles; a saved set loads back unchanged
+    m = base.merge(base)
+    assert numpy.array_equal(m.total, 2 * base.total)
+    numpy.testing.assert_allclose(m.quantiles([0.5]), base.quantiles([0.5]))
+    loaded = QuantileSketchSet.load(base.save(str(tmp_path / "sketches.npz")))
+    assert loaded.keyTuples() == base.keyTuples() and numpy.array_equal(loaded.counts, base.counts)
+    with pytest.raises(Exception, match="relative accuracy"):
+        base.compare(pdb.runtimeSketches(alpha=0.02))
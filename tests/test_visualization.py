@@ -0,0 +1,69 @@
+import numpy
+import pytest
+import duckdb
+from chimbuko_offline_analysis import ProvenanceDatabaseConnection
+from chimbuko_offline_analysis.synthetic import generateProvenanceDatabase
+from chimbuko_offline_analysis.visualization.parallel_coords.parallel_coords import anomalySelectionQuery, AnomalySummary
+
+#The stratified samples of the anomalies have at most the requested size, allocated over the strata
+@pytest.mark.parametrize("sample", [1, 10, 57, 10000])
+def test_rank_function_sample(pdb, sample):
+    r = pdb(anomalySelectionQuery(pdb, sample=sample, stratify="rank_function")).fetchnumpy()
+    total = pdb("SELECT COUNT(*) FROM %s" % pdb.anomalies.get_sql()).fetchone()[0]
+    assert len(r["event_id"]) == min(sample, total)
+    assert len(numpy.unique(r["event_id"])) == len(r["event_id"])
+    #Each stratum has its quota rounded down or up
+    n = pdb("SELECT pid, rid, fid, COUNT(*) AS n FROM %s GROUP BY ALL" % pdb.anomalies.get_sql()).fetchall()
+    got = {}
+    for k in zip(r["pid"], r["rid"], r["fid"]):
+        got[k] = got.get(k, 0) + 1
+    for p, q, f, c in n:
+        quota = min(sample, total) * c / total
+        assert numpy.floor(quota) <= got.get((p, q, f), 0) <= numpy.ceil(quota)
+
+@pytest.mark.parametrize("sample", [1, 10, 57, 10000])
+def test_severity_sample(pdb, sample):
+    r = pdb(anomalySelectionQuery(pdb, sample=sample, stratify="severity", nstrata=10)).fetchnumpy()
+    total = pdb("SELECT COUNT(*) FROM %s" % pdb.anomalies.get_sql()).fetchone()[0]
+    assert len(r["event_id"]) == min(sample, total)
+
+#The anomalies are selected among those with a node state record, as the chart shows their memory usage
+def test_anomaly_summary_node_state(tmp_path):
+    path = generateProvenanceDatabase(str(tmp_path / "run.duckdb"), nrank=2, nfunc=10, nevent=2000, anomaly_frac=0.05, nstep=5)
+    con = duckdb.connect(path)
+    con.sql("DELETE FROM node_state WHERE event_id IN (SELECT event_id FROM anomalies ORDER BY outlier_severity DESC LIMIT 5)")
+    expect = con.sql("SELECT a.outlier_severity FROM anomalies AS a INNER JOIN node_state AS n ON n.event_id = a.event_id \
+ORDER BY a.outlier_severity DESC LIMIT 10").fetchnumpy()["outlier_severity"]
+    con.close()
+    pdb = ProvenanceDatabaseConnection().connect(path, quiet=True)
+    fig = AnomalySummary(pdb, topn=10, show=False)
+    numpy.testing.assert_allclose(numpy.sort(fig.data[0].dimensions[3].values)[::-1], expect)
+    fig = AnomalySummary(pdb, sample=20, stratify="rank_function", show=False)
+    assert len(fig.data[0].dimensions[0].values) == 20
+
+#The intermediate views of the comparison are dropped once the chart is built
+def test_call_stack_comparison_views(con, pdb, db_path2):
+    from chimbuko_offline_analysis.visualization.lollipop.lollipop import CallStackSummariesComparison
+    pdb2 = con.connect(db_path2, quiet=True)
+    for i in range(3):
+        fig = CallStackSummariesComparison(pdb, pdb2, limit=5, show=False)
+    assert len(fig.data) > 0
+    assert con("SELECT COUNT(*) FROM duckdb_views() WHERE view_name LIKE '%CallStackSummariesComparison%'").fetchone()[0] == 0
+
+#A chart that is shown is shown once and not returned, such that it is not rendered again as the output of a Jupyter cell; with
+#show=False the figure is returned without being shown
+def test_chart_show(pdb, db_path2, monkeypatch):
+    import plotly.io as pio
+    from chimbuko_offline_analysis import visualization
+    from chimbuko_offline_analysis.visualization.lollipop.lollipop import CallStackSummariesComparison
+    shown = []
+    monkeypatch.setattr(pio, "show", lambda fig, renderer=None: shown.append(fig))
+    monkeypatch.setattr(visualization.rendering, "_renderer", "json")
+    pdb2 = pdb.pdb_con.connect(db_path2, quiet=True)
+    for chart in [ lambda show: AnomalySummary(pdb, show=show), lambda show: AnomalySummary(pdb, topn=None, density=True, show=show),
+                   lambda show: CallStackSummariesComparison(pdb, pdb2, limit=5, show=show) ]:
+        n = len(shown)
+        assert chart(True) is None
+        assert len(shown) == n + 1
+        fig = chart(False)
+        assert fig is not None and len(fig.data) > 0 and len(shown) == n + 1